@@ -17,7 +17,9 @@ Key Features:
 Routes:
 - Home, Login, and Logout routes for user authentication and session management.
 - Profile, Admin, and Newsfeed routes for user-specific and admin-specific interactions.
+- A Prometheus-style /metrics endpoint with per-route timings, for admins.
 - API endpoints for liking/disliking news stories, managing user accounts, and managing news items.
+- A JSON /comments/<story_id> endpoint serving a story's stored comment thread.
 
 The application uses Flask as its web framework, SQLite for database operations, and OAuth for
 authentication.
@@ -25,17 +27,44 @@ authentication.
 
 
 import json
-import sqlite3
+import re
+import time
+from functools import lru_cache
 from urllib.parse import quote_plus, urlencode
 from os import environ as env
 import math
 
 from authlib.integrations.flask_client import OAuth
 from dotenv import find_dotenv, load_dotenv
-from flask import Flask, redirect, render_template, session, url_for, jsonify, request
-from login import login_required, admin_required
+from flask import Flask, abort, redirect, render_template, session, url_for, jsonify, request
+from flask import stream_with_context
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from db import bump_data_version, configured_path, connect, data_version, database_path, get_db
+from db import init_app as init_db
+from feeds import FEEDS
+from login import login_required, admin_required, invalidate_admin_cache, is_admin
+from metrics import METRICS_CONTENT_TYPE, render_gauges, render_metrics
+from metrics import init_app as init_metrics
+from sqltrace import init_app as init_sql_trace
+from news import COMMENTS_DEFAULT_LIMIT, COMMENTS_MAX_DEPTH, COMMENTS_MAX_LIMIT, ITEMS_PER_PAGE
+from news import build_newsfeed, count_news_items, get_comment_thread, get_last_fetch_run
+from news import get_news_page, next_newsfeed_cursor, parse_newsfeed_args, stream_newsfeed
+from votes import VoteQueue, cast_vote, exit_on_sigterm
+
+# Number of rendered /news story lists kept in memory
+NEWS_FRAGMENT_CACHE_SIZE = 64
+
+# Votes joined with their stories, in the column order of the old story_likes table
+STORY_LIKES_COLUMNS = (
+    "story_likes.story_id, user_email, liked, disliked, "
+    "by, score, time, title, url, descendants, type, text"
+)
+STORY_LIKES_JOIN = "story_likes LEFT JOIN stories ON stories.id = story_likes.story_id"
 
-ITEMS_PER_PAGE = 10
+# Placeholder left in cached story lists for a vote count or the card's vote class
+VOTE_MARKER = "@@vote:{kind}:{story_id}@@"
+VOTE_MARKER_RE = re.compile(r"@@vote:(like|dislike|class):(-?\d+)@@")
 
 ENV_FILE = find_dotenv()
 if ENV_FILE:
@@ -43,6 +72,9 @@ if ENV_FILE:
 
 app = Flask(__name__, template_folder="templates")
 app.secret_key = env.get("APP_SECRET_KEY")
+init_db(app)
+init_metrics(app)
+init_sql_trace(app)
 
 oauth = OAuth(app)
 
@@ -56,6 +88,13 @@ oauth.register(
     server_metadata_url=f'https://{env.get("AUTH0_DOMAIN")}/.well-known/openid-configuration',
 )
 
+# Buffer votes and write them in batches instead of one transaction per vote
+app.config.setdefault("VOTE_WRITE_BEHIND", env.get("VOTE_WRITE_BEHIND") == "1")
+vote_queue = VoteQueue(lambda: connect(database_path(app.config["DATABASE"])))
+if app.config["VOTE_WRITE_BEHIND"]:
+    # So that stopping the server writes the buffered votes too
+    exit_on_sigterm()
+
 
 @app.route("/login")
 def login():
@@ -116,9 +155,9 @@ def insert_user_into_db(data):
 
     Checks if the user already exists in the database to avoid duplicates.
     Extracts user information from the session and inserts it into the 'users' table.
-    Commits changes to the database and closes the connection.
+    Commits changes to the database.
     """
-    connection = sqlite3.connect("stories.db")
+    connection = get_db()
     cursor = connection.cursor()
 
     # Check if the user already exists in the table
@@ -145,7 +184,6 @@ def insert_user_into_db(data):
         )
 
     connection.commit()
-    connection.close()
 
 
 @app.route("/logout")
@@ -217,12 +255,15 @@ def profile():
     user_info = session.get("user", {}).get("userinfo", {})
     user_email = user_info.get("email")
 
-    # Connect to the database.
-    connection = sqlite3.connect("stories.db")
+    # Get the database connection.
+    connection = get_db()
     cursor = connection.cursor()
 
     # Retrieve liked stories by the user
-    cursor.execute("SELECT * FROM story_likes WHERE user_email = ?", (user_email,))
+    cursor.execute(
+        f"SELECT {STORY_LIKES_COLUMNS} FROM {STORY_LIKES_JOIN} WHERE user_email = ?",
+        (user_email,),
+    )
     liked_stories = cursor.fetchall()
 
     # Convert the results to a list of dictionaries.
@@ -244,9 +285,6 @@ def profile():
             }
         )
 
-    # Close the database connection.
-    connection.close()
-
     # Render the profile template with the liked stories
     return render_template("profile.html", user_info=user_info, liked_feed=liked_feed)
 
@@ -264,6 +302,55 @@ def admin():
     return render_template("admin.html")
 
 
+@app.route("/metrics")
+@login_required
+@admin_required
+def metrics():
+    """
+    Serves per-endpoint latency, DB time, render time, query count and response size
+    histograms in the Prometheus text format.
+
+    Also reports how fresh the news data is, from the latest successful fetch run
+    ("the last fetch" below).
+
+    Only accessible by users with admin privileges.
+    """
+    body = render_metrics()
+    last_fetch = get_last_fetch_run(get_db().cursor())
+    if last_fetch is not None:
+        finished_at = last_fetch["finished_at"]
+        body += render_gauges(
+            [
+                (
+                    "news_last_fetch_timestamp_seconds",
+                    "When the last fetch finished.",
+                    finished_at,
+                ),
+                (
+                    "news_data_age_seconds",
+                    "Seconds since the last fetch.",
+                    time.time() - finished_at,
+                ),
+                (
+                    "news_last_fetch_duration_seconds",
+                    "Duration of the last fetch.",
+                    finished_at - last_fetch["started_at"],
+                ),
+                (
+                    "news_last_fetch_items_fetched",
+                    "Items the last fetch got.",
+                    last_fetch["items_fetched"],
+                ),
+                (
+                    "news_last_fetch_items_failed",
+                    "Items the last fetch missed.",
+                    last_fetch["items_failed"],
+                ),
+            ]
+        )
+    return body, 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+
 @app.route("/admin/items")
 @login_required
 @admin_required
@@ -275,10 +362,10 @@ def admin_items():
     Converts the results into a list of dictionaries for rendering.
     Returns a rendered HTML template for the admin items management page.
     """
-    connection = sqlite3.connect("stories.db")
+    connection = get_db()
     cursor = connection.cursor()
     # Fetch all liked/disliked stories for admin view
-    cursor.execute("SELECT * FROM story_likes")
+    cursor.execute(f"SELECT {STORY_LIKES_COLUMNS} FROM {STORY_LIKES_JOIN}")
     stories = cursor.fetchall()
 
     # Convert the results to a list of dictionaries.
@@ -301,9 +388,6 @@ def admin_items():
             }
         )
 
-    # Close the database connection.
-    connection.close()
-
     # Render the admin template with the stories feed
     return render_template("admin_items.html", stories_feed=stories_feed)
 
@@ -318,7 +402,7 @@ def admin_users():
     Fetches all users from the database and presents them in a list.
     Returns a rendered HTML template for managing users from the admin perspective.
     """
-    connection = sqlite3.connect("stories.db")
+    connection = get_db()
     cursor = connection.cursor()
     # Fetch all users from the database
     cursor.execute("SELECT * FROM users")
@@ -326,7 +410,6 @@ def admin_users():
     user_list = []
     for user in users:
         user_list.append({"email": user[1], "name": user[2]})
-    connection.close()
 
     return render_template("admin_users.html", users=user_list)
 
@@ -342,21 +425,18 @@ def admin_news():
     Fetches news items from the database based on the current page.
     Returns a rendered HTML template for managing news items.
     """
-    connection = sqlite3.connect("stories.db")
+    connection = get_db()
     cursor = connection.cursor()
 
     page = request.args.get("page", 1, type=int)
-    start_index = (page - 1) * ITEMS_PER_PAGE
-    end_index = start_index + ITEMS_PER_PAGE
 
     # Fetch news items for the current page
-    cursor.execute("SELECT * FROM new_stories")
-    results = cursor.fetchall()
+    results = get_news_page(cursor, page)
+    vote_counts = get_likes_dislikes_batch(cursor, [item[1] for item in results])
 
     news_feed = []
-    for item in results[start_index:end_index]:
-        item_id = item[1]
-        like_count, dislike_count = get_likes_dislikes_db(item_id)
+    for item in results:
+        like_count, dislike_count = vote_counts[item[1]]
         news_feed.append(
             {
                 "by": item[0],
@@ -373,9 +453,8 @@ def admin_news():
             }
         )
 
-    total_pages = math.ceil(len(results) / ITEMS_PER_PAGE)
+    total_pages = math.ceil(count_news_items(cursor) / ITEMS_PER_PAGE)
 
-    connection.close()
     return render_template(
         "admin_news.html",
         news_feed=news_feed,
@@ -387,46 +466,103 @@ def admin_news():
 @app.route("/newsfeed", methods=["GET", "POST"])
 def news():
     """
-    Retrieves the most recent news items from the database and returns them as JSON.
+    Retrieves news items from the database and returns them as JSON.
+
+    Query parameters:
+    - feed: one of top (default), new, best, ask, show and job.
+    - page: 1-based page number, or
+    - cursor: continue after the last item of a previous response (see the Link header).
+    - limit: items per page; defaults to 30, at most 500 for JSON.
+    - fields: comma-separated fields to return, e.g. "id,title,url".
+    - format: "json" (default) for a compact JSON list, or "ndjson" to stream one JSON
+      object per line. NDJSON without a limit streams the whole feed.
+
+    The response only changes when the news data does, so it carries a strong ETag and
+    Last-Modified header derived from the data version stamp. Conditional requests for
+    an unchanged version are answered with 304 Not Modified without touching the
+    database, and JSON bodies are cached per data version and query.
+    When more items follow, a Link header with rel="next" points at the next page.
+    """
+    db_path = configured_path()
+    version, modified = data_version(db_path)
+    try:
+        query = parse_newsfeed_args(request.args, version)
+    except ValueError as error:
+        return jsonify({"status": "error", "message": str(error)}), 400
+    if query is None:
+        message = "The feed has changed; start from the first page"
+        return jsonify({"status": "error", "message": message}), 410
+
+    response = app.response_class()
+    response.set_etag(f"newsfeed-{version}")
+    response.last_modified = modified
+    # Let clients keep a copy but revalidate it on every poll
+    response.cache_control.no_cache = True
+
+    if request.method in ("GET", "HEAD") and not is_resource_modified(
+        request.environ, etag=f"newsfeed-{version}", last_modified=modified
+    ):
+        response.status_code = 304
+        return response
+
+    if query["format"] == "ndjson":
+        cursor = get_db().cursor()
+        next_after = next_newsfeed_cursor(cursor, query)
+        response.mimetype = "application/x-ndjson"
+        response.response = stream_with_context(stream_newsfeed(cursor, query))
+    else:
+        body, next_after = build_newsfeed(
+            db_path,
+            version,
+            query["offset"],
+            query["after"],
+            query["limit"],
+            query["fields"],
+            query["feed"],
+        )
+        response.mimetype = "application/json"
+        response.set_data(body)
+
+    if next_after is not None:
+        next_args = {key: value for key, value in request.args.items() if key != "page"}
+        next_args["cursor"] = f"{version}.{next_after}"
+        next_args["limit"] = query["limit"]
+        response.headers["Link"] = f'<{url_for("news", **next_args)}>; rel="next"'
+    return response
+
 
-    Connects to the database and fetches the latest 30 news items.
-    Converts the database results into a list of dictionaries.
-    Closes the database connection.
-    Returns the news feed as a JSON string.
+@app.route("/comments/<int:story_id>", methods=["GET"])
+def story_comments(story_id):
     """
-    # Connect to the database.
-    connection = sqlite3.connect("stories.db")
-    cursor = connection.cursor()
+    Returns the stored comment thread of a story as JSON.
 
-    # Retrieve the 30 most recent items from the database.
-    cursor.execute("SELECT * FROM new_stories")
-    results = cursor.fetchall()
+    Query parameters:
+    - depth: levels of replies to return; defaults to and is capped at 10.
+    - limit: comments to return; defaults to 200, at most 1000.
 
-    # Convert the results to a list of dictionaries.
-    news_feed = []
-    for item in results[:30]:
-        news_feed.append(
-            {
-                "by": item[0],
-                "descendants": item[6],
-                "id": item[1],
-                #'kids': item[3],
-                "score": item[2],
-                "text": item[8],
-                "time": item[3],
-                "title": item[4],
-                "type": item[7],
-                "url": item[5],
-            }
-        )
+    Comments are listed in thread order, each after its parent, with their depth and
+    parent id so clients can indent them. Threads are stored by the fetcher's
+    optional comment stage (`fetch.py --comments N`); stories whose thread has not
+    been fetched are answered with 404.
+    """
+    depth = min(request.args.get("depth", COMMENTS_MAX_DEPTH, type=int), COMMENTS_MAX_DEPTH)
+    limit = min(request.args.get("limit", COMMENTS_DEFAULT_LIMIT, type=int), COMMENTS_MAX_LIMIT)
+    if depth < 1 or limit < 1:
+        return jsonify({"status": "error", "message": "depth and limit must be positive"}), 400
 
-    # Close the database connection.
-    connection.close()
+    cursor = get_db().cursor()
+    cursor.execute("SELECT fetched_at FROM comment_threads WHERE story_id = ?", (story_id,))
+    thread = cursor.fetchone()
+    if thread is None:
+        return jsonify({"status": "error", "message": "No comments stored for this story"}), 404
 
-    # Return the news feed as JSON.
-    json_news = json.dumps(news_feed, indent=4)
-    return json_news
-    # return jsonify(news_feed)
+    return jsonify(
+        {
+            "story_id": story_id,
+            "fetched_at": thread[0],
+            "comments": get_comment_thread(cursor, story_id, depth, limit),
+        }
+    )
 
 
 @app.route("/news", methods=["GET", "POST"])
@@ -435,35 +571,69 @@ def display():
     """
     Renders the news page with pagination.
 
-    Retrieves news items from the database based on the current page number.
-    Implements pagination to manage the display of news items.
-    Converts the results into a list of dictionaries for rendering.
-    Calculates the total number of pages needed for pagination.
+    The story list for a page is the same for every user, so it is rendered once per
+    page and data version and served from a bounded LRU cache. Only the like/dislike
+    counts, read in one query, and the session-dependent page chrome are rendered on
+    every request. The `feed` query parameter picks the list: top (default), new,
+    best, ask, show or job.
     Returns a rendered HTML template for the news page with pagination.
     """
     page = request.args.get("page", 1, type=int)
+    feed = request.args.get("feed", "top")
+    if feed not in FEEDS:
+        abort(404)
+    db_path = configured_path()
+    version, _ = data_version(db_path)
 
-    # Connect to the database.
-    connection = sqlite3.connect("stories.db")
-    cursor = connection.cursor()
+    news_items, story_ids = render_news_items(db_path, page, version, feed)
 
-    # Calculate the start and end indices for the current page
-    if page < 0:
-        start_index = 0
-        end_index = 10
-    else:
-        start_index = (page - 1) * ITEMS_PER_PAGE
-        end_index = start_index + ITEMS_PER_PAGE
+    # Fill the current vote counts into the cached story list.
+    vote_counts = get_likes_dislikes_batch(get_db().cursor(), story_ids)
+    news_items = apply_vote_overlay(news_items, vote_counts)
+
+    # How long ago the stories were fetched
+    last_fetch = get_last_fetch_run(get_db().cursor())
+    updated_minutes = None
+    if last_fetch is not None:
+        updated_minutes = max(int(time.time() - last_fetch["finished_at"]) // 60, 0)
+
+    # Render the news template around the story list.
+    return render_template(
+        "news.html",
+        news_items=Markup(news_items),
+        updated_minutes=updated_minutes,
+        feeds=FEEDS,
+        current_feed=feed,
+    )
+
+
+@lru_cache(maxsize=NEWS_FRAGMENT_CACHE_SIZE)
+def render_news_items(db_path, page, version, feed="top"):  # pylint: disable=unused-argument
+    """
+    Renders the story list and pagination of one news page.
+
+    Retrieves news items from the database based on the page number, and calculates
+    the total number of pages needed for pagination. Vote counts are left as markers
+    for apply_vote_overlay. Results are cached per database, feed, page and data
+    version, so the database is only read the first time a page is shown for a version.
+
+    Parameters:
+    - db_path (str): The path of the configured database; part of the cache key.
+    - page (int): The 1-based page number.
+    - version (str): The data version the page is rendered for; part of the cache key.
+    - feed (str): The name of a feed in FEEDS.
+
+    Returns:
+    - tuple: The rendered HTML and the ids of the stories on the page.
+    """
+    cursor = get_db().cursor()
 
-    # Retrieve the 30 most recent items from the database.
-    cursor.execute("SELECT * FROM new_stories")
-    results = cursor.fetchall()
+    # Retrieve the items for the current page from the database.
+    results = get_news_page(cursor, page, feed)
 
     # Convert the results to a list of dictionaries.
     news_feed = []
-    for item in results[start_index:end_index]:
-        item_id = item[1]
-        like_count, dislike_count = get_likes_dislikes_db(item_id)
+    for item in results:
         news_feed.append(
             {
                 "by": item[0],
@@ -475,21 +645,75 @@ def display():
                 "title": item[4],
                 "type": item[7],
                 "url": item[5],
-                "like_count": like_count,
-                "dislike_count": dislike_count,
             }
         )
 
-    # Close the database connection.
-    connection.close()
-
     # calculate the number of pages needed
-    total_pages = math.ceil(len(results) / ITEMS_PER_PAGE)
+    total_pages = math.ceil(count_news_items(cursor, feed) / ITEMS_PER_PAGE)
 
-    # Render the news template with the news feed.
-    return render_template(
-        "news.html", news_feed=news_feed, current_page=page, total_pages=total_pages
+    html = render_template(
+        "news_items.html",
+        news_feed=news_feed,
+        current_page=page,
+        total_pages=total_pages,
+        # Pagination links leave the default feed out of the URL
+        feed=None if feed == "top" else feed,
+        vote_marker=lambda kind, story_id: VOTE_MARKER.format(kind=kind, story_id=story_id),
     )
+    return html, tuple(item["id"] for item in news_feed)
+
+
+def apply_vote_overlay(news_items, vote_counts):
+    """
+    Replaces the vote markers in a rendered story list with the current counts.
+
+    Parameters:
+    - news_items (str): A story list rendered by render_news_items.
+    - vote_counts (dict): A mapping of story id to a (likes, dislikes) tuple.
+
+    Returns:
+    - str: The story list with counts and like/dislike card styles filled in.
+    """
+
+    def fill(match):
+        like_count, dislike_count = vote_counts.get(int(match.group(2)), (0, 0))
+        if match.group(1) == "like":
+            return str(like_count)
+        if match.group(1) == "dislike":
+            return str(dislike_count)
+        # Card header style, as the template chose it before: likes win over dislikes
+        if like_count:
+            return "like"
+        return "dislike" if dislike_count else ""
+
+    return VOTE_MARKER_RE.sub(fill, news_items)
+
+
+def record_vote(story_id, user_email, liked):
+    """
+    Records a vote, either directly or through the write-behind queue when
+    VOTE_WRITE_BEHIND is enabled.
+
+    Parameters:
+    - story_id (int): The id of the story being voted on.
+    - user_email (str): The email of the voting user.
+    - liked (bool): True for a like, False for a dislike.
+
+    Returns:
+    - tuple: The story's (likes, dislikes) after the vote, or None if there is no
+      story with that id.
+    """
+    if app.config["VOTE_WRITE_BEHIND"]:
+        return vote_queue.submit(get_db(), story_id, user_email, liked)
+    return cast_vote(get_db(), story_id, user_email, liked)
+
+
+def flush_votes():
+    """
+    Writes any buffered votes, so that deleting votes also removes those still queued.
+    """
+    if app.config["VOTE_WRITE_BEHIND"]:
+        vote_queue.flush()
 
 
 @app.route("/like_story", methods=["POST"])
@@ -498,115 +722,18 @@ def like_story():
     """
     Handles the 'like' action for a news story.
 
-    Receives the story ID from the request and checks if the user has already liked or disliked it.
-    Updates or inserts a new record in the 'story_likes' table with 'liked' status.
+    Receives the story ID from the request and records the user's like, replacing any
+    earlier like or dislike, in a single statement.
     Returns a JSON response indicating the success of the operation and updated like/dislike counts.
     """
     user_email = session.get("user", {}).get("userinfo", {}).get("email")
     story_id = request.json.get("story_id")
 
-    connection = sqlite3.connect("stories.db")
-    cursor = connection.cursor()
-
-    # Check if the user has already liked or disliked this story
-    cursor.execute("SELECT * FROM new_stories WHERE id = ?", (story_id,))
-    story_record = cursor.fetchone()
-
-    if story_record:
-        story_data = {
-            "by": story_record[0],
-            "id": story_record[1],
-            "score": story_record[2],
-            "time": story_record[3],
-            "title": story_record[4],
-            "url": story_record[5],
-            "descendants": story_record[6],
-            "type": story_record[7],
-            "text": story_record[8],
-        }
-
-        # Check if there's already an entry for this story and user
-        cursor.execute(
-            "SELECT liked, disliked FROM story_likes WHERE story_id = ? AND user_email = ?",
-            (story_id, user_email),
-        )
-        record = cursor.fetchone()
-
-        if record:
-            # Update the like/dislike status and story information for the existing record
-            cursor.execute(
-                """
-                UPDATE story_likes
-                SET liked = ?, 
-                    disliked = ?, 
-                    by = ?, 
-                    score = ?, 
-                    time = ?, 
-                    title = ?, 
-                    url = ?, 
-                    descendants = ?, 
-                    type = ?, 
-                    text = ?
-                WHERE story_id = ? AND user_email = ?
-            """,
-                (
-                    True,
-                    False,
-                    story_data["by"],
-                    story_data["score"],
-                    story_data["time"],
-                    story_data["title"],
-                    story_data["url"],
-                    story_data["descendants"],
-                    story_data["type"],
-                    story_data["text"],
-                    story_id,
-                    user_email,
-                ),
-            )
-        else:
-            # Insert a new record with the like/dislike status and story information
-            cursor.execute(
-                """
-                INSERT INTO story_likes (story_id, 
-                                         user_email, 
-                                         liked, 
-                                         disliked, 
-                                         by, 
-                                         score, 
-                                         time, 
-                                         title, 
-                                         url, 
-                                         descendants, 
-                                         type, 
-                                         text)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    story_id,
-                    user_email,
-                    True,
-                    False,
-                    story_data["by"],
-                    story_data["score"],
-                    story_data["time"],
-                    story_data["title"],
-                    story_data["url"],
-                    story_data["descendants"],
-                    story_data["type"],
-                    story_data["text"],
-                ),
-            )
-
-        # Commit changes and close connection
-        connection.commit()
-        connection.close()
-    else:
-        connection.close()
+    counts = record_vote(story_id, user_email, liked=True)
+    if counts is None:
         return jsonify({"status": "error", "message": "Story not found"}), 404
 
-    like_count, dislike_count = get_likes_dislikes_db(story_id)
-
+    like_count, dislike_count = counts
     return jsonify(
         {"status": "success", "like_count": like_count, "dislike_count": dislike_count}
     )
@@ -618,115 +745,18 @@ def dislike_story():
     """
     Handles the 'dislike' action for a news story.
 
-    Receives the story ID from the request and checks if the user has already liked or disliked it.
-    Updates or inserts a new record in the 'story_likes' table with 'disliked' status.
+    Receives the story ID from the request and records the user's dislike, replacing any
+    earlier like or dislike, in a single statement.
     Returns a JSON response indicating the success of the operation and updated like/dislike counts.
     """
     user_email = session.get("user", {}).get("userinfo", {}).get("email")
     story_id = request.json.get("story_id")
 
-    connection = sqlite3.connect("stories.db")
-    cursor = connection.cursor()
-
-    # Check if the user has already liked or disliked this story
-    cursor.execute("SELECT * FROM new_stories WHERE id = ?", (story_id,))
-    story_record = cursor.fetchone()
-
-    if story_record:
-        story_data = {
-            "by": story_record[0],
-            "id": story_record[1],
-            "score": story_record[2],
-            "time": story_record[3],
-            "title": story_record[4],
-            "url": story_record[5],
-            "descendants": story_record[6],
-            "type": story_record[7],
-            "text": story_record[8],
-        }
-
-        # Check if there's already an entry for this story and user
-        cursor.execute(
-            "SELECT liked, disliked FROM story_likes WHERE story_id = ? AND user_email = ?",
-            (story_id, user_email),
-        )
-        record = cursor.fetchone()
-
-        if record:
-            # Update the like/dislike status and story information for the existing record
-            cursor.execute(
-                """
-                UPDATE story_likes
-                SET liked = ?, 
-                    disliked = ?, 
-                    by = ?, 
-                    score = ?, 
-                    time = ?, 
-                    title = ?, 
-                    url = ?, 
-                    descendants = ?, 
-                    type = ?, 
-                    text = ?
-                WHERE story_id = ? AND user_email = ?
-            """,
-                (
-                    False,
-                    True,
-                    story_data["by"],
-                    story_data["score"],
-                    story_data["time"],
-                    story_data["title"],
-                    story_data["url"],
-                    story_data["descendants"],
-                    story_data["type"],
-                    story_data["text"],
-                    story_id,
-                    user_email,
-                ),
-            )
-        else:
-            # Insert a new record with the like/dislike status and story information
-            cursor.execute(
-                """
-                INSERT INTO story_likes (story_id, 
-                                         user_email, 
-                                         liked, 
-                                         disliked, 
-                                         by, 
-                                         score, 
-                                         time, 
-                                         title, 
-                                         url, 
-                                         descendants, 
-                                         type, 
-                                         text)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    story_id,
-                    user_email,
-                    False,
-                    True,
-                    story_data["by"],
-                    story_data["score"],
-                    story_data["time"],
-                    story_data["title"],
-                    story_data["url"],
-                    story_data["descendants"],
-                    story_data["type"],
-                    story_data["text"],
-                ),
-            )
-
-        # Commit changes and close connection
-        connection.commit()
-        connection.close()
-    else:
-        connection.close()
+    counts = record_vote(story_id, user_email, liked=False)
+    if counts is None:
         return jsonify({"status": "error", "message": "Story not found"}), 404
 
-    like_count, dislike_count = get_likes_dislikes_db(story_id)
-
+    like_count, dislike_count = counts
     return jsonify(
         {"status": "success", "like_count": like_count, "dislike_count": dislike_count}
     )
@@ -736,31 +766,52 @@ def get_likes_dislikes_db(story_id):
     """
     Retrieves the counts of likes and dislikes for a given story from the database.
 
-    Connects to the database and executes queries to count likes and dislikes 
-    for the specified story ID.
-    Closes the database connection after retrieving the counts.
+    Reads the story's row in the trigger-maintained story_vote_counts table.
     Returns the counts of likes and dislikes as a tuple.
     """
-    connection = sqlite3.connect("stories.db")
+    connection = get_db()
     cursor = connection.cursor()
 
-    # Get the count of likes
     cursor.execute(
-        "SELECT COUNT(*) FROM story_likes WHERE story_id = ? AND liked = True",
+        "SELECT likes, dislikes FROM story_vote_counts WHERE story_id = ?",
         (story_id,),
     )
-    likes_count = cursor.fetchone()[0]
+    counts = cursor.fetchone()
+
+    if counts is None:
+        return 0, 0
+    return counts
+
+
+def get_likes_dislikes_batch(cursor, story_ids):
+    """
+    Retrieves the counts of likes and dislikes for several stories in one query.
 
-    # Get the count of dislikes
+    Parameters:
+    - cursor (sqlite3.Cursor): The cursor to run the query on.
+    - story_ids (list): The ids of the stories to count votes for.
+
+    Returns:
+    - dict: A mapping of story id to a (likes, dislikes) tuple. Stories without
+      votes map to (0, 0).
+    """
+    counts = {story_id: (0, 0) for story_id in story_ids}
+    if not counts:
+        return counts
+
+    placeholders = ", ".join("?" * len(counts))
     cursor.execute(
-        "SELECT COUNT(*) FROM story_likes WHERE story_id = ? AND disliked = True",
-        (story_id,),
+        f"""
+        SELECT story_id, likes, dislikes
+        FROM story_vote_counts
+        WHERE story_id IN ({placeholders})
+        """,
+        list(counts),
     )
-    dislikes_count = cursor.fetchone()[0]
+    for story_id, likes_count, dislikes_count in cursor.fetchall():
+        counts[story_id] = (likes_count, dislikes_count)
 
-    connection.close()
-
-    return likes_count, dislikes_count
+    return counts
 
 
 @app.route("/delete", methods=["POST"])
@@ -776,16 +827,14 @@ def delete_like_dislike():
     data = request.json
     story_id = data.get("story_id")
     user_email = session.get("user", {}).get("userinfo", {}).get("email")
+    flush_votes()
 
-    # Connect to the database
-    connection = sqlite3.connect("stories.db")
+    # Get the database connection
+    connection = get_db()
     cursor = connection.cursor()
 
     # Check if the user is an admin
-    cursor.execute("SELECT admin FROM users WHERE email = ?", (user_email,))
-    user_admin = cursor.fetchone()[0]
-
-    if user_admin:
+    if is_admin(user_email):
         # If user is an admin, delete any entry with the story_id
         cursor.execute("DELETE FROM story_likes WHERE story_id = ?", (story_id,))
     else:
@@ -796,7 +845,6 @@ def delete_like_dislike():
         )
 
     connection.commit()
-    connection.close()
 
     return jsonify({"status": "success"})
 
@@ -814,9 +862,10 @@ def delete_user():
     """
     data = request.json
     user_email = data.get("email")
+    flush_votes()
 
-    # Connect to the database
-    connection = sqlite3.connect("stories.db")
+    # Get the database connection
+    connection = get_db()
     cursor = connection.cursor()
 
     # Delete the user's likes/dislikes
@@ -826,7 +875,7 @@ def delete_user():
     cursor.execute("DELETE FROM users WHERE email = ?", (user_email,))
 
     connection.commit()
-    connection.close()
+    invalidate_admin_cache(user_email)
 
     return jsonify({"status": "success"})
 
@@ -836,7 +885,7 @@ def delete_user():
 @admin_required
 def delete_news_item():
     """
-    Deletes a news item and its associated likes/dislikes from the database.
+    Deletes a news item and its associated likes/dislikes and comments from the database.
 
     Accessible only by admin users.
     Removes the specified news item and its interactions from the database.
@@ -844,19 +893,28 @@ def delete_news_item():
     """
     data = request.json
     news_id = data.get("news_id")
+    flush_votes()
 
-    # Connect to the database
-    connection = sqlite3.connect("stories.db")
+    # Get the database connection
+    connection = get_db()
     cursor = connection.cursor()
 
-    # Delete the news item's likes/dislikes
+    # Delete the news item's likes/dislikes and comments
     cursor.execute("DELETE FROM story_likes WHERE story_id = ?", (news_id,))
+    cursor.execute(
+        "DELETE FROM story_kids WHERE kid_id IN (SELECT id FROM comments WHERE story_id = ?)",
+        (news_id,),
+    )
+    cursor.execute("DELETE FROM comments WHERE story_id = ?", (news_id,))
+    cursor.execute("DELETE FROM comment_threads WHERE story_id = ?", (news_id,))
 
     # Delete the news item
     cursor.execute("DELETE FROM new_stories WHERE id = ?", (news_id,))
+    cursor.execute("DELETE FROM feed_items WHERE item_id = ?", (news_id,))
+    cursor.execute("DELETE FROM stories WHERE id = ?", (news_id,))
 
     connection.commit()
-    connection.close()
+    bump_data_version()
 
     return jsonify({"status": "success"})
 
@@ -0,0 +1,71 @@
+"""
+Module: bench_fetch.py
+
+Benchmarks `fetch.get_hacker_news_data` against a local stand-in Hacker News server.
+
+The stand-in server adds a fixed latency to every request to mimic the round trip to
+the real API. The fetcher is timed at each requested concurrency level and every result
+is checked against the sequential (concurrency 1) run, so a speedup never comes at the
+cost of a different story order.
+
+Usage:
+Run from the repository root.
+
+Example:
+python3 -m benchmarks.bench_fetch --items 500 --latency 0.02 --concurrency 1 8 16 32
+"""
+import argparse
+import time
+
+from benchmarks.hn_stub import make_items, start_stub_server
+from fetch import get_hacker_news_data
+
+
+def run(items, latency, levels):
+    """
+    Times the fetcher at each concurrency level against a fresh stand-in server.
+
+    Parameters:
+    - items (int): The number of stories served by the stand-in server.
+    - latency (float): Seconds of artificial latency per request.
+    - levels (list): Concurrency levels to benchmark.
+
+    Returns:
+    - list: A list of (concurrency, seconds, request_count) tuples.
+    """
+    server = start_stub_server(make_items(items), latency=latency)
+    results = []
+    baseline = None
+    try:
+        for level in levels:
+            server.request_count = 0
+            start = time.perf_counter()
+            data = get_hacker_news_data(concurrency=level, base_url=server.base_url)
+            elapsed = time.perf_counter() - start
+
+            if baseline is None:
+                baseline = data
+            elif data != baseline:
+                raise AssertionError(f"concurrency {level} returned a different story list")
+            results.append((level, elapsed, server.request_count))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 16, 32])
+    args = parser.parse_args()
+
+    timings = run(args.items, args.latency, args.concurrency)
+    base_seconds = timings[0][1]
+    print(f"{'concurrency':>11} {'seconds':>8} {'requests':>8} {'speedup':>8}")
+    for concurrency, seconds, requests_made in timings:
+        print(
+            f"{concurrency:>11} {seconds:>8.2f} {requests_made:>8} "
+            f"{base_seconds / seconds:>7.1f}x"
+        )
@@ -0,0 +1,222 @@
+"""
+Module: bench_routes.py
+
+Benchmarks the Flask routes against synthetic databases of several sizes.
+
+For every size a database with that many stories and votes is generated with
+benchmarks/generate_data.py (or reused from an earlier run) and each route is
+requested through the Flask test client as a logged-in admin user. Page numbers and
+story ids are drawn from a seeded random generator, so runs are repeatable and the
+per-page caches are exercised the way browsing users exercise them. For each route
+the p50/p95/p99 latency, the number of SQL statements per request and the response
+size are reported.
+
+Results are saved as JSON under benchmarks/results/, named after the current commit,
+so that runs can be compared across commits.
+
+Functions:
+- run(path, iterations, seed): Times every route against one database.
+- percentile(samples, fraction): Returns a nearest-rank percentile.
+- compare(results, baseline): Prints the change in p50 latency against a saved run.
+
+Usage:
+Run from the repository root. Databases are kept in benchmarks/data/ and reused
+when one of the same size and seed exists.
+
+Example:
+python3 -m benchmarks.bench_routes --sizes 1000 100000 1000000
+python3 -m benchmarks.bench_routes --compare benchmarks/results/4d9e319.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import time
+from contextlib import closing
+
+from app import app
+from benchmarks.generate_data import generate
+from db import bump_data_version, connect, get_db
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# The generated admin user, who is also the heaviest voter
+BENCH_USER = "admin@example.com"
+
+# (name, method, request builder); builders take the random generator and the story
+# ids and return the path and the JSON body
+ROUTES = [
+    ("/news", "GET", lambda rng, ids: (f"/news?page={rng.randint(1, len(ids) // 10 + 1)}", None)),
+    (
+        "/newsfeed",
+        "GET",
+        lambda rng, ids: (f"/newsfeed?page={rng.randint(1, len(ids) // 30 + 1)}", None),
+    ),
+    (
+        "/admin/news",
+        "GET",
+        lambda rng, ids: (f"/admin/news?page={rng.randint(1, len(ids) // 10 + 1)}", None),
+    ),
+    ("/profile", "GET", lambda rng, ids: ("/profile", None)),
+    ("/admin/items", "GET", lambda rng, ids: ("/admin/items", None)),
+    ("/like_story", "POST", lambda rng, ids: ("/like_story", {"story_id": rng.choice(ids)})),
+    ("/dislike_story", "POST", lambda rng, ids: ("/dislike_story", {"story_id": rng.choice(ids)})),
+]
+
+
+def percentile(samples, fraction):
+    """
+    Returns the nearest-rank percentile of a list of samples.
+
+    Parameters:
+    - samples (list): The measurements.
+    - fraction (float): The percentile as a fraction, e.g. 0.95.
+
+    Returns:
+    - float: The smallest sample that at least `fraction` of the samples do not exceed.
+    """
+    ordered = sorted(samples)
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def run(path, iterations, seed):
+    """
+    Times every route against one database through the Flask test client.
+
+    Parameters:
+    - path (str): The database to serve.
+    - iterations (int): Timed requests per route, after one untimed warm-up request.
+    - seed (int): Seed for the page numbers and story ids requested.
+
+    Returns:
+    - list: One dictionary per route with the latency percentiles in milliseconds,
+      the mean number of SQL statements and the mean response size in bytes.
+    """
+    app.config["DATABASE"] = path
+    app.secret_key = app.secret_key or "bench"
+    bump_data_version(path)
+    rng = random.Random(seed)
+    with closing(connect(path)) as connection:
+        ids = [row[0] for row in connection.execute("SELECT id FROM new_stories")]
+
+    # The test client handles requests on this thread, so they all use this connection
+    with app.app_context():
+        connection = get_db()
+    statements = []
+    connection.set_trace_callback(
+        lambda statement: statements.append(statement) if not statement.startswith("--") else None
+    )
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = {"userinfo": {"email": BENCH_USER}}
+
+    results = []
+    try:
+        for name, method, build_request in ROUTES:
+            timings, queries, sizes = [], [], []
+            for iteration in range(iterations + 1):
+                url, body = build_request(rng, ids)
+                statements.clear()
+                start = time.perf_counter()
+                response = client.open(url, method=method, json=body)
+                data = response.get_data()
+                elapsed = time.perf_counter() - start
+                if response.status_code != 200:
+                    raise RuntimeError(f"{method} {url} returned {response.status_code}")
+                if iteration:
+                    timings.append(elapsed * 1000)
+                    queries.append(len(statements))
+                    sizes.append(len(data))
+            results.append(
+                {
+                    "route": name,
+                    "p50_ms": percentile(timings, 0.50),
+                    "p95_ms": percentile(timings, 0.95),
+                    "p99_ms": percentile(timings, 0.99),
+                    "queries": sum(queries) / len(queries),
+                    "bytes": sum(sizes) // len(sizes),
+                }
+            )
+    finally:
+        connection.set_trace_callback(None)
+    return results
+
+
+def compare(results, baseline):
+    """
+    Prints the change in p50 latency of every route against a saved run.
+
+    Parameters:
+    - results (dict): This run's results, keyed by database size.
+    - baseline (dict): The saved run's results, keyed by database size.
+    """
+    print(f"\n{'stories':>9} {'route':<15} {'before':>9} {'after':>9} {'change':>8}")
+    for size, routes in results.items():
+        before = {row["route"]: row for row in baseline.get(size, [])}
+        for row in routes:
+            if row["route"] not in before:
+                continue
+            old, new = before[row["route"]]["p50_ms"], row["p50_ms"]
+            print(
+                f"{size:>9} {row['route']:<15} {old:>8.2f}ms {new:>8.2f}ms "
+                f"{new / old - 1:>+7.0%}"
+            )
+
+
+def commit_label():
+    """
+    Returns the short hash of the current commit, used to name the results file.
+    """
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "latest"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--votes-per-story", type=float, default=1.0)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default=None, help="results file name; defaults to the commit")
+    parser.add_argument("--compare", default=None, help="a saved results file to compare with")
+    args = parser.parse_args()
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    all_results = {}
+    print(
+        f"{'stories':>9} {'route':<15} {'p50':>9} {'p95':>9} {'p99':>9} "
+        f"{'queries':>7} {'bytes':>9}"
+    )
+    for stories in args.sizes:
+        votes = int(stories * args.votes_per_story)
+        db_path = os.path.join(DATA_DIR, f"routes-{stories}-{votes}-{args.users}-{args.seed}.db")
+        if not os.path.exists(db_path):
+            generate(db_path, stories, args.users, votes, args.seed)
+        all_results[str(stories)] = run(db_path, args.iterations, args.seed)
+        for timing in all_results[str(stories)]:
+            print(
+                f"{stories:>9} {timing['route']:<15} {timing['p50_ms']:>7.2f}ms "
+                f"{timing['p95_ms']:>7.2f}ms {timing['p99_ms']:>7.2f}ms "
+                f"{timing['queries']:>7.1f} {timing['bytes']:>9}"
+            )
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"{args.label or commit_label()}.json")
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        json.dump({"sizes": args.sizes, "results": all_results}, results_file, indent=2)
+    print(f"\nSaved {results_path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            compare(all_results, json.load(baseline_file)["results"])
@@ -0,0 +1,231 @@
+"""
+Module: generate_data.py
+
+Fills a stories database with synthetic stories, users and votes for load testing.
+
+The data follows the shapes seen in production rather than uniform noise:
+- Votes per story follow a Zipf-like distribution: a few stories collect most votes
+  and most stories get none.
+- Votes per user are Zipf-like as well, so a handful of heavy users have long
+  profile pages.
+- About one story in ten is a text post with a long `text` field.
+- Story times are spread over the last days, denser during the (UTC) daytime, and
+  stories are stored in feed order, the order `fetch.sort_stories` produces.
+
+Everything is drawn from one seeded random generator, so the same arguments always
+produce the same database. Rows are written with batched `executemany` calls in a
+single transaction, and the schema comes from the migrations, so the result matches
+what the app expects.
+
+Functions:
+- generate(path, stories, users, votes, seed, zipf, days): Creates the database.
+- zipf_cum_weights(count, exponent): Cumulative Zipf weights for `random.choices`.
+
+Usage:
+Run from the repository root. The target database must not exist yet unless
+`--force` is given.
+
+Example:
+python3 -m benchmarks.generate_data --db /tmp/load.db --stories 1000000 --votes 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+from contextlib import closing
+
+from db import bump_data_version, connect
+from hn_client import convert_time
+from migrations import migrate
+
+# First story id, in the range of current Hacker News ids
+FIRST_STORY_ID = 38000000
+
+# Rows per executemany batch
+BATCH_SIZE = 50000
+
+# Page cache while generating, in KiB
+GENERATE_CACHE_SIZE_KIB = 512 * 1024
+
+# Share of stories that are text posts, and the median length of their text
+TEXT_POST_RATE = 0.1
+TEXT_MEDIAN_LENGTH = 800
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are or from at an which "
+    "database query latency cache index server python sqlite flask request thread page "
+    "story user vote news ask show launch startup model data system build release open"
+).split()
+
+
+def zipf_cum_weights(count, exponent):
+    """
+    Returns cumulative Zipf weights for ranks 1..count, for use with `random.choices`.
+
+    Parameters:
+    - count (int): The number of ranks.
+    - exponent (float): The Zipf exponent; larger values concentrate more weight on
+      the first ranks.
+
+    Returns:
+    - list: The running totals of 1 / rank ** exponent.
+    """
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def story_rows(rng, stories, days, now):
+    """
+    Generates the new_stories rows, in feed order.
+    """
+    # Titles and text are cut from pre-drawn material; drawing words per story is slow
+    titles = [
+        " ".join(rng.choices(WORDS, k=rng.randint(3, 12))).capitalize() for _ in range(5000)
+    ]
+    corpus = " ".join(rng.choices(WORDS, k=TEXT_MEDIAN_LENGTH * 8))
+    rows = []
+    for number in range(stories):
+        # Reject night-time hours half of the time to get a daily rhythm
+        while True:
+            epoch = now - rng.randrange(days * 86400)
+            if 7 <= epoch // 3600 % 24 <= 22 or rng.random() < 0.5:
+                break
+        score = min(int(rng.paretovariate(1.2)), 5000)
+        is_text_post = rng.random() < TEXT_POST_RATE
+        text = ""
+        if is_text_post:
+            length = min(int(rng.lognormvariate(0, 0.8) * TEXT_MEDIAN_LENGTH), len(corpus) // 2)
+            start = rng.randrange(len(corpus) - length)
+            text = corpus[start:start + length]
+        rows.append(
+            (
+                f"user{rng.randrange(50000)}",
+                FIRST_STORY_ID + number,
+                score,
+                convert_time(epoch),
+                rng.choice(titles),
+                "" if is_text_post else f"https://example.com/{FIRST_STORY_ID + number}",
+                int(score * rng.uniform(0, 1.5)),
+                "story",
+                text,
+            )
+        )
+    # Newest first, lower scores first among stories posted at the same second
+    rows.sort(key=lambda row: (row[3], -row[2]), reverse=True)
+    return rows
+
+
+def generate(path, stories, users, votes, seed=1, zipf=1.1, days=30):
+    """
+    Creates a synthetic stories database.
+
+    The first user, admin@example.com, is an admin and the heaviest voter.
+
+    Parameters:
+    - path (str): Where to create the database; it must not exist yet.
+    - stories (int): The number of stories.
+    - users (int): The number of users.
+    - votes (int): The number of votes; draws that repeat a user's vote on a story are
+      dropped and drawn again.
+    - seed (int): Seed for the random generator.
+    - zipf (float): The Zipf exponent of votes per story and per user.
+    - days (int): How many days back story times go.
+
+    Returns:
+    - dict: The number of stories, users and votes stored.
+    """
+    rng = random.Random(seed)
+    now = 1700000000 + days * 86400
+    emails = ["admin@example.com"] + [f"user{number}@example.com" for number in range(1, users)]
+
+    rows = story_rows(rng, stories, days, now)
+    story_ids = [row[1] for row in rows]
+    # Popularity is independent of feed position
+    popular = rng.sample(story_ids, len(story_ids))
+    story_weights = zipf_cum_weights(len(popular), zipf)
+    user_weights = zipf_cum_weights(len(emails), zipf)
+
+    with closing(connect(path)) as connection:
+        migrate(connection)
+        # The file is thrown away if generation fails, so durability can wait until the end,
+        # and a large page cache keeps the randomly ordered vote index in memory
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute(f"PRAGMA cache_size = -{GENERATE_CACHE_SIZE_KIB}")
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT INTO users (email, name, nickname, picture, admin) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (email, email.split("@")[0].title(), email.split("@")[0], "", int(number == 0))
+                    for number, email in enumerate(emails)
+                ),
+            )
+            for start in range(0, len(rows), BATCH_SIZE):
+                connection.executemany(
+                    """INSERT INTO new_stories (
+                        by, id, score, time, title, url, descendants, type, text
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    rows[start:start + BATCH_SIZE],
+                )
+            stored = misses = 0
+            while stored < votes and misses < 10:
+                count = min(BATCH_SIZE, votes - stored)
+                voted = rng.choices(popular, cum_weights=story_weights, k=count)
+                voters = rng.choices(emails, cum_weights=user_weights, k=count)
+                cursor = connection.executemany(
+                    """INSERT OR IGNORE INTO story_likes (story_id, user_email, liked, disliked)
+                    VALUES (?, ?, ?, ?)""",
+                    (
+                        (story_id, email, liked, not liked)
+                        for story_id, email, liked in zip(
+                            voted, voters, (rng.random() < 0.75 for _ in range(count))
+                        )
+                    ),
+                )
+                # Stop if draws keep repeating existing votes; there is no room for more
+                misses = misses + 1 if cursor.rowcount == 0 else 0
+                stored += cursor.rowcount
+            connection.execute(
+                """INSERT OR IGNORE INTO stories (
+                    id, by, score, time, title, url, descendants, type, text
+                )
+                SELECT id, by, score, time, title, url, descendants, type, text
+                FROM new_stories
+                WHERE id IN (SELECT story_id FROM story_likes)"""
+            )
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("ANALYZE")
+
+    bump_data_version(path)
+    return {"stories": stories, "users": users, "votes": stored}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--db", required=True, help="path of the database to create")
+    parser.add_argument("--stories", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--votes", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--zipf", type=float, default=1.1, help="Zipf exponent of votes per story and user"
+    )
+    parser.add_argument("--days", type=int, default=30, help="how many days back story times go")
+    parser.add_argument("--force", action="store_true", help="replace an existing database")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f"{args.db} exists; use --force to replace it")
+        for suffix in ("", "-wal", "-shm", ".version"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    started = time.perf_counter()
+    counts = generate(
+        args.db, args.stories, args.users, args.votes, args.seed, args.zipf, args.days
+    )
+    print(
+        f"Wrote {counts['stories']} stories, {counts['users']} users and {counts['votes']} votes "
+        f"to {args.db} in {time.perf_counter() - started:.1f}s"
+    )
@@ -0,0 +1,262 @@
+"""
+Module: hn_stub.py
+
+A local stand-in for the Hacker News Firebase API, used by the benchmarks and the
+fetcher tests so that neither depends on the real service or the network.
+
+The server answers the same paths as https://hacker-news.firebaseio.com/v0
+(`topstories.json` and the other story lists, `updates.json` and `item/<id>.json`)
+from an in-memory set of generated items,
+and can add an artificial per-request latency to mimic a remote round trip.
+
+It can also misbehave the way the real API sometimes does: answer item requests
+with a 500, answer them slowly, or return null for an item. Whether a request
+misbehaves is drawn from the seed, the item id and how many times the item was
+requested before, so a run against the same server settings always sees the same
+faults, and a retried request can succeed where the first attempt failed.
+
+Functions:
+- make_items(count): Builds a dictionary of fake story items keyed by id.
+- add_comment_trees(items, depth, fanout): Gives every story a full tree of comments.
+- start_stub_server(items, latency, top_ids, fail_rate, slow_rate, slow_latency, null_rate,
+  seed, feed_ids): Starts the stand-in server on a background thread.
+
+Usage:
+Start a server, point the fetcher at it through its `base_url`, then shut it down.
+
+Example:
+server = start_stub_server(make_items(500), latency=0.02)
+data = get_hacker_news_data(base_url=server.base_url)
+server.shutdown()
+
+server = start_stub_server(make_items(500), fail_rate=0.2, null_rate=0.05)
+"""
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_items(count, seed=0):
+    """
+    Builds a dictionary of fake story items keyed by id.
+
+    Parameters:
+    - count (int): The number of stories to generate.
+    - seed (int): Seed for the random generator so runs are repeatable.
+
+    Returns:
+    - dict: A mapping of story id to a Hacker News style item dictionary.
+    """
+    rng = random.Random(seed)
+    base_time = 1700000000
+    items = {}
+    for story_id in range(1, count + 1):
+        items[story_id] = {
+            "by": f"user{rng.randint(1, 1000)}",
+            "descendants": rng.randint(0, 500),
+            "id": story_id,
+            "score": rng.randint(1, 1000),
+            # Coarse timestamps so the fetcher's secondary sort key gets exercised
+            "time": base_time + rng.randint(0, 50) * 60,
+            "title": f"Story {story_id}",
+            "type": "story",
+            "url": f"https://example.com/{story_id}",
+        }
+    return items
+
+
+def add_comment_trees(items, depth=3, fanout=3):
+    """
+    Gives every story in `items` a full tree of comments.
+
+    Every story and comment above the last level gets `fanout` replies, so a story has
+    fanout + fanout**2 + ... + fanout**depth comments. Comment ids follow the highest
+    id in `items`, and the stories' `kids` and `descendants` are set to match. Serve
+    the result with the story ids as `top_ids`, or the comments are listed as well.
+
+    Parameters:
+    - items (dict): Story items keyed by id, as built by make_items; updated in place.
+    - depth (int): Levels of replies below each story.
+    - fanout (int): Replies per story or comment.
+
+    Returns:
+    - dict: The same dictionary, with the comments added.
+    """
+    next_id = max(items) + 1
+    for story in [item for item in items.values() if item.get("type") == "story"]:
+        level = [story]
+        for _ in range(depth):
+            replies = []
+            for parent in level:
+                parent["kids"] = list(range(next_id, next_id + fanout))
+                for kid_id in parent["kids"]:
+                    replies.append(
+                        {
+                            "by": f"user{kid_id % 1000}",
+                            "id": kid_id,
+                            "parent": parent["id"],
+                            "text": f"Comment {kid_id}",
+                            "time": story["time"] + kid_id % 3600,
+                            "type": "comment",
+                        }
+                    )
+                next_id += fanout
+            for reply in replies:
+                items[reply["id"]] = reply
+            level = replies
+        story["descendants"] = sum(fanout**level for level in range(1, depth + 1))
+    return items
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving the Hacker News API paths from the server's items.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answers `topstories.json`, the other story lists, `updates.json` and
+        `item/<id>.json` requests.
+        """
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        path = self.path.split("?", 1)[0]
+        if path == "/v0/topstories.json":
+            body = server.top_ids
+        elif path.startswith("/v0/") and path.endswith("stories.json"):
+            body = server.feed_ids.get(path[len("/v0/"):-len(".json")], [])
+        elif path == "/v0/updates.json":
+            body = {"items": server.updated_ids, "profiles": []}
+        elif path.startswith("/v0/item/") and path.endswith(".json"):
+            item_id = path[len("/v0/item/"):-len(".json")]
+            body = server.items.get(int(item_id)) if item_id.isdigit() else None
+            with server.lock:
+                attempt = server.attempts.get(item_id, 0)
+                server.attempts[item_id] = attempt + 1
+            if server.roll("null", item_id) < server.null_rate:
+                body = None
+            if server.roll("slow", item_id, attempt) < server.slow_rate:
+                time.sleep(server.slow_latency)
+            if server.roll("fail", item_id, attempt) < server.fail_rate:
+                self.send_error(500)
+                return
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """
+        Silences the default per-request logging to stderr.
+        """
+
+
+class StubServer(ThreadingHTTPServer):  # pylint: disable=too-many-instance-attributes
+    """
+    The threaded HTTP server behind the stand-in, quiet about clients that hang up.
+
+    It listens on a free port of 127.0.0.1 and holds what the handler serves, with the
+    same parameters as `start_stub_server`.
+    """
+
+    daemon_threads = True
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        items,
+        latency=0.0,
+        top_ids=None,
+        fail_rate=0.0,
+        slow_rate=0.0,
+        slow_latency=1.0,
+        null_rate=0.0,
+        seed=0,
+        feed_ids=None,
+    ):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.items = items
+        self.top_ids = list(items) if top_ids is None else top_ids
+        self.updated_ids = []
+        self.feed_ids = dict(feed_ids or {})
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.null_rate = null_rate
+        self.seed = seed
+        # Requests seen per item id, so retries draw new faults
+        self.attempts = {}
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}/v0"
+
+    def roll(self, *key):
+        """
+        Returns a number in [0, 1) fixed by the seed and `key`, to decide on a fault.
+        """
+        return random.Random(":".join(map(str, (self.seed,) + key))).random()
+
+    def handle_error(self, request, client_address):
+        """
+        Ignores connections dropped by clients, e.g. a fetcher that gave up on a slow
+        answer, and reports anything else as usual.
+        """
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub_server(
+    items,
+    latency=0.0,
+    top_ids=None,
+    fail_rate=0.0,
+    slow_rate=0.0,
+    slow_latency=1.0,
+    null_rate=0.0,
+    seed=0,
+    feed_ids=None,
+):
+    """
+    Starts the stand-in Hacker News server on a background thread.
+
+    Parameters:
+    - items (dict): Items to serve, keyed by id.
+    - latency (float): Seconds to sleep before answering each request.
+    - top_ids (list): The ids returned by `topstories.json`; defaults to all items.
+    - fail_rate (float): Share of item requests answered with a 500 error.
+    - slow_rate (float): Share of item requests delayed by `slow_latency` seconds.
+    - slow_latency (float): Extra seconds a slow item request takes.
+    - null_rate (float): Share of items always served as null.
+    - seed (int): Seed for which requests misbehave.
+    - feed_ids (dict): The ids returned by the other story lists, keyed by their name
+      in the API path, e.g. "newstories"; lists not given are empty.
+
+    Returns:
+    - StubServer: The running server, with a `base_url` attribute pointing at
+      its `/v0` root, a `request_count` counter and an `updated_ids` list served by
+      `updates.json`. Call `shutdown()` when finished.
+    """
+    server = StubServer(
+        items, latency, top_ids, fail_rate, slow_rate, slow_latency, null_rate, seed, feed_ids
+    )
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,271 @@
+"""
+Module: comments.py
+
+This module fetches the comment threads of stories and stores them in the database.
+
+Threads are fetched breadth first and in parallel, with limits on their depth, on
+the comments per story and on the time the whole stage may take. The comments go into
+the `comments` table, the edges from each story or comment to its kids into
+`story_kids`, and `comment_threads` records when each thread was fetched and the
+story's comment count at the time, so that threads whose count has not changed are
+not fetched again.
+
+Functions:
+- get_comment_trees(session, stories, concurrency, base_url, stats, deadline, retries,
+  max_depth, max_count): Fetches the comment trees of several stories breadth first.
+- insert_comments_into_db(threads, comments, edges, db_path, connection): Replaces
+  the stored comment threads of some stories.
+- fetch_comments(stories, session, concurrency, base_url, stats, deadline, retries,
+  db_path, connection): Fetches and stores the comment threads that need it.
+
+Usage:
+`fetch.run_fetch` calls `fetch_comments` for the first stories of the news page when
+run with `fetch.py --comments N`.
+
+Example:
+fetch_comments(stories[:30], deadline=10)
+"""
+import json
+import time
+from db import open_database
+from hn_client import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RETRIES,
+    HN_API_URL,
+    FetchController,
+    convert_time,
+    create_session,
+    fetch_items,
+)
+
+# Limits of the optional comment stage: levels of replies below each story, comments
+# per story, and seconds the whole stage may take
+COMMENT_MAX_DEPTH = 5
+COMMENT_MAX_COUNT = 200
+COMMENT_DEADLINE = 20
+
+# Seconds after which a story's thread is fetched again even if its comment count has
+# not changed, so that edited comments are picked up
+COMMENT_MAX_AGE = 3600
+
+
+def get_comment_trees(
+    session,
+    stories,
+    concurrency=DEFAULT_CONCURRENCY,
+    base_url=HN_API_URL,
+    stats=None,
+    deadline=COMMENT_DEADLINE,
+    retries=DEFAULT_RETRIES,
+    max_depth=COMMENT_MAX_DEPTH,
+    max_count=COMMENT_MAX_COUNT,
+):
+    """
+    Fetches the comment trees of several stories, breadth first and in parallel.
+
+    The trees are walked one level at a time for all stories together: every kid of
+    the current level is fetched concurrently through one FetchController, and the
+    kids of the fetched comments form the next level. Top-level comments therefore
+    come first, and each story stops once `max_count` of its comments have been
+    requested. After the deadline no new request is started, so the stage takes at
+    most about `deadline` seconds.
+
+    Parameters:
+    - session (requests.Session): The session to issue the requests on.
+    - stories (list): The story items, with their `kids` lists.
+    - concurrency (int): The maximum number of concurrent item requests.
+    - base_url (str): The root of the Hacker News API.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - deadline (float): Seconds the stage may take; None for no limit.
+    - retries (int): Retries per request after the first attempt.
+    - max_depth (int): Levels of replies to fetch below each story.
+    - max_count (int): Comments to request per story.
+
+    Returns:
+    - tuple: The fetched comments as (story id, item) pairs, the (parent id, position,
+      kid id) edges leading to them, and the set of ids of the stories whose thread was
+      cut short because a comment could not be fetched, e.g. at the deadline.
+    """
+    controller = FetchController(session, base_url, concurrency, deadline, retries, stats)
+    budget = {story["id"]: max_count for story in stories}
+    level = [(story["id"], story) for story in stories]
+    comments = []
+    edges = []
+    incomplete = set()
+    for _ in range(max_depth):
+        wanted = []
+        for story_id, parent in level:
+            for position, kid_id in enumerate(parent.get("kids", []), 1):
+                if budget[story_id] == 0:
+                    break
+                budget[story_id] -= 1
+                wanted.append((story_id, parent["id"], position, kid_id))
+        if not wanted:
+            break
+
+        kid_ids = [entry[3] for entry in wanted]
+        items = fetch_items(session, kid_ids, concurrency, base_url, stats, controller)
+        level = []
+        for (story_id, parent_id, position, kid_id), item in zip(wanted, items):
+            if item is None:
+                incomplete.add(story_id)
+                continue
+            comments.append((story_id, item))
+            edges.append((parent_id, position, kid_id))
+            level.append((story_id, item))
+    return comments, edges, incomplete
+
+
+def insert_comments_into_db(threads, comments, edges, db_path="stories.db", connection=None):
+    """
+    Replaces the stored comment threads of some stories.
+
+    The old comments and edges of the stories are deleted and the new ones inserted
+    with batched `executemany` calls, all in one transaction, so readers see either
+    the old or the new thread. Threads of stories that are in neither `new_stories`
+    nor `stories` any more are removed as well.
+
+    Parameters:
+    - threads (dict): The comment count (`descendants`) of each story whose thread was
+      fetched, keyed by story id; None for a thread that was cut short.
+    - comments (list): (story id, item) pairs, as returned by `get_comment_trees`.
+    - edges (list): (parent id, position, kid id) tuples, as returned by
+      `get_comment_trees`.
+    - db_path (str): Path to the SQLite database.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening one to `db_path`.
+    """
+    now = int(time.time())
+    story_list = json.dumps(list(threads))
+    with open_database(db_path, connection) as conn:
+        with conn:
+            conn.execute(
+                """DELETE FROM story_kids WHERE kid_id IN (
+                    SELECT id FROM comments WHERE story_id IN (SELECT value FROM json_each(?))
+                )""",
+                (story_list,),
+            )
+            conn.execute(
+                "DELETE FROM comments WHERE story_id IN (SELECT value FROM json_each(?))",
+                (story_list,),
+            )
+            conn.executemany(
+                """INSERT INTO comments (id, story_id, by, time, text, deleted)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    story_id = excluded.story_id,
+                    by = excluded.by,
+                    time = excluded.time,
+                    text = excluded.text,
+                    deleted = excluded.deleted""",
+                [
+                    (
+                        item["id"],
+                        story_id,
+                        item.get("by", ""),
+                        convert_time(item.get("time", 0)),
+                        item.get("text", ""),
+                        int(bool(item.get("deleted") or item.get("dead"))),
+                    )
+                    for story_id, item in comments
+                ],
+            )
+            conn.executemany(
+                """INSERT INTO story_kids (parent_id, position, kid_id) VALUES (?, ?, ?)
+                ON CONFLICT DO NOTHING""",
+                edges,
+            )
+            conn.executemany(
+                """INSERT INTO comment_threads (story_id, descendants, fetched_at) VALUES (?, ?, ?)
+                ON CONFLICT (story_id) DO UPDATE SET
+                    descendants = excluded.descendants, fetched_at = excluded.fetched_at""",
+                [(story_id, descendants, now) for story_id, descendants in threads.items()],
+            )
+
+            # Forget the threads of stories that are gone
+            conn.execute(
+                """DELETE FROM comment_threads
+                WHERE story_id NOT IN (SELECT id FROM new_stories)
+                AND story_id NOT IN (SELECT id FROM stories)"""
+            )
+            conn.execute(
+                "DELETE FROM comments WHERE story_id NOT IN (SELECT story_id FROM comment_threads)"
+            )
+            conn.execute("DELETE FROM story_kids WHERE kid_id NOT IN (SELECT id FROM comments)")
+
+
+def fetch_comments(
+    stories,
+    session=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    base_url=HN_API_URL,
+    stats=None,
+    deadline=COMMENT_DEADLINE,
+    retries=DEFAULT_RETRIES,
+    db_path="stories.db",
+    connection=None,
+):
+    """
+    Fetches and stores the comment threads of the stories that need it.
+
+    A story's thread is fetched if it has not been fetched before, if the story's
+    comment count (`descendants`) has changed since, or if it is older than
+    COMMENT_MAX_AGE seconds. A thread cut short, e.g. by the deadline, is stored as far
+    as it was fetched but without a comment count, so the next run fetches it again.
+
+    Parameters:
+    - stories (list): The story items, with their `kids` lists.
+    - session (requests.Session): Optional session to reuse; one is created if omitted.
+    - concurrency (int): The maximum number of concurrent item requests.
+    - base_url (str): The root of the Hacker News API.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - deadline (float): Seconds the stage may take; None for no limit.
+    - retries (int): Retries per request after the first attempt.
+    - db_path (str): Path to the SQLite database.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening one to `db_path`.
+
+    Returns:
+    - int: The number of comments stored.
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(concurrency)
+
+    try:
+        with open_database(db_path, connection) as conn:
+            cursor = conn.execute(
+                """SELECT story_id, descendants, fetched_at FROM comment_threads
+                WHERE story_id IN (SELECT value FROM json_each(?))""",
+                (json.dumps([story["id"] for story in stories]),),
+            )
+            threads = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+            now = int(time.time())
+            due = [
+                story
+                for story in stories
+                if story["id"] not in threads
+                or threads[story["id"]][0] != story.get("descendants")
+                or now - threads[story["id"]][1] >= COMMENT_MAX_AGE
+            ]
+            if not due:
+                return 0
+
+            comments, edges, incomplete = get_comment_trees(
+                session, due, concurrency, base_url, stats, deadline, retries
+            )
+            insert_comments_into_db(
+                {
+                    story["id"]: None if story["id"] in incomplete else story.get("descendants")
+                    for story in due
+                },
+                comments,
+                edges,
+                db_path,
+                conn,
+            )
+        print(f"stored {len(comments)} comments of {len(due)} stories")
+        return len(comments)
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,255 @@
+"""
+Module: db.py
+
+This module is the single place the application opens SQLite connections.
+
+Each thread keeps one long-lived connection to the stories database, configured
+once with the pragmas below, and every request handled on that thread reuses it
+through Flask's application context. The database runs in WAL mode, so the fetcher
+writing new stories never blocks readers and readers never block the fetcher.
+
+The module also keeps the data version stamp: a small file next to the database that
+is rewritten whenever the news data changes. Responses derived only from the news
+data can be cached, and validated, against the stamp without querying SQLite.
+
+Functions:
+- database_path(value): Normalizes the configured database location to a file path.
+- connect(path): Opens a new, fully configured connection to the database.
+- open_database(db_path, connection): Yields a migrated connection to the database.
+- get_db(): Returns the connection for the current request or thread.
+- release_db(exception): Returns the request's connection to a clean state.
+- init_app(app): Registers the connection handling with a Flask application.
+- configured_path(): Returns the database path configured for the current app.
+- bump_data_version(path): Records that the news data has changed.
+- data_version(path): Returns the current data version stamp and when it was set.
+
+Usage:
+Call `init_app(app)` once after creating the application, then use `get_db()` in
+route handlers and decorators instead of calling `sqlite3.connect` directly.
+
+Example:
+connection = get_db()
+cursor = connection.cursor()
+cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+from flask import current_app, g, has_app_context
+from metrics import TimedConnection
+from migrations import migrate
+
+DEFAULT_DATABASE = "stories.db"
+
+# Milliseconds a connection waits for a lock held by another one before giving up
+BUSY_TIMEOUT_MS = 5000
+
+# Bytes of the database file mapped into memory
+MMAP_SIZE = 64 * 1024 * 1024
+
+# Page cache per connection, in KiB (negative values are KiB in SQLite)
+CACHE_SIZE_KIB = 16 * 1024
+
+_local = threading.local()
+
+# Last stamp read per stamp file, keyed by path: (stat signature, version, modified)
+_version_cache = {}
+
+
+def database_path(value=None):
+    """
+    Normalizes the configured database location to a file path.
+
+    Accepts either a plain path or a SQLAlchemy style `sqlite:///` URL.
+
+    Parameters:
+    - value (str): The configured database location; defaults to DEFAULT_DATABASE.
+
+    Returns:
+    - str: The path of the SQLite database file.
+    """
+    value = value or DEFAULT_DATABASE
+    if value.startswith("sqlite:///"):
+        return value[len("sqlite:///"):]
+    return value
+
+
+def connect(path=DEFAULT_DATABASE):
+    """
+    Opens a new, fully configured connection to the database.
+
+    Switches the database to WAL journal mode and applies the busy timeout,
+    synchronous level, memory map size and cache size to the connection. Its
+    cursors report their time to the request metrics.
+
+    Parameters:
+    - path (str): The path of the SQLite database file.
+
+    Returns:
+    - sqlite3.Connection: The configured connection.
+    """
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, factory=TimedConnection)
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # NORMAL is durable across application crashes in WAL mode; only a power loss
+    # can roll back the most recent commits
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    cursor.close()
+    return connection
+
+
+@contextmanager
+def open_database(db_path=DEFAULT_DATABASE, connection=None):
+    """
+    Yields a connection to the stories database, migrated to the current schema.
+
+    Parameters:
+    - db_path (str): Path to the SQLite database.
+    - connection (sqlite3.Connection): An open connection to use instead; it is left
+      open, and is assumed to be migrated already.
+
+    Yields:
+    - sqlite3.Connection: The connection.
+    """
+    if connection is not None:
+        yield connection
+        return
+    with closing(connect(db_path)) as new_connection:
+        migrate(new_connection)
+        yield new_connection
+
+
+def get_db():
+    """
+    Returns the connection for the current request or thread.
+
+    Inside an application context the connection is cached on `g` for the rest of
+    the request. Each thread opens its connection once and keeps it across requests,
+    so the pragmas, and the schema migration, are only applied the first time.
+
+    Returns:
+    - sqlite3.Connection: The connection to the configured database.
+    """
+    if has_app_context():
+        if "db" not in g:
+            g.db = _thread_connection(database_path(current_app.config.get("DATABASE")))
+        return g.db
+    return _thread_connection(DEFAULT_DATABASE)
+
+
+def _thread_connection(path):
+    """
+    Returns this thread's connection to `path`, opening it on first use.
+
+    A newly opened connection brings the database schema up to date before it is
+    handed out, so the configured database is migrated by the first request that
+    uses it rather than when the application is imported.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if path not in connections:
+        connection = connect(path)
+        migrate(connection)
+        connections[path] = connection
+    return connections[path]
+
+
+def release_db(exception=None):  # pylint: disable=unused-argument
+    """
+    Returns the request's connection to a clean state at the end of the request.
+
+    The connection itself stays open for the next request on this thread; any
+    transaction a handler left open, e.g. after an error, is rolled back so that
+    it doesn't hold locks or pin an old snapshot.
+
+    Parameters:
+    - exception (Exception): The exception that ended the request, if any.
+    """
+    connection = g.pop("db", None)
+    if connection is not None and connection.in_transaction:
+        connection.rollback()
+
+
+def init_app(app):
+    """
+    Registers the connection handling with a Flask application.
+
+    Parameters:
+    - app (Flask): The application to register with.
+    """
+    app.config.setdefault("DATABASE", DEFAULT_DATABASE)
+    app.teardown_appcontext(release_db)
+
+
+def configured_path():
+    """
+    Returns the database path configured for the current app, or the default one.
+
+    Caches of data read from the database are keyed on it as well as on the data
+    version, since two databases can be at the same version.
+
+    Returns:
+    - str: The path of the SQLite database file.
+    """
+    if has_app_context():
+        return database_path(current_app.config.get("DATABASE"))
+    return DEFAULT_DATABASE
+
+
+def bump_data_version(path=None):
+    """
+    Records that the news data has changed by writing a new data version stamp.
+
+    Call this after committing a change to the news data. The stamp is replaced
+    atomically, so readers never see a partially written file.
+
+    Parameters:
+    - path (str): The database path; defaults to the configured database.
+
+    Returns:
+    - str: The new data version.
+    """
+    stamp_path = (path or configured_path()) + ".version"
+    version = str(time.time_ns())
+    temp_path = f"{stamp_path}.{os.getpid()}.{threading.get_ident()}"
+    with open(temp_path, "w", encoding="utf-8") as stamp_file:
+        stamp_file.write(version)
+    os.replace(temp_path, stamp_path)
+    return version
+
+
+def data_version(path=None):
+    """
+    Returns the current data version stamp and when it was set.
+
+    Costs a single stat() call while the stamp is unchanged. A database whose data
+    has never been stamped has version "0".
+
+    Parameters:
+    - path (str): The database path; defaults to the configured database.
+
+    Returns:
+    - tuple: The version string and the time it was set as an aware datetime, or
+      None if there is no stamp yet.
+    """
+    stamp_path = (path or configured_path()) + ".version"
+    try:
+        stat = os.stat(stamp_path)
+    except FileNotFoundError:
+        return "0", None
+
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _version_cache.get(stamp_path)
+    if cached is None or cached[0] != signature:
+        with open(stamp_path, encoding="utf-8") as stamp_file:
+            version = stamp_file.read().strip() or "0"
+        modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        cached = _version_cache[stamp_path] = (signature, version, modified)
+    return cached[1], cached[2]
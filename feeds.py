@@ -0,0 +1,364 @@
+"""
+Module: feeds.py
+
+This module fetches the Hacker News story lists ("feeds") and stores which feed lists
+which story at which rank.
+
+Besides the top stories, the new, best, ask, show and job feeds (FEEDS) can be
+fetched in the same run. Every item is downloaded once however many feeds list it;
+its content is stored in the `stories` table and `feed_items` records which feed
+lists it at which rank, its position in the feed's API list.
+
+In incremental mode the raw items are kept in the `item_cache` table, and only items
+that are new to the feeds, listed in the API's `updates.json` feed, or older than
+the maximum age of their rank's tier are downloaded again. The tiers (REFRESH_TIERS)
+refresh the front page every minute, the next pages every five minutes and the long
+tail hourly, so each run only downloads what is due.
+
+Functions:
+- is_live_story(item): Tells whether an item can be listed on the news page.
+- get_feed_ids(controller, feeds): Fetches the item id lists of several feeds.
+- feed_stories(feed_ids, items): Builds each feed's ranked story list from the fetched
+  items.
+- get_feeds(feeds, concurrency, session, base_url, stats, deadline, retries): Fetches
+  the latest stories of several feeds, each item once.
+- max_age_for_rank(rank, tiers): Returns how long an item at a rank may stay cached.
+- get_feeds_incremental(feeds, concurrency, session, base_url, tiers, db_path, stats,
+  deadline, retries, connection): Fetches the latest stories of several feeds through
+  the item cache.
+- insert_feeds_into_db(feed_data, db_path, stats, connection): Stores the stories of
+  several feeds and their ranks in `feed_items`.
+
+Usage:
+`fetch.run_fetch` calls these for the feeds picked with `fetch.py --feeds`.
+
+Example:
+feed_data = get_feeds(("top", "ask"))
+insert_feeds_into_db(feed_data)
+"""
+import json
+import time
+from db import open_database
+from hn_client import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RETRIES,
+    HN_API_URL,
+    FetchController,
+    create_session,
+    fetch_items,
+    story_row,
+)
+
+# The Hacker News story lists, by the name the app uses for them, and their API paths
+FEEDS = {
+    "top": "topstories.json",
+    "new": "newstories.json",
+    "best": "beststories.json",
+    "ask": "askstories.json",
+    "show": "showstories.json",
+    "job": "jobstories.json",
+}
+
+# updates.json only covers the last few minutes, so cached items are also refreshed
+# once they are older than the maximum age of their rank's tier: (last rank of the
+# tier, maximum age in seconds), with None for every rank after the previous tiers.
+# The front page changes fastest and gets most of the traffic.
+REFRESH_TIERS = ((30, 60), (100, 300), (None, 3600))
+
+# Items due within this many seconds are refreshed early, so that a run scheduled
+# every DAEMON_INTERVAL seconds (fetch.py), give or take its jitter, does not skip them
+REFRESH_SLACK = 10
+
+# Seconds cached items are kept after they were last seen in the top list, so that
+# stories that drop out and come back are not downloaded again
+ITEM_CACHE_TTL = 86400
+
+
+def is_live_story(item):
+    """
+    Tells whether an item can be listed on the news page.
+
+    Parameters:
+    - item (dict): The item as returned by the API.
+
+    Returns:
+    - bool: False for deleted or dead items and items without a score or time, which
+      the API returns for removed stories.
+    """
+    return not (item.get("deleted") or item.get("dead")) and "score" in item and "time" in item
+
+
+def get_feed_ids(controller, feeds):
+    """
+    Fetches the item id lists of several feeds.
+
+    Parameters:
+    - controller (FetchController): The controller to issue the requests through.
+    - feeds (tuple): Names of feeds in FEEDS.
+
+    Returns:
+    - dict: The ids of each feed, in the API's order, keyed by feed name. Feeds whose
+      list could not be fetched are left out.
+    """
+    feed_ids = {}
+    for feed in feeds:
+        ids = controller.get_json(FEEDS[feed])
+        if ids is not None:
+            feed_ids[feed] = ids
+    return feed_ids
+
+
+def feed_stories(feed_ids, items):
+    """
+    Builds each feed's ranked story list from the items fetched for all feeds.
+
+    Parameters:
+    - feed_ids (dict): The ids of each feed, keyed by feed name.
+    - items (dict): The available items, keyed by id.
+
+    Returns:
+    - dict: The (rank, story) pairs of each feed, in the API's order, where rank is the
+      1-based position in the feed's id list. Items that are not available and items
+      that cannot be listed (see `is_live_story`) are left out, without renumbering
+      the rest.
+    """
+    return {
+        feed: [
+            (rank, items[x])
+            for rank, x in enumerate(ids, 1)
+            if x in items and is_live_story(items[x])
+        ]
+        for feed, ids in feed_ids.items()
+    }
+
+
+def get_feeds(
+    feeds=("top",),
+    concurrency=DEFAULT_CONCURRENCY,
+    session=None,
+    base_url=HN_API_URL,
+    stats=None,
+    deadline=None,
+    retries=DEFAULT_RETRIES,
+):
+    """
+    Fetches the latest stories of several Hacker News feeds.
+
+    Retrieves the id list of every feed, then fetches each item once, however many
+    feeds list it, keeping up to `concurrency` item requests in flight over one shared
+    connection pool. Items that cannot be fetched within their retries or before the
+    deadline are left out.
+
+    Parameters:
+    - feeds (tuple): Names of feeds in FEEDS.
+    - concurrency (int): The maximum number of concurrent item requests.
+    - session (requests.Session): Optional session to reuse; one is created if omitted.
+    - base_url (str): The root of the Hacker News API.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - deadline (float): Seconds the run may take; None for no limit.
+    - retries (int): Retries per request after the first attempt.
+
+    Returns:
+    - dict: The (rank, story) pairs of each feed in the API's order, as built by
+      `feed_stories`, keyed by feed name. Feeds whose id list could not be fetched are
+      left out.
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(concurrency)
+
+    try:
+        controller = FetchController(session, base_url, concurrency, deadline, retries, stats)
+        feed_ids = get_feed_ids(controller, feeds)
+
+        # Every item once, in the order of the first feed listing it
+        item_ids = list(dict.fromkeys(x for ids in feed_ids.values() for x in ids))
+        items = fetch_items(session, item_ids, concurrency, base_url, stats, controller)
+        fetched = {x: item for x, item in zip(item_ids, items) if item is not None}
+
+        if feed_ids:
+            print("retrieved news")
+        return feed_stories(feed_ids, fetched)
+    finally:
+        if own_session:
+            session.close()
+
+
+def max_age_for_rank(rank, tiers=REFRESH_TIERS):
+    """
+    Returns how long an item at a given rank in the top list may stay cached.
+
+    Parameters:
+    - rank (int): The 1-based position of the item in the top list.
+    - tiers (tuple): (last rank, maximum age in seconds) pairs in rank order; a last
+      rank of None covers every remaining rank.
+
+    Returns:
+    - int: The maximum age in seconds of the first tier covering the rank, or of the
+      last tier if none does.
+    """
+    for last_rank, max_age in tiers:
+        if last_rank is None or rank <= last_rank:
+            return max_age
+    return tiers[-1][1]
+
+
+def get_feeds_incremental(
+    feeds=("top",),
+    concurrency=DEFAULT_CONCURRENCY,
+    session=None,
+    base_url=HN_API_URL,
+    tiers=REFRESH_TIERS,
+    db_path="stories.db",
+    stats=None,
+    deadline=None,
+    retries=DEFAULT_RETRIES,
+    connection=None,
+):
+    """
+    Fetches the latest stories of several feeds, re-downloading only new or changed items.
+
+    Reads the feeds' id lists and the API's changed-items list (`updates.json`), then
+    fetches only the items that are not in the local `item_cache` table, are listed
+    as changed, or were cached for longer than their rank's tier allows (less
+    REFRESH_SLACK). The cache is shared by all feeds: an item listed by several feeds
+    is fetched once, at the rate of its best rank. Fetched items are upserted into the
+    cache, every listed item's best rank and last-seen time are updated, and items
+    that have not been in any of the feeds for ITEM_CACHE_TTL seconds are dropped.
+
+    Parameters:
+    - feeds (tuple): Names of feeds in FEEDS.
+    - concurrency (int): The maximum number of concurrent item requests.
+    - session (requests.Session): Optional session to reuse; one is created if omitted.
+    - base_url (str): The root of the Hacker News API.
+    - tiers (tuple): (last rank, maximum age in seconds) pairs deciding when a cached
+      item is fetched again regardless; see REFRESH_TIERS.
+    - db_path (str): Path to the SQLite database holding the item cache.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - deadline (float): Seconds the run may take; None for no limit.
+    - retries (int): Retries per request after the first attempt.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening one to `db_path`.
+
+    Returns:
+    - dict: The (rank, story) pairs of each feed, keyed by feed name, the same lists
+      `get_feeds` would return. Items that could not be fetched are taken from the
+      cache if it has them, and left out otherwise.
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(concurrency)
+
+    try:
+        controller = FetchController(session, base_url, concurrency, deadline, retries, stats)
+        feed_ids = get_feed_ids(controller, feeds)
+        if not feed_ids:
+            return {}
+
+        updates = controller.get_json("updates.json") or {}
+        changed = set(updates.get("items", []))
+
+        # The best rank of every listed item, in the order of the first feed listing it
+        ranks = {}
+        for ids in feed_ids.values():
+            for rank, x in enumerate(ids, 1):
+                ranks[x] = min(ranks.get(x, rank), rank)
+
+        with open_database(db_path, connection) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, data, fetched_at FROM item_cache")
+            cached = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+            now = int(time.time())
+            due = [
+                x
+                for x, rank in ranks.items()
+                if x not in cached
+                or x in changed
+                or now - cached[x][1] >= max_age_for_rank(rank, tiers) - REFRESH_SLACK
+            ]
+            items = fetch_items(session, due, concurrency, base_url, stats, controller)
+            fetched = {x: item for x, item in zip(due, items) if item is not None}
+
+            cursor.executemany(
+                """INSERT INTO item_cache (id, data, fetched_at) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    data = excluded.data, fetched_at = excluded.fetched_at""",
+                [(x, json.dumps(item), now) for x, item in fetched.items()],
+            )
+            # Items that left the feeds keep their data for a while but lose their rank
+            cursor.execute("UPDATE item_cache SET rank = NULL WHERE rank IS NOT NULL")
+            cursor.executemany(
+                "UPDATE item_cache SET rank = ?, last_seen = ? WHERE id = ?",
+                [(rank, now, x) for x, rank in ranks.items()],
+            )
+            cursor.execute(
+                "DELETE FROM item_cache WHERE last_seen IS NULL OR last_seen < ?",
+                (now - ITEM_CACHE_TTL,),
+            )
+            conn.commit()
+
+        available = {x: json.loads(cached[x][0]) for x in ranks if x in cached and x not in fetched}
+        available.update(fetched)
+        print(f"retrieved news ({len(fetched)} of {len(ranks)} items fetched)")
+        return feed_stories(feed_ids, available)
+    finally:
+        if own_session:
+            session.close()
+
+
+def insert_feeds_into_db(feed_data, db_path="stories.db", stats=None, connection=None):
+    """
+    Stores the stories of several feeds and which feed lists them at which rank.
+
+    Every story is upserted once into the `stories` table, however many feeds list it,
+    and each feed's rows in `feed_items` are replaced by its new list, keeping each
+    story's rank in the feed as the API lists it. Feeds missing from `feed_data` keep
+    their previous list. Stories that are in no feed and have no votes are removed.
+    Everything is written in one transaction; call `fetch.insert_data_into_db`
+    afterwards, and bump the data version.
+
+    Parameters:
+    - feed_data (dict): The (rank, story) pairs of each feed, as returned by
+      `get_feeds`, keyed by feed name.
+    - db_path (str): Path to the SQLite database.
+    - stats (FetchStats): Optional collector for the write duration.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening one to `db_path`.
+    """
+    rows = {}
+    memberships = []
+    for feed, ranked in feed_data.items():
+        for _, story in ranked:
+            rows.setdefault(story.get("id"), story)
+        memberships.append((feed, [(feed, rank, story.get("id")) for rank, story in ranked]))
+
+    started = time.perf_counter()
+    with open_database(db_path, connection) as conn:
+        with conn:
+            conn.executemany(
+                """INSERT INTO stories (id, by, descendants, score, time, title, url, type, text)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    by = excluded.by,
+                    descendants = excluded.descendants,
+                    score = excluded.score,
+                    time = excluded.time,
+                    title = excluded.title,
+                    url = excluded.url,
+                    type = excluded.type,
+                    text = excluded.text""",
+                [story_row(story) for story in rows.values()],
+            )
+            for feed, feed_rows in memberships:
+                conn.execute("DELETE FROM feed_items WHERE feed = ?", (feed,))
+                conn.executemany(
+                    "INSERT INTO feed_items (feed, rank, item_id) VALUES (?, ?, ?)", feed_rows
+                )
+            conn.execute(
+                """DELETE FROM stories
+                WHERE id NOT IN (SELECT item_id FROM feed_items)
+                AND id NOT IN (SELECT story_id FROM story_likes)"""
+            )
+    if stats is not None:
+        stats.db_write_seconds = (stats.db_write_seconds or 0.0) + time.perf_counter() - started
@@ -7,118 +7,601 @@ local SQLite database.
 It retrieves the latest news from Hacker News API, formats the data, 
 and updates the local database with the new information.
 
-The module includes functions to convert Unix epoch time to a human-readable format,
-fetch news data from Hacker News API, and insert this data into a SQLite database.
+The module includes functions to fetch news data from Hacker News API and insert
+this data into a SQLite database. The API requests themselves are made by the client
+in hn_client.py, the story lists by feeds.py and the comment threads by comments.py.
+
+With `--daemon` the script stays resident instead of running once: it keeps its HTTP
+session and database connection open, refreshes the stories on a jittered interval,
+holds a lock file so that only one daemon runs at a time, and exits after the current
+run on SIGTERM or SIGINT.
+
+Every run started from the command line is recorded in the `fetch_runs` table: when
+it ran, how many items were requested, fetched and failed, the HTTP latency
+percentiles, the bytes downloaded, and how many rows were written and how long the
+database write took.
+
+Besides the top stories, the new, best, ask, show and job feeds can be fetched in the
+same run with `--feeds`; by default only the top feed is. The top feed is also
+swapped in as the `new_stories` table.
+
+With `--comments N` the comment threads of the first N stories of the news page are
+fetched as well, breadth first with depth, count and time limits.
+
+In incremental mode only items that are new, changed or due for a refresh by their
+rank are downloaded; see feeds.py.
 
 Functions:
-- convert_time(epoch_time): Converts Unix epoch time to a readable datetime string.
-- get_hacker_news_data(): Fetches the latest news data from Hacker News API.
-- insert_data_into_db(data): Inserts fetched news data into the SQLite database.
+- sort_stories(stories_dicts): Sorts stories the way they are shown on the news page.
+- get_hacker_news_data(concurrency, session, base_url, stats, deadline, retries): Fetches
+  the latest news data from Hacker News API.
+- get_hacker_news_data_incremental(concurrency, session, base_url, tiers, db_path,
+  stats, deadline, retries, connection): Fetches the latest news data, re-downloading
+  only new or changed items.
+- insert_data_into_db(data, db_path, stats, connection, bump_version): Loads fetched
+  news data into a shadow table and atomically swaps it in as the `new_stories` table.
+- record_fetch_run(stats, status, error, db_path, connection): Records a fetch run in the
+  `fetch_runs` ledger.
+- run_fetch(incremental, concurrency, db_path, connection, feeds, comments,
+  comment_deadline): Fetches the latest news into the database and records the run.
+- run_daemon(interval, jitter, lock_path, stop, incremental, concurrency, db_path): Runs
+  a fetch every interval until stopped, keeping the HTTP pool and database warm.
 
 Usage:
 This script can be run as a standalone script to update the local database with
-the latest news from Hacker News.
+the latest news from Hacker News. The API root can be overridden with the
+`HN_API_URL` environment variable, e.g. to point at a local stand-in server.
 
 Example:
 python3 fetch.py
+python3 fetch.py --concurrency 32
+python3 fetch.py --incremental
+python3 fetch.py --feeds top new best ask show job
+python3 fetch.py --comments 30 --comment-deadline 10
+python3 fetch.py --deadline 30 --retries 5
+python3 fetch.py --daemon --incremental --interval 30
 """
+import argparse
+import fcntl
+import os
+import random
+import signal
 import sqlite3
+import sys
+import threading
+import time
+import traceback
+from contextlib import closing
 from datetime import datetime
 from operator import itemgetter
-import requests
+from comments import COMMENT_DEADLINE, fetch_comments
+from db import bump_data_version, connect, open_database
+from feeds import FEEDS, REFRESH_TIERS, get_feeds, get_feeds_incremental, insert_feeds_into_db
+from hn_client import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RETRIES,
+    HN_API_URL,
+    FetchStats,
+    create_session,
+    story_row,
+)
+from migrations import NEW_STORIES_COLUMNS, NEW_STORIES_INDEXES, migrate, split_statements
+
+# Seconds a command line run may take
+DEFAULT_DEADLINE = 120
+
+# Seconds between runs in daemon mode, and the fraction of it runs are spread by
+DAEMON_INTERVAL = 60
+DAEMON_JITTER = 0.1
+
 
-def convert_time(epoch_time):
+def sort_stories(stories_dicts):
     """
-    Converts Unix epoch time to a human-readable datetime string.
+    Sorts stories the way they are shown on the news page.
 
     Parameters:
-    - epoch_time (int): The time in Unix epoch format.
+    - stories_dicts (list): A list of story dictionaries, in top list order.
 
     Returns:
-    - str: A formatted time string in the format '%Y-%m-%d %H:%M:%S'.
+    - list: The stories sorted first by score in ascending order, then by time in
+      descending order.
     """
-    # Convert Unix epoch time to datetime
-    dt_object = datetime.fromtimestamp(epoch_time)
+    # First, sort the news items by 'score' in ascending order
+    stories_dicts = sorted(stories_dicts, key=itemgetter("score"))
 
-    # Format the datetime object as a string
-    formatted_time = dt_object.strftime("%Y-%m-%d %H:%M:%S")
+    # Then, sort by 'time' in descending order (newest first)
+    return sorted(stories_dicts, key=itemgetter("time"), reverse=True)
 
-    return formatted_time
 
-
-def get_hacker_news_data():
+def get_hacker_news_data(
+    concurrency=DEFAULT_CONCURRENCY,
+    session=None,
+    base_url=HN_API_URL,
+    stats=None,
+    deadline=None,
+    retries=DEFAULT_RETRIES,
+):
     """
     Fetches the latest news data from Hacker News API.
 
-    Retrieves top story IDs from Hacker News API and fetches individual story data. 
-    Sorts the stories first by score in ascending order, then by time in descending order.
+    Retrieves top story IDs from Hacker News API and fetches individual story data,
+    keeping up to `concurrency` item requests in flight over one shared connection pool.
+    Items that cannot be fetched within their retries or before the deadline are left
+    out. Sorts the stories first by score in ascending order, then by time in
+    descending order.
+
+    Parameters:
+    - concurrency (int): The maximum number of concurrent item requests.
+    - session (requests.Session): Optional session to reuse; one is created if omitted.
+    - base_url (str): The root of the Hacker News API.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - deadline (float): Seconds the run may take; None for no limit.
+    - retries (int): Retries per request after the first attempt.
 
     Returns:
     - list: A list of dictionaries containing sorted news stories.
     """
-    url = "https://hacker-news.firebaseio.com/v0/topstories.json"
-    response = requests.get(url, timeout=10)
+    feeds = get_feeds(("top",), concurrency, session, base_url, stats, deadline, retries)
+    return sort_stories([story for _, story in feeds.get("top", [])])
 
-    if response.status_code == 200:
-        data = response.json()
-        stories_dicts = []
 
-        for x in data[0:]:
-            url = f"https://hacker-news.firebaseio.com/v0/item/{x}.json"
-            the_story = requests.get(url, timeout=10)
-            the_story_dict = the_story.json()
-            stories_dicts.append(the_story_dict)
+def get_hacker_news_data_incremental(
+    concurrency=DEFAULT_CONCURRENCY,
+    session=None,
+    base_url=HN_API_URL,
+    tiers=REFRESH_TIERS,
+    db_path="stories.db",
+    stats=None,
+    deadline=None,
+    retries=DEFAULT_RETRIES,
+    connection=None,
+):
+    """
+    Fetches the latest news data, re-downloading only new or changed items.
 
-        # First, sort the news items by 'score' in ascending order
-        stories_dicts.sort(key=itemgetter("score"))
+    The top feed of `feeds.get_feeds_incremental`; see there for how items are cached
+    and when they are downloaded again.
 
-        # Then, sort by 'time' in descending order (newest first)
-        sorted_news = sorted(stories_dicts, key=itemgetter("time"), reverse=True)
+    Parameters:
+    - concurrency (int): The maximum number of concurrent item requests.
+    - session (requests.Session): Optional session to reuse; one is created if omitted.
+    - base_url (str): The root of the Hacker News API.
+    - tiers (tuple): (last rank, maximum age in seconds) pairs deciding when a cached
+      item is fetched again regardless; see REFRESH_TIERS.
+    - db_path (str): Path to the SQLite database holding the item cache.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - deadline (float): Seconds the run may take; None for no limit.
+    - retries (int): Retries per request after the first attempt.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening one to `db_path`.
 
-        print("retrieved news")
-        return sorted_news
-    return []
+    Returns:
+    - list: A list of dictionaries containing sorted news stories, the same list
+      `get_hacker_news_data` would return. Items that could not be fetched are taken
+      from the cache if it has them, and left out otherwise.
+    """
+    feeds = get_feeds_incremental(
+        ("top",),
+        concurrency,
+        session,
+        base_url,
+        tiers,
+        db_path,
+        stats,
+        deadline,
+        retries,
+        connection,
+    )
+    return sort_stories([story for _, story in feeds.get("top", [])])
 
 
-def insert_data_into_db(data):
+def insert_data_into_db(data, db_path="stories.db", stats=None, connection=None, bump_version=True):
     """
     Inserts fetched news data into the SQLite database.
 
     Parameters:
     - data (list): A list of news story dictionaries to be inserted into the database.
+    - db_path (str): Path to the SQLite database.
+    - stats (FetchStats): Optional collector for the rows written and write duration.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening one to `db_path`.
+    - bump_version (bool): Whether to bump the data version once the swap has
+      committed; pass False to bump it yourself after further writes.
 
-    Deletes existing records in the database and inserts new data.
+    Loads the new data into a shadow copy of the `new_stories` table in one transaction,
+    then swaps it in place of the live table, and rebuilds its indexes, in a second,
+    very short transaction.
+    Readers therefore always see either the previous or the new complete set of stories,
+    and are only held off for the duration of the swap. The data version stamp is
+    bumped once the swap has committed, unless `bump_version` is False.
     """
-    connection = sqlite3.connect("stories.db")
-    cursor = connection.cursor()
+    rows = []
+    seen = set()
+    for item in data:
+        # new_stories.id is unique; keep the first copy of any repeated story
+        if item.get("id") in seen:
+            continue
+        seen.add(item.get("id"))
+        rows.append(story_row(item))
 
-    # Truncate the table before inserting new data.
-    cursor.execute("DELETE FROM new_stories")
+    started = time.perf_counter()
+    with open_database(db_path, connection) as conn:
+        _swap_in_stories(conn, rows)
+    if bump_version:
+        bump_data_version(db_path)
+    if stats is not None:
+        stats.rows_written = len(rows)
+        stats.db_write_seconds = (stats.db_write_seconds or 0.0) + time.perf_counter() - started
+    print("inserted news in db")
 
-    for item in data:
-        epoch_time = item.get("time", "")  # get time
-        time = convert_time(epoch_time)
-        cursor.execute(
-            """INSERT INTO new_stories (id, by, descendants, score, time, title, url, type, text)
+
+def _swap_in_stories(connection, rows):
+    """
+    Loads story rows into the shadow table and swaps it in as `new_stories`.
+    """
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None  # transactions are managed explicitly below
+    cursor = connection.cursor()
+
+    try:
+        # Fill the shadow table; the live table is untouched while this runs
+        cursor.execute("BEGIN")
+        cursor.execute("DROP TABLE IF EXISTS new_stories_shadow")
+        cursor.execute(f"CREATE TABLE new_stories_shadow {NEW_STORIES_COLUMNS}")
+        cursor.executemany(
+            """INSERT INTO new_stories_shadow
+            (id, by, descendants, score, time, title, url, type, text)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                item.get("id", ""),
-                item.get("by", ""),
-                item.get("descendants", 0),
-                item.get("score", ""),
-                time,
-                item.get("title", ""),
-                item.get("url", ""),
-                item.get("type", ""),
-                item.get("text", ""),
-            ),
+            rows,
+        )
+        # Refresh the kept copies of stories that have votes
+        cursor.execute(
+            """INSERT INTO stories (id, by, score, time, title, url, descendants, type, text)
+            SELECT id, by, score, time, title, url, descendants, type, text
+            FROM new_stories_shadow
+            WHERE id IN (SELECT id FROM stories)
+            ON CONFLICT (id) DO UPDATE SET
+                by = excluded.by,
+                score = excluded.score,
+                time = excluded.time,
+                title = excluded.title,
+                url = excluded.url,
+                descendants = excluded.descendants,
+                type = excluded.type,
+                text = excluded.text"""
         )
+        cursor.execute("COMMIT")
 
-    connection.commit()
-    connection.close()
-    print("inserted news in db")
+        # Swap it in; rowid order is the feed order, so the load order is preserved
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DROP TABLE IF EXISTS new_stories")
+        cursor.execute("ALTER TABLE new_stories_shadow RENAME TO new_stories")
+        for statement in split_statements(NEW_STORIES_INDEXES):
+            cursor.execute(statement)
+        cursor.execute("COMMIT")
+    except sqlite3.Error:
+        if connection.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.close()
+        connection.isolation_level = isolation_level
+
+
+def record_fetch_run(stats, status, error=None, db_path="stories.db", connection=None):
+    """
+    Records a finished fetch run in the `fetch_runs` ledger.
+
+    Parameters:
+    - stats (FetchStats): The statistics collected during the run; the counts of its
+      comment stage, if any, go into the `comments_*` columns.
+    - status (str): "ok" or "failed".
+    - error (str): What went wrong, for a failed run.
+    - db_path (str): Path to the SQLite database.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening one to `db_path`.
+
+    Returns:
+    - int: The id of the ledger row.
+    """
+    def milliseconds(seconds):
+        return None if seconds is None else seconds * 1000
+
+    comments = stats.comments or FetchStats()
+
+    with open_database(db_path, connection) as conn:
+        with conn:
+            cursor = conn.execute(
+                """INSERT INTO fetch_runs (
+                    started_at, finished_at, mode, concurrency, status, error,
+                    items_requested, items_fetched, items_failed,
+                    latency_p50_ms, latency_p95_ms, latency_p99_ms, bytes_downloaded,
+                    rows_written, db_write_ms,
+                    comments_requested, comments_fetched, comments_failed
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    stats.started_at,
+                    time.time(),
+                    stats.mode,
+                    stats.concurrency,
+                    status,
+                    error,
+                    stats.items_requested,
+                    stats.items_fetched,
+                    stats.items_failed,
+                    milliseconds(stats.latency_percentile(0.50)),
+                    milliseconds(stats.latency_percentile(0.95)),
+                    milliseconds(stats.latency_percentile(0.99)),
+                    stats.bytes_downloaded,
+                    stats.rows_written,
+                    milliseconds(stats.db_write_seconds),
+                    comments.items_requested,
+                    comments.items_fetched,
+                    comments.items_failed,
+                ),
+            )
+            return cursor.lastrowid
+
+
+def run_fetch(
+    incremental=False,
+    concurrency=DEFAULT_CONCURRENCY,
+    db_path="stories.db",
+    connection=None,
+    feeds=("top",),
+    comments=0,
+    comment_deadline=COMMENT_DEADLINE,
+    **kwargs,
+):
+    """
+    Fetches the latest news into the database and records the run in the ledger.
+
+    The top feed always is fetched and becomes the `new_stories` table, sorted like the
+    news page; every feed's stories, the top feed's included, are also stored with
+    their API rank through `insert_feeds_into_db`.
+    With `comments`, the comment threads of the first stories of the news page are
+    fetched afterwards, within their own `comment_deadline`, and counted separately in
+    the stats' `comments`.
+    Whatever was fetched before the deadline is written. A run that got no top stories
+    at all, e.g. because the API was down, leaves the stored stories in place and is
+    recorded as failed. A run ended by an error is recorded as failed before the error
+    is raised. The data version is bumped after the run is recorded, so the new
+    stories and the ledger row become visible to the app's caches together.
+
+    Parameters:
+    - incremental (bool): Only download items that are new or changed.
+    - concurrency (int): The maximum number of concurrent item requests.
+    - db_path (str): Path to the SQLite database.
+    - connection (sqlite3.Connection): Optional open connection to use instead of
+      opening new ones to `db_path`.
+    - feeds (tuple): Names of the feeds in FEEDS to fetch besides the top feed.
+    - comments (int): Fetch the comment threads of this many stories from the top of
+      the news page; 0 skips the comment stage.
+    - comment_deadline (float): Seconds the comment stage may take.
+    - kwargs: Passed on to the fetch function, e.g. `session`, `base_url`, `deadline`
+      or `retries`.
+
+    Returns:
+    - FetchStats: The statistics of the run; `rows_written` is None if nothing was
+      written.
+    """
+    stats = FetchStats("incremental" if incremental else "full", concurrency)
+    feeds = ("top",) + tuple(feed for feed in feeds if feed != "top")
+    try:
+        if incremental:
+            feed_data = get_feeds_incremental(
+                feeds,
+                concurrency=concurrency,
+                db_path=db_path,
+                stats=stats,
+                connection=connection,
+                **kwargs,
+            )
+        else:
+            feed_data = get_feeds(feeds, concurrency=concurrency, stats=stats, **kwargs)
+        news_data = sort_stories([story for _, story in feed_data.get("top", [])])
+        if not news_data:
+            record_fetch_run(stats, "failed", "no stories fetched", db_path, connection)
+            return stats
+        insert_feeds_into_db(feed_data, db_path, stats, connection)
+        insert_data_into_db(news_data, db_path, stats, connection, bump_version=False)
+        if comments:
+            stats.comments = FetchStats(stats.mode, concurrency)
+            fetch_comments(
+                news_data[:comments],
+                kwargs.get("session"),
+                concurrency,
+                kwargs.get("base_url", HN_API_URL),
+                stats.comments,
+                comment_deadline,
+                kwargs.get("retries", DEFAULT_RETRIES),
+                db_path,
+                connection,
+            )
+    except Exception as error:
+        # Anything that ends the run, expected or not, is recorded before it propagates
+        record_fetch_run(stats, "failed", repr(error), db_path, connection)
+        if stats.rows_written is not None:
+            bump_data_version(db_path)
+        raise
+    record_fetch_run(stats, "ok", db_path=db_path, connection=connection)
+    # Only now, so that readers caching the latest run by data version see this one
+    bump_data_version(db_path)
+    return stats
+
+
+def run_daemon(
+    interval=DAEMON_INTERVAL,
+    jitter=DAEMON_JITTER,
+    lock_path=None,
+    stop=None,
+    incremental=False,
+    concurrency=DEFAULT_CONCURRENCY,
+    db_path="stories.db",
+    **kwargs,
+):
+    """
+    Keeps the stories fresh by running a fetch every `interval` seconds until stopped.
+
+    One HTTP session and one database connection are kept open for the daemon's
+    lifetime, so runs skip interpreter start-up, imports and connection set-up. Runs
+    start `interval` seconds apart, give or take `jitter` of the interval; a run that
+    overruns the interval is followed by the next one straight away. A run that fails,
+    with whatever error, is logged with its traceback and recorded in the ledger, and
+    the daemon carries on at the next interval.
+
+    Only one daemon can run per lock file: the lock is an exclusive `flock` held for
+    the daemon's lifetime and released by the kernel even if the process is killed.
+
+    Parameters:
+    - interval (float): Seconds between the starts of two runs.
+    - jitter (float): Fraction of the interval the runs are randomly spread by.
+    - lock_path (str): The lock file; defaults to the database path plus ".fetch.lock".
+    - stop (threading.Event): Set to stop the daemon after the current run.
+    - incremental (bool): Only download items that are new or changed.
+    - concurrency (int): The maximum number of concurrent item requests.
+    - db_path (str): Path to the SQLite database.
+    - kwargs: Passed on to `run_fetch`, e.g. `base_url`, `deadline` or `retries`.
+
+    Returns:
+    - int: The number of runs made.
+
+    Raises:
+    - RuntimeError: If another daemon holds the lock file.
+    """
+    lock_path = lock_path or f"{db_path}.fetch.lock"
+    stop = stop or threading.Event()
+    runs = 0
+    with open(lock_path, "a+", encoding="utf-8") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as error:
+            raise RuntimeError(f"another fetch daemon holds {lock_path}") from error
+        lock_file.truncate(0)
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+
+        session = create_session(concurrency)
+        with session, closing(connect(db_path)) as connection:
+            migrate(connection)
+            print(f"fetch daemon started, refreshing every {interval}s", flush=True)
+            while not stop.is_set():
+                started = time.monotonic()
+                try:
+                    stats = run_fetch(
+                        incremental, concurrency, db_path, connection, session=session, **kwargs
+                    )
+                    print(
+                        f"{datetime.now():%Y-%m-%d %H:%M:%S} fetched {stats.items_fetched} items, "
+                        f"{stats.items_failed} failed",
+                        flush=True,
+                    )
+                except Exception as error:  # pylint: disable=broad-exception-caught
+                    # One bad run must not end the daemon; nothing restarts it
+                    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} fetch failed: {error!r}", flush=True)
+                    traceback.print_exc(file=sys.stdout)
+                    sys.stdout.flush()
+                runs += 1
+                delay = interval * random.uniform(1 - jitter, 1 + jitter)
+                stop.wait(max(0.0, started + delay - time.monotonic()))
+            print("fetch daemon stopped", flush=True)
+    return runs
 
 
 if __name__ == "__main__":
-    news_data = get_hacker_news_data()
-    insert_data_into_db(news_data)
+    parser = argparse.ArgumentParser(description="Fetch Hacker News stories into stories.db")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="maximum number of concurrent item requests",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only download items that are new or changed since the last run",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=DEFAULT_DEADLINE,
+        help="seconds the run may take before it keeps what it has",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=DEFAULT_RETRIES, help="retries per failed request"
+    )
+    parser.add_argument(
+        "--feeds",
+        nargs="+",
+        choices=list(FEEDS),
+        default=["top"],
+        help="feeds to fetch, e.g. --feeds top new ask; the top feed is always fetched",
+    )
+    parser.add_argument(
+        "--comments",
+        type=int,
+        default=0,
+        help="fetch the comment threads of this many stories from the top of the news page",
+    )
+    parser.add_argument(
+        "--comment-deadline",
+        type=float,
+        default=COMMENT_DEADLINE,
+        help="seconds the comment stage may take",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="stay resident and refresh the stories every --interval seconds",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DAEMON_INTERVAL,
+        help="seconds between runs in daemon mode",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=DAEMON_JITTER,
+        help="fraction of the interval runs are randomly spread by in daemon mode",
+    )
+    parser.add_argument(
+        "--lock-file", default=None, help="lock file that keeps a second daemon from starting"
+    )
+    args = parser.parse_args()
+
+    if args.daemon:
+        stop_event = threading.Event()
+        # Finish the current run, then exit
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+        try:
+            run_daemon(
+                args.interval,
+                args.jitter,
+                args.lock_file,
+                stop_event,
+                incremental=args.incremental,
+                concurrency=args.concurrency,
+                feeds=tuple(args.feeds),
+                comments=args.comments,
+                comment_deadline=args.comment_deadline,
+                deadline=args.deadline,
+                retries=args.retries,
+            )
+        except RuntimeError as daemon_error:
+            sys.exit(str(daemon_error))
+        sys.exit(0)
+
+    run_stats = run_fetch(
+        incremental=args.incremental,
+        concurrency=args.concurrency,
+        feeds=tuple(args.feeds),
+        comments=args.comments,
+        comment_deadline=args.comment_deadline,
+        deadline=args.deadline,
+        retries=args.retries,
+    )
+    if run_stats.rows_written is None:
+        sys.exit(1)
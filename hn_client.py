@@ -0,0 +1,410 @@
+"""
+Module: hn_client.py
+
+This module is the fetcher's client for the Hacker News API.
+
+Item requests are issued concurrently from a thread pool that shares a single
+keep-alive connection pool, so a run costs a handful of TCP/TLS handshakes instead
+of one per story.
+
+Requests go through a FetchController: failed requests are retried with jittered
+exponential backoff, the number of requests in flight adapts (AIMD) to errors and
+slow answers, and a run stops starting requests at its deadline and keeps what it
+has collected. Items the API returns as null are skipped.
+
+Classes:
+- FetchStats(mode, concurrency): Statistics collected during one fetch run.
+- AdaptiveLimit(maximum, latency_target): An AIMD limit on requests in flight.
+- FetchController(session, base_url, concurrency, deadline, retries, stats): Issues API
+  requests with retries, adaptive concurrency and a deadline.
+
+Functions:
+- convert_time(epoch_time): Converts Unix epoch time to a readable datetime string.
+- timed_get(session, url, stats, timeout): Issues a GET request, recording its latency
+  and size.
+- create_session(pool_size): Creates an HTTP session with a keep-alive connection pool.
+- fetch_item(session, item_id, base_url, stats): Fetches a single item from Hacker News API.
+- fetch_items(session, item_ids, concurrency, base_url, stats, controller): Fetches
+  several items concurrently.
+- story_row(item): Converts an API item to a row of story columns.
+
+Usage:
+The API root can be overridden with the `HN_API_URL` environment variable, e.g. to
+point at a local stand-in server.
+
+Example:
+with create_session() as session:
+    items = fetch_items(session, [8863, 8864])
+"""
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import environ as env
+import requests
+from requests.adapters import HTTPAdapter
+
+HN_API_URL = env.get("HN_API_URL", "https://hacker-news.firebaseio.com/v0")
+
+# Number of item requests kept in flight at once
+DEFAULT_CONCURRENCY = 16
+
+# Retries per request, and the bounds of the jittered exponential backoff between them
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 5.0
+
+# Seconds a single request may take
+REQUEST_TIMEOUT = 10
+
+# Responses slower than this many seconds count as a sign of overload
+LATENCY_TARGET = 2.0
+
+# Factor the concurrency limit is cut by on overload, at most once per LATENCY_TARGET
+DECREASE_FACTOR = 0.5
+
+
+def convert_time(epoch_time):
+    """
+    Converts Unix epoch time to a human-readable datetime string.
+
+    Parameters:
+    - epoch_time (int): The time in Unix epoch format.
+
+    Returns:
+    - str: A formatted time string in the format '%Y-%m-%d %H:%M:%S'.
+    """
+    # Convert Unix epoch time to datetime
+    dt_object = datetime.fromtimestamp(epoch_time)
+
+    # Format the datetime object as a string
+    formatted_time = dt_object.strftime("%Y-%m-%d %H:%M:%S")
+
+    return formatted_time
+
+
+class FetchStats:
+    """
+    Counts, timings and sizes collected during one fetch run, for the `fetch_runs`
+    ledger. The fetch worker threads update it concurrently. The comment stage
+    collects its own FetchStats in `comments`, so comment requests are not counted
+    as story items.
+
+    Parameters:
+    - mode (str): "full" or "incremental".
+    - concurrency (int): The maximum number of concurrent item requests.
+    """
+
+    def __init__(self, mode="full", concurrency=DEFAULT_CONCURRENCY):
+        self.mode = mode
+        self.concurrency = concurrency
+        self.started_at = time.time()
+        self.items_requested = 0
+        self.items_fetched = 0
+        self.items_failed = 0
+        self.latencies = []
+        self.bytes_downloaded = 0
+        self.rows_written = None
+        self.db_write_seconds = None
+        self.comments = None
+        self._lock = threading.Lock()
+
+    def record_request(self, seconds, size):
+        """
+        Records the latency and body size of one HTTP request.
+        """
+        with self._lock:
+            self.latencies.append(seconds)
+            self.bytes_downloaded += size
+
+    def record_item(self, ok):
+        """
+        Records whether an item request succeeded.
+        """
+        with self._lock:
+            if ok:
+                self.items_fetched += 1
+            else:
+                self.items_failed += 1
+
+    def latency_percentile(self, fraction):
+        """
+        Returns the nearest-rank percentile of the request latencies, in seconds.
+
+        Parameters:
+        - fraction (float): The percentile as a fraction, e.g. 0.95.
+
+        Returns:
+        - float: The latency, or None if no request was made.
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def timed_get(session, url, stats=None, timeout=REQUEST_TIMEOUT):
+    """
+    Issues a GET request, recording its latency and size in `stats` when given.
+
+    Parameters:
+    - session (requests.Session): The session to issue the request on.
+    - url (str): The URL to fetch.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - timeout (float): Seconds to wait for the server.
+
+    Returns:
+    - requests.Response: The response.
+    """
+    started = time.perf_counter()
+    response = session.get(url, timeout=timeout)
+    if stats is not None:
+        stats.record_request(time.perf_counter() - started, len(response.content))
+    return response
+
+
+class AdaptiveLimit:
+    """
+    Limits the number of requests in flight, adapting the limit to how the API copes.
+
+    The limit follows AIMD (additive increase, multiplicative decrease): it starts at
+    `maximum`, grows by about one per round of successful requests, and is cut by
+    DECREASE_FACTOR when a request fails or is slower than `latency_target`, at most
+    once per `latency_target` so one burst of slow answers only counts once.
+
+    Parameters:
+    - maximum (int): The highest number of requests allowed in flight.
+    - latency_target (float): Seconds above which a response counts as overload.
+    """
+
+    def __init__(self, maximum=DEFAULT_CONCURRENCY, latency_target=LATENCY_TARGET):
+        self.maximum = max(maximum, 1)
+        self.limit = float(self.maximum)
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline_at=None):
+        """
+        Waits for a free slot.
+
+        Parameters:
+        - deadline_at (float): A time.monotonic() value after which to give up.
+
+        Returns:
+        - bool: True once a slot is taken, False if the deadline passed first.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                timeout = None if deadline_at is None else deadline_at - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    return False
+                self._condition.wait(timeout)
+            if deadline_at is not None and time.monotonic() >= deadline_at:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, failed):
+        """
+        Frees a slot and adjusts the limit from the request's outcome.
+
+        Parameters:
+        - latency (float): Seconds the request took.
+        - failed (bool): Whether the request failed in a way worth retrying.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if failed or latency > self.latency_target:
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class FetchController:
+    """
+    Issues Hacker News API requests with retries, adaptive concurrency and a deadline.
+
+    Failed requests (connection errors, timeouts, 429 and 5xx answers, malformed JSON)
+    are retried up to `retries` times after a jittered exponential backoff. Requests
+    are limited by an AdaptiveLimit. Once the run's deadline has passed no new request
+    is started and every request's timeout is capped by the time left, so a run takes
+    at most about `deadline` seconds and keeps whatever it collected until then.
+
+    Parameters:
+    - session (requests.Session): The session to issue the requests on.
+    - base_url (str): The root of the Hacker News API.
+    - concurrency (int): The highest number of requests in flight.
+    - deadline (float): Seconds the run may take; None for no limit.
+    - retries (int): Retries per request after the first attempt.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    """
+
+    def __init__(
+        self,
+        session,
+        base_url=HN_API_URL,
+        concurrency=DEFAULT_CONCURRENCY,
+        deadline=None,
+        retries=DEFAULT_RETRIES,
+        stats=None,
+    ):
+        self.session = session
+        self.base_url = base_url
+        self.limit = AdaptiveLimit(concurrency)
+        self.deadline_at = None if deadline is None else time.monotonic() + deadline
+        self.retries = retries
+        self.stats = stats
+
+    def get_json(self, path):
+        """
+        Fetches and decodes one API path, retrying failures.
+
+        Parameters:
+        - path (str): The path below the API root, e.g. "topstories.json".
+
+        Returns:
+        - object: The decoded JSON, or None if every attempt failed or the deadline
+          passed.
+        """
+        url = f"{self.base_url}/{path}"
+        for attempt in range(self.retries + 1):
+            if not self.limit.acquire(self.deadline_at):
+                return None
+            timeout = REQUEST_TIMEOUT
+            if self.deadline_at is not None:
+                timeout = max(min(timeout, self.deadline_at - time.monotonic()), 0.1)
+
+            started = time.perf_counter()
+            retry = False
+            value = None
+            try:
+                response = timed_get(self.session, url, self.stats, timeout)
+                if response.status_code == 200:
+                    value = response.json()
+                else:
+                    retry = response.status_code == 429 or response.status_code >= 500
+            except (requests.RequestException, ValueError):
+                retry = True
+            finally:
+                self.limit.release(time.perf_counter() - started, retry)
+
+            if not retry:
+                return value
+            if attempt < self.retries:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+                if self.deadline_at is not None and time.monotonic() + delay >= self.deadline_at:
+                    return None
+                time.sleep(delay)
+        return None
+
+    def fetch_item(self, item_id):
+        """
+        Fetches one item.
+
+        Parameters:
+        - item_id (int): The Hacker News item id.
+
+        Returns:
+        - dict: The item, or None if it could not be fetched or the API has no such item.
+        """
+        item = self.get_json(f"item/{item_id}.json")
+        if self.stats is not None:
+            self.stats.record_item(item is not None)
+        return item
+
+
+def create_session(pool_size=DEFAULT_CONCURRENCY):
+    """
+    Creates an HTTP session with a keep-alive connection pool.
+
+    Parameters:
+    - pool_size (int): The maximum number of pooled connections per host. Should be at
+      least the fetch concurrency so that no worker has to open a throwaway connection.
+
+    Returns:
+    - requests.Session: A session that reuses connections across requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_item(session, item_id, base_url=HN_API_URL, stats=None):
+    """
+    Fetches a single item from Hacker News API, retrying failures.
+
+    Parameters:
+    - session (requests.Session): The session to issue the request on.
+    - item_id (int): The Hacker News item id.
+    - base_url (str): The root of the Hacker News API.
+    - stats (FetchStats): Optional collector for the run's statistics.
+
+    Returns:
+    - dict: The item as returned by the API, or None if it could not be fetched.
+    """
+    return FetchController(session, base_url, 1, stats=stats).fetch_item(item_id)
+
+
+def fetch_items(
+    session,
+    item_ids,
+    concurrency=DEFAULT_CONCURRENCY,
+    base_url=HN_API_URL,
+    stats=None,
+    controller=None,
+):
+    """
+    Fetches several items from Hacker News API concurrently.
+
+    Parameters:
+    - session (requests.Session): The session to issue the requests on.
+    - item_ids (list): The Hacker News item ids to fetch.
+    - concurrency (int): The maximum number of concurrent item requests.
+    - base_url (str): The root of the Hacker News API.
+    - stats (FetchStats): Optional collector for the run's statistics.
+    - controller (FetchController): Optional controller carrying the run's deadline
+      and concurrency limit; one without a deadline is created if omitted.
+
+    Returns:
+    - list: The items, in the same order as `item_ids`, with None for items that
+      could not be fetched.
+    """
+    if controller is None:
+        controller = FetchController(session, base_url, concurrency, stats=stats)
+    if stats is not None:
+        stats.items_requested += len(item_ids)
+    with ThreadPoolExecutor(max_workers=controller.limit.maximum) as executor:
+        return list(executor.map(controller.fetch_item, item_ids))
+
+
+def story_row(item):
+    """
+    Converts an API item to a row of story columns.
+
+    Parameters:
+    - item (dict): The item as returned by the API.
+
+    Returns:
+    - tuple: The id, by, descendants, score, time, title, url, type and text columns.
+    """
+    return (
+        item.get("id", ""),
+        item.get("by", ""),
+        item.get("descendants", 0),
+        item.get("score", ""),
+        convert_time(item.get("time", "")),
+        item.get("title", ""),
+        item.get("url", ""),
+        item.get("type", ""),
+        item.get("text", ""),
+    )
@@ -14,6 +14,8 @@ access certain routes.
 
 It checks the user's admin status from the database and redirects 
 non-admin users to a default display page if they attempt to access admin-only routes.
+Admin status is cached per process for ADMIN_CACHE_TTL seconds, so the admin pages'
+many requests don't each pay for a database lookup.
 
 These decorators are essential for maintaining secure and proper access control within
 the application.
@@ -21,6 +23,8 @@ the application.
 Functions:
 - login_required(view_func): Decorator to enforce user authentication for protected routes.
 - admin_required(view_func): Decorator to enforce admin privileges for specific routes.
+- is_admin(user_email): Returns whether a user has admin privileges, using the role cache.
+- invalidate_admin_cache(user_email): Forgets cached admin status after it may have changed.
 
 Usage:
 Decorators can be applied to any Flask route handlers where user authentication or 
@@ -39,9 +43,19 @@ def admin_route():
 
 """
 
+import time
 from functools import wraps
-import sqlite3
 from flask import session, redirect, url_for
+from db import get_db
+
+# Seconds a user's admin status is trusted before it is looked up again
+ADMIN_CACHE_TTL = 60
+
+# Maximum number of users whose admin status is cached
+ADMIN_CACHE_SIZE = 1024
+
+# Cached admin status by email: (is_admin, expiry on the monotonic clock)
+_admin_cache = {}
 
 def login_required(view_func):
     """
@@ -74,7 +88,7 @@ def admin_required(view_func):
     Wraps a view function to ensure the user has admin privileges. 
     If the user is not an admin, redirects them to the main display page.
     Can be applied to any route that should be accessible only by users with admin status.
-    Checks the user's admin status by querying the 'users' table in the database.
+    Checks the user's admin status with is_admin, which caches the 'users' table lookup.
 
     Parameters:
     - view_func (function): The view function that requires admin access.
@@ -87,18 +101,55 @@ def admin_required(view_func):
         user_info = session.get("user", {}).get("userinfo", {})
         user_email = user_info.get("email")
 
-        # Connect to the database
-        connection = sqlite3.connect("stories.db")
-        cursor = connection.cursor()
-
-        # Check if the user is an admin
-        cursor.execute("SELECT admin FROM users WHERE email = ?", (user_email,))
-        result = cursor.fetchone()
-
-        if result is None or result[0] == 0:
+        if not is_admin(user_email):
             # Redirect non-admin users to a different page
             return redirect(url_for("display"))
 
         return view_func(*args, **kwargs)
 
     return decorated_function
+
+
+def is_admin(user_email):
+    """
+    Returns whether a user has admin privileges.
+
+    Looks the user up in the 'users' table and caches the answer for ADMIN_CACHE_TTL
+    seconds. Unknown users are not admins.
+
+    Parameters:
+    - user_email (str): The email of the user to check.
+
+    Returns:
+    - bool: True if the user is an admin.
+    """
+    now = time.monotonic()
+    cached = _admin_cache.get(user_email)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+
+    cursor = get_db().cursor()
+    cursor.execute("SELECT admin FROM users WHERE email = ?", (user_email,))
+    result = cursor.fetchone()
+    admin = result is not None and bool(result[0])
+
+    if len(_admin_cache) >= ADMIN_CACHE_SIZE:
+        _admin_cache.clear()
+    _admin_cache[user_email] = (admin, now + ADMIN_CACHE_TTL)
+    return admin
+
+
+def invalidate_admin_cache(user_email=None):
+    """
+    Forgets cached admin status after it may have changed.
+
+    Should be called whenever a user is deleted or their admin flag is changed. Other
+    worker processes pick up the change within ADMIN_CACHE_TTL seconds.
+
+    Parameters:
+    - user_email (str): The user whose status changed; forgets every user if omitted.
+    """
+    if user_email is None:
+        _admin_cache.clear()
+    else:
+        _admin_cache.pop(user_email, None)
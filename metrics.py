@@ -0,0 +1,349 @@
+"""
+Module: metrics.py
+
+This module records how long the application takes to answer requests and where the
+time goes, and exposes the numbers in the Prometheus text format.
+
+For every endpoint it keeps histograms of the total request time, the time spent in
+SQLite, the time spent rendering templates, the number of SQL statements run and the
+response size. Time spent in SQLite is measured by the cursor class that db.py opens
+every connection with; render time comes from Flask's template signals. Everything
+else (session handling, JSON encoding, ...) is the difference between the total and
+those two.
+
+Recording a request costs a handful of perf_counter() calls and one lock acquisition,
+so the metrics are always on. Each process keeps its own numbers; with several
+workers, every worker reports what it served itself.
+
+Classes:
+- Histogram(buckets): Counts observations into cumulative buckets.
+- TimedCursor: A SQLite cursor that adds its execution time to the current request.
+- TimedConnection: A SQLite connection whose cursors are TimedCursors.
+
+Functions:
+- init_app(app): Registers the request hooks and template signals with an application.
+- render_metrics(): Returns all metrics in the Prometheus text exposition format.
+- render_gauges(gauges): Formats point-in-time values, such as data freshness, as gauges.
+
+Usage:
+db.py opens connections with `factory=TimedConnection`; call `init_app(app)` once
+after creating the application and serve `render_metrics()` from an endpoint.
+
+Example:
+init_app(app)
+return render_metrics(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+"""
+import sqlite3
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from flask import g, has_app_context, request
+from flask.signals import before_render_template, template_rendered
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds of each histogram
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# (name, help text, buckets) of the per-endpoint histograms, in export order
+HISTOGRAMS = (
+    ("http_request_duration_seconds", "Time spent handling requests.", SECONDS_BUCKETS),
+    ("http_request_db_seconds", "Time spent in SQLite while handling requests.", SECONDS_BUCKETS),
+    ("http_request_render_seconds", "Time spent rendering templates.", SECONDS_BUCKETS),
+    ("http_request_queries", "SQL statements run per request.", QUERY_BUCKETS),
+    ("http_response_size_bytes", "Size of response bodies.", BYTES_BUCKETS),
+)
+
+_lock = threading.Lock()
+
+# (histogram name, endpoint) -> Histogram
+_histograms = {}
+
+# (endpoint, status) -> number of requests
+_requests = {}
+
+
+class Histogram:
+    """
+    Counts observations into buckets by upper bound, plus their sum and count.
+
+    Parameters:
+    - buckets (tuple): The ascending bucket upper bounds; an implicit +Inf bucket
+      catches everything above the last one.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Records one observation.
+
+        Parameters:
+        - value (float): The observed value.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestTimings:
+    """
+    Time and statement counts collected while handling one request.
+    """
+
+    __slots__ = ("started", "db_seconds", "queries", "render_seconds", "renders", "trace")
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.render_seconds = 0.0
+        # Start times of the templates being rendered; fragments render inside pages
+        self.renders = []
+        # The SQL trace of the request, when sqltrace.py is tracing it
+        self.trace = None
+
+    def add_db_time(self, seconds):
+        """
+        Adds time spent in SQLite, also to the traced statement if there is a trace.
+        """
+        self.db_seconds += seconds
+        if self.trace is not None:
+            self.trace.add_time(seconds)
+
+
+def current_timings():
+    """
+    Returns the timings of the request being handled, or None outside a request.
+    """
+    if has_app_context():
+        return g.get("request_timings")
+    return None
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    A SQLite cursor that adds the time spent executing statements and fetching rows to
+    the current request's timings. Outside a request it behaves like a plain cursor.
+    """
+
+    def execute(self, *args):
+        """
+        Executes a statement, counting it and timing it for the current request.
+        """
+        timings = current_timings()
+        if timings is None:
+            return super().execute(*args)
+        timings.queries += 1
+        started = perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            timings.add_db_time(perf_counter() - started)
+
+    def executemany(self, *args):
+        """
+        Executes a statement for many parameter sets, counted and timed as one statement.
+        """
+        timings = current_timings()
+        if timings is None:
+            return super().executemany(*args)
+        timings.queries += 1
+        started = perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            timings.add_db_time(perf_counter() - started)
+
+    def fetchone(self):
+        """
+        Fetches the next row, timed for the current request.
+        """
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        """
+        Fetches the next rows, timed for the current request.
+        """
+        return self._timed_fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        """
+        Fetches the remaining rows, timed for the current request.
+        """
+        return self._timed_fetch(super().fetchall)
+
+    def _timed_fetch(self, fetch, *args):
+        """
+        Calls a fetch method, adding its duration to the current request's DB time.
+        """
+        timings = current_timings()
+        if timings is None:
+            return fetch(*args)
+        started = perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            timings.add_db_time(perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A SQLite connection whose cursors, including those behind `execute`, are TimedCursors.
+    """
+
+    def cursor(self, factory=None):
+        """
+        Returns a new cursor, a TimedCursor unless another factory is given.
+        """
+        return super().cursor(factory or TimedCursor)
+
+    # The built-in shortcuts create their cursor without calling cursor()
+    def execute(self, *args):
+        """
+        Executes a statement on a new TimedCursor and returns the cursor.
+        """
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        """
+        Executes a statement for many parameter sets on a new TimedCursor.
+        """
+        return self.cursor().executemany(*args)
+
+
+def start_request():
+    """
+    Starts timing the request being handled.
+    """
+    g.request_timings = RequestTimings()
+
+
+def finish_request(response):
+    """
+    Records the timings, statement count and size of a finished response.
+
+    Parameters:
+    - response (flask.Response): The response about to be sent.
+
+    Returns:
+    - flask.Response: The same response.
+    """
+    timings = g.pop("request_timings", None)
+    if timings is None:
+        return response
+
+    duration = perf_counter() - timings.started
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    size = response.calculate_content_length()
+    values = (duration, timings.db_seconds, timings.render_seconds, timings.queries, size)
+
+    with _lock:
+        for (name, _, buckets), value in zip(HISTOGRAMS, values):
+            if value is None:
+                # Streamed bodies have no size until they are sent
+                continue
+            histogram = _histograms.get((name, endpoint))
+            if histogram is None:
+                histogram = _histograms[(name, endpoint)] = Histogram(buckets)
+            histogram.observe(value)
+        key = (endpoint, response.status_code)
+        _requests[key] = _requests.get(key, 0) + 1
+    return response
+
+
+def render_started(sender, template, context, **extra):  # pylint: disable=unused-argument
+    """
+    Notes when a template starts rendering.
+    """
+    timings = current_timings()
+    if timings is not None:
+        timings.renders.append(perf_counter())
+
+
+def render_finished(sender, template, context, **extra):  # pylint: disable=unused-argument
+    """
+    Adds a finished template's render time to the request, counting nested renders once.
+    """
+    timings = current_timings()
+    if timings is not None and timings.renders:
+        started = timings.renders.pop()
+        if not timings.renders:
+            timings.render_seconds += perf_counter() - started
+
+
+def init_app(app):
+    """
+    Registers the request hooks and template signals with a Flask application.
+
+    Parameters:
+    - app (Flask): The application to instrument.
+    """
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    before_render_template.connect(render_started, app)
+    template_rendered.connect(render_finished, app)
+
+
+def render_metrics():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+
+    Returns:
+    - str: One HELP and TYPE header per metric followed by its samples.
+    """
+    with _lock:
+        histograms = {
+            key: (list(histogram.counts), histogram.sum, histogram.count)
+            for key, histogram in _histograms.items()
+        }
+        requests = dict(_requests)
+
+    lines = [
+        "# HELP http_requests_total Requests handled, by endpoint and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (endpoint, status), count in sorted(requests.items()):
+        lines.append(f'http_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+    for name, help_text, buckets in HISTOGRAMS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, endpoint), (counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {total}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def render_gauges(gauges):
+    """
+    Formats point-in-time values in the Prometheus text exposition format.
+
+    Parameters:
+    - gauges (list): (name, help text, value) tuples.
+
+    Returns:
+    - str: One HELP and TYPE header and one sample per gauge.
+    """
+    lines = []
+    for name, help_text, value in gauges:
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n" if lines else ""
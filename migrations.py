@@ -0,0 +1,388 @@
+"""
+Module: migrations.py
+
+This module upgrades an existing stories database to the current schema in place.
+
+Each migration is a numbered SQL script. The number of the last migration applied is
+stored in the database's `PRAGMA user_version`, so only the missing migrations run,
+each in its own transaction, and an up-to-date database costs a single pragma read.
+After any migration is applied, `ANALYZE` refreshes the query planner's statistics
+so the new indexes are used straight away.
+
+`schema.sql` is generated from the migrations by `schema_script`, so a database
+created from it starts at the current version.
+
+Functions:
+- split_statements(script): Splits a SQL script into its individual statements.
+- migrate(connection): Applies every pending migration to the database.
+- schema_script(): Returns the SQL script that creates a database at the current version.
+
+Usage:
+The application and the fetcher migrate the database when they start. It can also be
+migrated by hand, e.g. before a deploy.
+
+Example:
+python3 migrations.py
+python3 migrations.py --db /path/to/stories.db
+python3 migrations.py --schema > schema.sql
+"""
+import argparse
+import sqlite3
+import sys
+import textwrap
+from contextlib import closing
+from votes import REBUILD_VOTE_COUNTS_SQL, VOTE_COUNTS_SCHEMA
+
+# Indexes on story_likes, recreated whenever the table is rebuilt
+STORY_LIKES_INDEXES = """
+CREATE INDEX IF NOT EXISTS story_likes_story_vote ON story_likes (story_id, liked, disliked);
+CREATE INDEX IF NOT EXISTS story_likes_user ON story_likes (user_email);
+"""
+
+# Column definitions of the new_stories table, shared with the fetcher's shadow copy
+NEW_STORIES_COLUMNS = """(
+    by TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    descendants INTEGER,
+    type TEXT,
+    text TEXT
+)"""
+
+# Indexes on new_stories; the fetcher recreates them whenever it swaps the table in
+NEW_STORIES_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS new_stories_id ON new_stories (id);
+"""
+
+BASELINE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS story_kids (
+    parent_id INTEGER,
+    kid_id INTEGER,
+    FOREIGN KEY (parent_id) REFERENCES stories (id)
+);
+CREATE TABLE IF NOT EXISTS new_stories {NEW_STORIES_COLUMNS};
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    name TEXT NOT NULL,
+    nickname TEXT,
+    picture TEXT,
+    admin BOOLEAN DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS story_likes (
+    story_id INTEGER NOT NULL,
+    user_email TEXT NOT NULL,
+    liked BOOLEAN,
+    disliked BOOLEAN,
+    by TEXT,
+    score INTEGER,
+    time INTEGER,
+    title TEXT,
+    url TEXT,
+    descendants INTEGER,
+    type TEXT,
+    text TEXT,
+    PRIMARY KEY (story_id, user_email),
+    FOREIGN KEY (user_email) REFERENCES users(email)
+);
+"""
+
+MIGRATIONS = [
+    (1, "baseline schema", BASELINE_SCHEMA),
+    (2, "story vote counters", VOTE_COUNTS_SCHEMA + REBUILD_VOTE_COUNTS_SQL),
+    (
+        3,
+        "fetcher item cache",
+        """
+        CREATE TABLE IF NOT EXISTS item_cache (
+            id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            fetched_at INTEGER NOT NULL
+        );
+        """,
+    ),
+    (
+        4,
+        "unique key on new_stories.id",
+        """
+        DELETE FROM new_stories
+        WHERE rowid NOT IN (SELECT MIN(rowid) FROM new_stories GROUP BY id);
+        """
+        + NEW_STORIES_INDEXES,
+    ),
+    (
+        5,
+        "unique key on users.email",
+        """
+        -- Merge duplicate accounts into the oldest one, keeping any admin flag
+        UPDATE users SET admin = (SELECT MAX(admin) FROM users AS u WHERE u.email = users.email);
+        DELETE FROM users WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY email);
+        CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email);
+        """,
+    ),
+    (6, "story_likes vote and user indexes", STORY_LIKES_INDEXES),
+    (
+        7,
+        "votes reference stories instead of copying them",
+        """
+        CREATE TABLE IF NOT EXISTS stories (
+            id INTEGER PRIMARY KEY,
+            by TEXT,
+            score INTEGER,
+            time INTEGER,
+            title TEXT,
+            url TEXT,
+            descendants INTEGER,
+            type TEXT,
+            text TEXT
+        );
+        -- Keep the story content of every vote, preferring the current copy in new_stories
+        INSERT INTO stories (id, by, score, time, title, url, descendants, type, text)
+        SELECT id, by, score, time, title, url, descendants, type, text
+        FROM new_stories
+        WHERE id IN (SELECT story_id FROM story_likes)
+        ON CONFLICT (id) DO NOTHING;
+        INSERT INTO stories (id, by, score, time, title, url, descendants, type, text)
+        SELECT story_id, by, score, time, title, url, descendants, type, text
+        FROM story_likes
+        WHERE rowid IN (SELECT MAX(rowid) FROM story_likes GROUP BY story_id)
+        ON CONFLICT (id) DO NOTHING;
+
+        CREATE TABLE story_likes_normalized (
+            story_id INTEGER NOT NULL,
+            user_email TEXT NOT NULL,
+            liked BOOLEAN,
+            disliked BOOLEAN,
+            PRIMARY KEY (story_id, user_email),
+            FOREIGN KEY (user_email) REFERENCES users(email)
+        );
+        INSERT INTO story_likes_normalized (story_id, user_email, liked, disliked)
+        SELECT story_id, user_email, liked, disliked FROM story_likes;
+        DROP TABLE story_likes;
+        ALTER TABLE story_likes_normalized RENAME TO story_likes;
+        """
+        # Dropping the old table dropped its indexes and counter triggers
+        + STORY_LIKES_INDEXES
+        + VOTE_COUNTS_SCHEMA,
+    ),
+    (
+        8,
+        "fetch run ledger",
+        """
+        CREATE TABLE IF NOT EXISTS fetch_runs (
+            id INTEGER PRIMARY KEY,
+            started_at REAL NOT NULL,
+            finished_at REAL NOT NULL,
+            mode TEXT NOT NULL,
+            concurrency INTEGER,
+            status TEXT NOT NULL,
+            error TEXT,
+            items_requested INTEGER NOT NULL DEFAULT 0,
+            items_fetched INTEGER NOT NULL DEFAULT 0,
+            items_failed INTEGER NOT NULL DEFAULT 0,
+            latency_p50_ms REAL,
+            latency_p95_ms REAL,
+            latency_p99_ms REAL,
+            bytes_downloaded INTEGER NOT NULL DEFAULT 0,
+            rows_written INTEGER,
+            db_write_ms REAL
+        );
+        CREATE INDEX IF NOT EXISTS fetch_runs_status_finished ON fetch_runs (status, finished_at);
+        """,
+    ),
+    (
+        9,
+        "item cache rank and last seen",
+        """
+        ALTER TABLE item_cache ADD COLUMN rank INTEGER;
+        ALTER TABLE item_cache ADD COLUMN last_seen INTEGER;
+        UPDATE item_cache SET last_seen = fetched_at;
+        """,
+    ),
+    (
+        10,
+        "feed membership",
+        """
+        CREATE TABLE IF NOT EXISTS feed_items (
+            feed TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            PRIMARY KEY (feed, rank)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS feed_items_item ON feed_items (item_id);
+        """,
+    ),
+    (
+        11,
+        "comment threads",
+        """
+        -- Edges from a story or comment to its kids, in the API's order; parents can be
+        -- comments too, so the old foreign key to stories goes
+        CREATE TABLE story_kids_ordered (
+            parent_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            kid_id INTEGER NOT NULL,
+            PRIMARY KEY (parent_id, position)
+        ) WITHOUT ROWID;
+        INSERT OR IGNORE INTO story_kids_ordered (parent_id, position, kid_id)
+        SELECT parent_id, ROW_NUMBER() OVER (PARTITION BY parent_id ORDER BY rowid), kid_id
+        FROM story_kids
+        WHERE parent_id IS NOT NULL AND kid_id IS NOT NULL;
+        DROP TABLE story_kids;
+        ALTER TABLE story_kids_ordered RENAME TO story_kids;
+        CREATE UNIQUE INDEX IF NOT EXISTS story_kids_kid ON story_kids (kid_id);
+
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY,
+            story_id INTEGER NOT NULL,
+            by TEXT,
+            time TEXT,
+            text TEXT,
+            deleted INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS comments_story ON comments (story_id);
+
+        -- When each story's thread was fetched, and its comment count at the time
+        CREATE TABLE IF NOT EXISTS comment_threads (
+            story_id INTEGER PRIMARY KEY,
+            descendants INTEGER,
+            fetched_at INTEGER NOT NULL
+        );
+        """,
+    ),
+    (
+        12,
+        "comment stage counts of fetch runs",
+        """
+        ALTER TABLE fetch_runs ADD COLUMN comments_requested INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE fetch_runs ADD COLUMN comments_fetched INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE fetch_runs ADD COLUMN comments_failed INTEGER NOT NULL DEFAULT 0;
+        """,
+    ),
+]
+
+
+def split_statements(script):
+    """
+    Splits a SQL script into its individual statements.
+
+    Unlike a plain split on ';' this keeps trigger bodies, which contain semicolons
+    of their own, in one piece.
+
+    Parameters:
+    - script (str): The SQL script.
+
+    Returns:
+    - list: The complete statements in the script.
+    """
+    statements = []
+    pending = ""
+    for part in script.split(";"):
+        pending += part + ";"
+        if sqlite3.complete_statement(pending):
+            if pending.strip(" \n;"):
+                statements.append(pending.strip())
+            pending = ""
+    return statements
+
+
+def migrate(connection):
+    """
+    Applies every pending migration to the database.
+
+    Each migration runs in its own IMMEDIATE transaction together with the update of
+    `PRAGMA user_version`, so a failed migration leaves the database at the previous
+    version. The version is read again once the write lock is held, which makes it
+    safe for several processes to migrate the same database at start-up.
+
+    Parameters:
+    - connection (sqlite3.Connection): An open connection to the stories database.
+
+    Returns:
+    - list: The names of the migrations that were applied.
+    """
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA user_version")
+    if cursor.fetchone()[0] >= MIGRATIONS[-1][0]:
+        return []
+
+    if connection.in_transaction:
+        connection.commit()
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None  # transactions are managed explicitly below
+
+    applied = []
+    try:
+        for number, name, script in MIGRATIONS:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("PRAGMA user_version")
+                if cursor.fetchone()[0] < number:
+                    for statement in split_statements(script):
+                        cursor.execute(statement)
+                    cursor.execute(f"PRAGMA user_version = {number}")
+                    applied.append(name)
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+
+        if applied:
+            cursor.execute("ANALYZE")
+    finally:
+        connection.isolation_level = isolation_level
+
+    return applied
+
+
+def schema_script():
+    """
+    Returns the SQL script that creates an empty database at the current schema version.
+
+    The script is read back from a fresh in-memory database after all migrations have
+    run: its tables, then its indexes, then its triggers, followed by the
+    `PRAGMA user_version` of the last migration, so `migrate` has nothing left to do
+    on a database created from it.
+
+    Returns:
+    - str: The script, as kept in schema.sql.
+    """
+    with closing(sqlite3.connect(":memory:")) as connection:
+        migrate(connection)
+        rows = connection.execute(
+            """SELECT sql FROM sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+            ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END, rowid"""
+        ).fetchall()
+        target = connection.execute("PRAGMA user_version").fetchone()[0]
+
+    statements = []
+    for (sql,) in rows:
+        # Statements keep the indentation they had in MIGRATIONS after their first line
+        first, _, rest = sql.partition("\n")
+        statements.append(f"{first}\n{textwrap.dedent(rest)}" if rest else first)
+    script = "".join(f"{statement};\n" for statement in statements)
+    return f"{script}PRAGMA user_version = {target};\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade stories.db to the current schema")
+    parser.add_argument("--db", default="stories.db", help="path to the stories database")
+    parser.add_argument(
+        "--schema", action="store_true", help="print the script that creates a fresh database"
+    )
+    args = parser.parse_args()
+
+    if args.schema:
+        print(schema_script(), end="")
+        sys.exit(0)
+
+    with closing(sqlite3.connect(args.db)) as db:
+        names = migrate(db)
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+    for migration in names:
+        print(f"applied: {migration}")
+    print(f"database is at schema version {version}")
@@ -0,0 +1,369 @@
+"""
+Module: news.py
+
+This module reads the news feeds, the fetch ledger and the comment threads for the
+application's pages and JSON endpoints.
+
+The top feed is the `new_stories` table, which the fetcher loads in display order;
+the other feeds are their `feed_items` rows joined with the `stories` table. Pages are
+read with LIMIT/OFFSET or, for /newsfeed cursors, after a feed position, so only the
+rows shown are read. Results that only change with the news data (the story counts,
+the latest fetch run and /newsfeed JSON bodies) are cached against the data version.
+
+Functions:
+- feed_source(feed): Returns where the stories of a feed are read from.
+- get_news_page(cursor, page, feed): Retrieves one page of news items.
+- count_news_items(cursor, feed): Returns the number of stories in a feed.
+- get_last_fetch_run(cursor): Returns the latest successful fetch run.
+- parse_newsfeed_args(args, version): Validates the /newsfeed query parameters.
+- newsfeed_query(query): Builds the SELECT statement for a /newsfeed query.
+- next_newsfeed_cursor(cursor, query): Finds where the next /newsfeed page starts.
+- build_newsfeed(db_path, version, offset, after, limit, fields, feed): Builds a compact
+  JSON page of the news feed.
+- stream_newsfeed(cursor, query): Streams news items as newline-delimited JSON.
+- get_comment_thread(cursor, story_id, depth, limit): Reads a story's stored comment
+  thread in one query.
+
+Usage:
+The functions take a cursor on the request's connection, or use `db.get_db()`, so
+they are called from within a request or application context.
+
+Example:
+cursor = get_db().cursor()
+stories = get_news_page(cursor, 2, "ask")
+"""
+import json
+from functools import lru_cache
+from db import configured_path, data_version, get_db
+from feeds import FEEDS
+
+ITEMS_PER_PAGE = 10
+
+# /newsfeed page sizes, the fields it can return, and how many JSON bodies it keeps
+NEWSFEED_DEFAULT_LIMIT = 30
+NEWSFEED_MAX_LIMIT = 500
+NEWSFEED_FIELDS = ("by", "descendants", "id", "score", "text", "time", "title", "type", "url")
+NEWSFEED_CACHE_SIZE = 64
+
+# /comments: comments per response and levels of replies returned
+COMMENTS_DEFAULT_LIMIT = 200
+COMMENTS_MAX_LIMIT = 1000
+COMMENTS_MAX_DEPTH = 10
+
+# A story's comments in thread order: every comment follows its parent and siblings
+# keep the API's order. The path of zero-padded positions sorts the tree depth first;
+# each level is one lookup per parent on the story_kids primary key.
+COMMENT_THREAD_SQL = """
+WITH RECURSIVE thread (id, parent_id, depth, path) AS (
+    SELECT kid_id, parent_id, 1, printf('%06d', position)
+    FROM story_kids
+    WHERE parent_id = ?
+    UNION ALL
+    SELECT story_kids.kid_id, story_kids.parent_id, thread.depth + 1,
+        thread.path || printf('%06d', story_kids.position)
+    FROM thread JOIN story_kids ON story_kids.parent_id = thread.id
+    WHERE thread.depth < ?
+)
+SELECT comments.id, thread.parent_id, thread.depth, comments.by, comments.time,
+    comments.text, comments.deleted
+FROM thread JOIN comments ON comments.id = thread.id
+ORDER BY thread.path
+LIMIT ?
+"""
+
+# Story columns in the order of new_stories, as read for the other feeds
+FEED_STORY_COLUMNS = "by, id, score, time, title, url, descendants, type, text"
+
+# (database path, feed) -> (data version, value) of the feed's story count
+_news_count_cache = {}
+
+# database path -> (data version, value) of the latest successful fetch run
+_last_fetch_cache = {}
+
+# Columns of fetch_runs returned by get_last_fetch_run
+FETCH_RUN_FIELDS = (
+    "started_at", "finished_at", "mode", "items_requested", "items_fetched", "items_failed",
+    "latency_p95_ms", "bytes_downloaded", "rows_written", "db_write_ms",
+)
+
+
+def feed_source(feed):
+    """
+    Returns where the stories of a feed are read from.
+
+    The top feed is new_stories, which the fetcher loads in display order, so rowid
+    order is the feed order. The other feeds are their feed_items rows, read through
+    the (feed, rank) primary key, joined with the stories table, in rank order, which
+    is the order Hacker News lists them in.
+
+    Parameters:
+    - feed (str): The name of a feed in FEEDS.
+
+    Returns:
+    - tuple: The column giving the feed order, a FROM clause ending in an open WHERE
+      clause to be completed with a condition, and the clause's parameters.
+    """
+    if feed == "top":
+        return "rowid", "new_stories WHERE", ()
+    return (
+        "rank",
+        "feed_items JOIN stories ON stories.id = feed_items.item_id WHERE feed = ? AND",
+        (feed,),
+    )
+
+
+def get_news_page(cursor, page, feed="top"):
+    """
+    Retrieves one page of news items from the database.
+
+    Only the requested page is read; pages below 1 return the first page.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): The cursor to run the query on.
+    - page (int): The 1-based page number.
+    - feed (str): The name of a feed in FEEDS.
+
+    Returns:
+    - list: The stories on the requested page, with the columns of new_stories.
+    """
+    offset = (max(page, 1) - 1) * ITEMS_PER_PAGE
+    order, source, params = feed_source(feed)
+    cursor.execute(
+        f"SELECT {FEED_STORY_COLUMNS} FROM {source} {order} > 0 ORDER BY {order} LIMIT ? OFFSET ?",
+        params + (ITEMS_PER_PAGE, offset),
+    )
+    return cursor.fetchall()
+
+
+def count_news_items(cursor, feed="top"):
+    """
+    Returns the number of stories in a feed, used to work out the page count.
+
+    The count only changes with the news data, so it is cached against the data
+    version and page views don't pay for a table scan.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): The cursor to run the count on if the cache is stale.
+    - feed (str): The name of a feed in FEEDS.
+
+    Returns:
+    - int: The number of news items.
+    """
+    path = configured_path()
+    version, _ = data_version(path)
+    entry = _news_count_cache.get((path, feed))
+    if entry is None or entry[0] != version:
+        order, source, params = feed_source(feed)
+        cursor.execute(f"SELECT COUNT(*) FROM {source} {order} > 0", params)
+        entry = _news_count_cache[path, feed] = (version, cursor.fetchone()[0])
+    return entry[1]
+
+
+def get_last_fetch_run(cursor):
+    """
+    Returns the latest successful fetch run from the fetch_runs ledger.
+
+    A successful run bumps the data version after its row is committed, so the row is
+    cached against it.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): The cursor to read the ledger with if the cache is stale.
+
+    Returns:
+    - dict: The run's FETCH_RUN_FIELDS, or None if no fetch has been recorded.
+    """
+    path = configured_path()
+    version, _ = data_version(path)
+    entry = _last_fetch_cache.get(path)
+    if entry is not None:
+        cached_version, run = entry
+        if cached_version == version:
+            return run
+
+    cursor.execute(
+        f"""SELECT {", ".join(FETCH_RUN_FIELDS)} FROM fetch_runs
+        WHERE status = 'ok' ORDER BY finished_at DESC LIMIT 1"""
+    )
+    row = cursor.fetchone()
+    run = dict(zip(FETCH_RUN_FIELDS, row)) if row else None
+    _last_fetch_cache[path] = (version, run)
+    return run
+
+
+def parse_newsfeed_args(args, version):
+    """
+    Validates the /newsfeed query parameters.
+
+    Parameters:
+    - args (MultiDict): The request's query parameters.
+    - version (str): The current data version, which cursors must match.
+
+    Returns:
+    - dict: The feed, format, fields, limit, offset and the position to continue
+      after, or None if the cursor belongs to an older data version.
+
+    Raises:
+    - ValueError: If a parameter is malformed.
+    """
+    feed = args.get("feed", "top")
+    if feed not in FEEDS:
+        raise ValueError(f"feed must be one of {', '.join(FEEDS)}")
+
+    output_format = args.get("format", "json")
+    if output_format not in ("json", "ndjson"):
+        raise ValueError("format must be json or ndjson")
+
+    fields = NEWSFEED_FIELDS
+    if args.get("fields"):
+        fields = tuple(field.strip() for field in args["fields"].split(","))
+        unknown = [field for field in fields if field not in NEWSFEED_FIELDS]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(unknown)}")
+
+    limit = args.get("limit", type=int)
+    if "limit" in args and (limit is None or limit < 1):
+        raise ValueError("limit must be a positive number")
+    if output_format == "json":
+        limit = min(limit or NEWSFEED_DEFAULT_LIMIT, NEWSFEED_MAX_LIMIT)
+
+    if "page" in args and "cursor" in args:
+        raise ValueError("use either page or cursor, not both")
+    page = args.get("page", 1, type=int)
+    offset, after = (max(page, 1) - 1) * (limit or 0), 0
+    if "cursor" in args:
+        cursor_version, _, cursor_after = args["cursor"].partition(".")
+        if not cursor_after.isdigit():
+            raise ValueError("malformed cursor")
+        if cursor_version != version:
+            return None
+        offset, after = 0, int(cursor_after)
+
+    return {
+        "feed": feed,
+        "format": output_format,
+        "fields": fields,
+        "limit": limit,
+        "offset": offset,
+        "after": after,
+    }
+
+
+def newsfeed_query(query):
+    """
+    Builds the SELECT statement and parameters for a validated /newsfeed query.
+
+    The feed position (the rowid of new_stories or the rank in feed_items) comes first
+    in every row; it is the feed order and the cursor position.
+
+    Parameters:
+    - query (dict): The query returned by parse_newsfeed_args.
+
+    Returns:
+    - tuple: The SQL statement and its parameters.
+    """
+    # Field names come from NEWSFEED_FIELDS, so they are safe to put in the statement
+    order, source, params = feed_source(query["feed"])
+    sql = f"SELECT {order}, {', '.join(query['fields'])} FROM {source} {order} > ? ORDER BY {order}"
+    if query["limit"] is None:
+        return sql, params + (query["after"],)
+    return sql + " LIMIT ? OFFSET ?", params + (query["after"], query["limit"], query["offset"])
+
+
+def next_newsfeed_cursor(cursor, query):
+    """
+    Finds where the page after a /newsfeed query starts, without reading the rows.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): The cursor to run the query on.
+    - query (dict): The query returned by parse_newsfeed_args.
+
+    Returns:
+    - int: The position of the last item of this page if more items follow, else None.
+    """
+    if query["limit"] is None:
+        return None
+    order, source, params = feed_source(query["feed"])
+    cursor.execute(
+        f"SELECT {order} FROM {source} {order} > ? ORDER BY {order} LIMIT 2 OFFSET ?",
+        params + (query["after"], query["offset"] + query["limit"] - 1),
+    )
+    rows = cursor.fetchall()
+    return rows[0][0] if len(rows) == 2 else None
+
+
+@lru_cache(maxsize=NEWSFEED_CACHE_SIZE)
+def build_newsfeed(
+    db_path, version, offset, after, limit, fields, feed="top"
+):  # pylint: disable=unused-argument,too-many-arguments
+    """
+    Builds a compact JSON page of the news feed from the database.
+
+    Results are cached per database, data version and query.
+
+    Parameters:
+    - db_path (str): The path of the configured database; part of the cache key.
+    - version (str): The data version the page is built for; part of the cache key.
+    - offset (int): The number of items to skip.
+    - after (int): Only items after this feed position are returned.
+    - limit (int): The maximum number of items to return.
+    - fields (tuple): The fields to include for each item.
+    - feed (str): The name of a feed in FEEDS.
+
+    Returns:
+    - tuple: The JSON string, and the position of the last item if more items follow.
+    """
+    query = {"feed": feed, "fields": fields, "limit": limit, "offset": offset, "after": after}
+    cursor = get_db().cursor()
+
+    cursor.execute(*newsfeed_query(query))
+    news_feed = [dict(zip(fields, row[1:])) for row in cursor.fetchall()]
+
+    return json.dumps(news_feed, separators=(",", ":")), next_newsfeed_cursor(cursor, query)
+
+
+def stream_newsfeed(cursor, query):
+    """
+    Streams news items as newline-delimited JSON, one item per line.
+
+    Rows are read from the database cursor as they are sent, so memory use does not
+    grow with the size of the export.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): The cursor to run the query on.
+    - query (dict): The query returned by parse_newsfeed_args.
+
+    Yields:
+    - str: One JSON object followed by a newline per item.
+    """
+    cursor.execute(*newsfeed_query(query))
+    for row in cursor:
+        yield json.dumps(dict(zip(query["fields"], row[1:])), separators=(",", ":")) + "\n"
+
+
+def get_comment_thread(cursor, story_id, depth=COMMENTS_MAX_DEPTH, limit=COMMENTS_DEFAULT_LIMIT):
+    """
+    Reads a story's stored comment thread in one query.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): The cursor to run the query on.
+    - story_id (int): The id of the story.
+    - depth (int): Levels of replies to return.
+    - limit (int): The maximum number of comments to return.
+
+    Returns:
+    - list: One dictionary per comment, in thread order, with its id, parent id,
+      depth below the story, author, time, text and whether it was deleted.
+    """
+    cursor.execute(COMMENT_THREAD_SQL, (story_id, depth, limit))
+    return [
+        {
+            "id": row[0],
+            "parent": row[1],
+            "depth": row[2],
+            "by": row[3],
+            "time": row[4],
+            "text": row[5],
+            "deleted": bool(row[6]),
+        }
+        for row in cursor.fetchall()
+    ]
@@ -4,8 +4,15 @@
 LOG_FILE="/home/jose/project/fetch_log.txt"
 
 # Output timestamp and message to log file
-echo "$(date +"%Y-%m-%d %H:%M:%S") Running fetch.py" >> "$LOG_FILE"
-
-# Run fetch.py
-/usr/bin/python3 /home/jose/project/fetch.py
+echo "$(date +"%Y-%m-%d %H:%M:%S") Starting fetch daemon" >> "$LOG_FILE"
 
+# Run fetch.py as a resident daemon that refreshes the stories every minute, only
+# downloading the items whose refresh tier is due; extra arguments (e.g. --interval 30)
+# are passed on. The daemon holds a lock file, so starting it again while it runs,
+# e.g. from an @reboot or periodic cron entry, exits straight away. Stop it with
+# SIGTERM; it finishes the current run first.
+#
+# Only the top stories are fetched unless FETCH_FEEDS lists more of the feeds, e.g.
+# FETCH_FEEDS="top new ask show"; each extra feed adds to the requests made per run.
+FETCH_FEEDS="${FETCH_FEEDS:-top}"
+exec /usr/bin/python3 -u /home/jose/project/fetch.py --daemon --incremental --feeds $FETCH_FEEDS "$@" >> "$LOG_FILE" 2>&1
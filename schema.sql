@@ -1,8 +1,3 @@
-CREATE TABLE story_kids (
-    parent_id INTEGER,
-    kid_id INTEGER,
-    FOREIGN KEY (parent_id) REFERENCES stories (id)
-);
 CREATE TABLE new_stories (
     by TEXT NOT NULL,
     id INTEGER NOT NULL,
@@ -11,20 +6,29 @@ CREATE TABLE new_stories (
     title TEXT NOT NULL,
     url TEXT NOT NULL,
     descendants INTEGER,
-    type TEXT
-, text TEXT);
+    type TEXT,
+    text TEXT
+);
 CREATE TABLE users (
-id INTEGER PRIMARY KEY AUTOINCREMENT, 
-email TEXT NOT NULL,
-name TEXT NOT NULL,
-nickname TEXT, 
-picture TEXT
-, admin BOOLEAN DEFAULT 0);
-CREATE TABLE story_likes (
-    story_id INTEGER NOT NULL,
-    user_email TEXT NOT NULL,
-    liked BOOLEAN,
-    disliked BOOLEAN,
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    name TEXT NOT NULL,
+    nickname TEXT,
+    picture TEXT,
+    admin BOOLEAN DEFAULT 0
+);
+CREATE TABLE story_vote_counts (
+    story_id INTEGER PRIMARY KEY,
+    likes INTEGER NOT NULL DEFAULT 0,
+    dislikes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE item_cache (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    fetched_at INTEGER NOT NULL
+, rank INTEGER, last_seen INTEGER);
+CREATE TABLE stories (
+    id INTEGER PRIMARY KEY,
     by TEXT,
     score INTEGER,
     time INTEGER,
@@ -32,7 +36,93 @@ CREATE TABLE story_likes (
     url TEXT,
     descendants INTEGER,
     type TEXT,
-    text TEXT,
+    text TEXT
+);
+CREATE TABLE "story_likes" (
+    story_id INTEGER NOT NULL,
+    user_email TEXT NOT NULL,
+    liked BOOLEAN,
+    disliked BOOLEAN,
     PRIMARY KEY (story_id, user_email),
     FOREIGN KEY (user_email) REFERENCES users(email)
 );
+CREATE TABLE fetch_runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    mode TEXT NOT NULL,
+    concurrency INTEGER,
+    status TEXT NOT NULL,
+    error TEXT,
+    items_requested INTEGER NOT NULL DEFAULT 0,
+    items_fetched INTEGER NOT NULL DEFAULT 0,
+    items_failed INTEGER NOT NULL DEFAULT 0,
+    latency_p50_ms REAL,
+    latency_p95_ms REAL,
+    latency_p99_ms REAL,
+    bytes_downloaded INTEGER NOT NULL DEFAULT 0,
+    rows_written INTEGER,
+    db_write_ms REAL
+, comments_requested INTEGER NOT NULL DEFAULT 0, comments_fetched INTEGER NOT NULL DEFAULT 0, comments_failed INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE feed_items (
+    feed TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    PRIMARY KEY (feed, rank)
+) WITHOUT ROWID;
+CREATE TABLE "story_kids" (
+    parent_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    kid_id INTEGER NOT NULL,
+    PRIMARY KEY (parent_id, position)
+) WITHOUT ROWID;
+CREATE TABLE comments (
+    id INTEGER PRIMARY KEY,
+    story_id INTEGER NOT NULL,
+    by TEXT,
+    time TEXT,
+    text TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE comment_threads (
+    story_id INTEGER PRIMARY KEY,
+    descendants INTEGER,
+    fetched_at INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX new_stories_id ON new_stories (id);
+CREATE UNIQUE INDEX users_email ON users (email);
+CREATE INDEX story_likes_story_vote ON story_likes (story_id, liked, disliked);
+CREATE INDEX story_likes_user ON story_likes (user_email);
+CREATE INDEX fetch_runs_status_finished ON fetch_runs (status, finished_at);
+CREATE INDEX feed_items_item ON feed_items (item_id);
+CREATE UNIQUE INDEX story_kids_kid ON story_kids (kid_id);
+CREATE INDEX comments_story ON comments (story_id);
+CREATE TRIGGER story_likes_count_insert AFTER INSERT ON story_likes
+BEGIN
+    INSERT INTO story_vote_counts (story_id, likes, dislikes)
+    VALUES (NEW.story_id, IFNULL(NEW.liked = True, 0), IFNULL(NEW.disliked = True, 0))
+    ON CONFLICT(story_id) DO UPDATE SET
+        likes = likes + excluded.likes,
+        dislikes = dislikes + excluded.dislikes;
+END;
+CREATE TRIGGER story_likes_count_delete AFTER DELETE ON story_likes
+BEGIN
+    UPDATE story_vote_counts
+    SET likes = likes - IFNULL(OLD.liked = True, 0),
+        dislikes = dislikes - IFNULL(OLD.disliked = True, 0)
+    WHERE story_id = OLD.story_id;
+END;
+CREATE TRIGGER story_likes_count_update
+AFTER UPDATE OF story_id, liked, disliked ON story_likes
+BEGIN
+    UPDATE story_vote_counts
+    SET likes = likes - IFNULL(OLD.liked = True, 0),
+        dislikes = dislikes - IFNULL(OLD.disliked = True, 0)
+    WHERE story_id = OLD.story_id;
+    INSERT INTO story_vote_counts (story_id, likes, dislikes)
+    VALUES (NEW.story_id, IFNULL(NEW.liked = True, 0), IFNULL(NEW.disliked = True, 0))
+    ON CONFLICT(story_id) DO UPDATE SET
+        likes = likes + excluded.likes,
+        dislikes = dislikes + excluded.dislikes;
+END;
+PRAGMA user_version = 12;
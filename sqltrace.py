@@ -0,0 +1,197 @@
+"""
+Module: sqltrace.py
+
+This module is an opt-in tracer for the SQL statements a request runs.
+
+When enabled, the request's connection reports every statement it runs through
+`sqlite3.Connection.set_trace_callback`, whether it comes from a handler in app.py or
+from login.py. Statements are normalized by replacing their literal values with `?`,
+so the same query run for different ids is counted as one statement. Time spent in
+SQLite is added to the statement that was running, as measured by the request
+metrics' cursor.
+
+A statement that runs more than `SQL_TRACE_THRESHOLD` times in one request is
+flagged as an N+1: a query issued once per item of a list instead of once for the
+whole list. Every traced response gets an `X-SQL-Trace` header summarizing the
+request's statements, and each N+1 is logged as a warning with its statement.
+
+Classes:
+- RequestTrace(threshold): The statements seen during one request.
+
+Functions:
+- normalize(statement): Replaces the literal values in a statement with `?`.
+- init_app(app): Registers the tracer with a Flask application.
+
+Usage:
+Call `init_app(app)` once, then set `SQL_TRACE=1` in the environment, or
+`app.config["SQL_TRACE"] = True`, and optionally `SQL_TRACE_THRESHOLD` (default 5).
+Tracing has a per-statement cost and is meant for development and pre-deploy checks.
+
+Example:
+SQL_TRACE=1 python3 app.py
+curl -sI http://127.0.0.1/newsfeed | grep X-SQL-Trace
+"""
+import os
+import re
+from flask import current_app, g, request
+from db import get_db
+
+DEFAULT_THRESHOLD = 5
+
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+VALUE_LIST_RE = re.compile(r"\(\?(?:\s*,\s*\?)+\)")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize(statement):
+    """
+    Replaces the literal values in a statement with `?` and collapses whitespace.
+
+    Lists of values, such as the ids in an `IN (...)` clause, become a single `(?)`,
+    so batches of different sizes are counted as one statement.
+
+    Parameters:
+    - statement (str): A statement as passed to the trace callback, with its
+      parameters filled in.
+
+    Returns:
+    - str: The normalized statement.
+    """
+    statement = STRING_LITERAL_RE.sub("?", statement)
+    statement = NUMBER_LITERAL_RE.sub("?", statement)
+    statement = VALUE_LIST_RE.sub("(?)", statement)
+    return WHITESPACE_RE.sub(" ", statement).strip()
+
+
+class RequestTrace:
+    """
+    The statements seen during one request, with how often each ran and its time.
+
+    Parameters:
+    - threshold (int): How many runs of one statement are allowed before it is
+      flagged as an N+1.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        # normalized statement -> [runs, seconds], in the order first seen
+        self.statements = {}
+        self.current = None
+
+    def record(self, statement):
+        """
+        Trace callback: counts a statement the connection is about to run.
+
+        Parameters:
+        - statement (str): The statement, with its parameters filled in.
+        """
+        # Statements run by triggers are part of the statement that fired them
+        if statement.startswith("--"):
+            return
+        key = normalize(statement)
+        entry = self.statements.get(key)
+        if entry is None:
+            entry = self.statements[key] = [0, 0.0]
+        entry[0] += 1
+        self.current = entry
+
+    def add_time(self, seconds):
+        """
+        Adds time spent in SQLite to the statement that ran last.
+
+        Parameters:
+        - seconds (float): The time spent executing or fetching rows.
+        """
+        if self.current is not None:
+            self.current[1] += seconds
+
+    def n_plus_one(self):
+        """
+        Returns the statements that ran more often than the threshold.
+
+        Returns:
+        - list: (statement, runs, seconds) tuples, most frequent first.
+        """
+        flagged = [
+            (statement, runs, seconds)
+            for statement, (runs, seconds) in self.statements.items()
+            if runs > self.threshold
+        ]
+        return sorted(flagged, key=lambda entry: entry[1], reverse=True)
+
+    def summary(self):
+        """
+        Returns a one-line summary of the request's statements for the response header.
+
+        Returns:
+        - str: The number of statements run, distinct statements, their total time
+          in milliseconds and the number of N+1 statements.
+        """
+        runs = sum(entry[0] for entry in self.statements.values())
+        seconds = sum(entry[1] for entry in self.statements.values())
+        return (
+            f"statements={runs}; distinct={len(self.statements)}; "
+            f"db_ms={seconds * 1000:.2f}; n_plus_one={len(self.n_plus_one())}"
+        )
+
+
+def start_trace():
+    """
+    Starts tracing the statements run on the request's connection, if enabled.
+    """
+    if not current_app.config.get("SQL_TRACE"):
+        return
+    trace = RequestTrace(int(current_app.config.get("SQL_TRACE_THRESHOLD", DEFAULT_THRESHOLD)))
+    g.sql_trace = trace
+    timings = g.get("request_timings")
+    if timings is not None:
+        timings.trace = trace
+    get_db().set_trace_callback(trace.record)
+
+
+def finish_trace(response):
+    """
+    Stops tracing, adds the summary header and logs any N+1 statements.
+
+    Parameters:
+    - response (flask.Response): The response about to be sent.
+
+    Returns:
+    - flask.Response: The same response.
+    """
+    trace = g.pop("sql_trace", None)
+    if trace is None:
+        return response
+    get_db().set_trace_callback(None)
+
+    response.headers["X-SQL-Trace"] = trace.summary()
+    for statement, runs, seconds in trace.n_plus_one():
+        current_app.logger.warning(
+            "N+1 query on %s %s: ran %d times (%.2f ms): %s",
+            request.method,
+            request.path,
+            runs,
+            seconds * 1000,
+            statement,
+        )
+    return response
+
+
+def init_app(app):
+    """
+    Registers the tracer with a Flask application.
+
+    Tracing only happens while `SQL_TRACE` is enabled in the app's config, which
+    defaults to the `SQL_TRACE` environment variable. Must be called after the
+    request metrics are registered, so that statement times reach the trace.
+
+    Parameters:
+    - app (Flask): The application to trace.
+    """
+    app.config.setdefault("SQL_TRACE", os.environ.get("SQL_TRACE") == "1")
+    app.config.setdefault(
+        "SQL_TRACE_THRESHOLD", int(os.environ.get("SQL_TRACE_THRESHOLD", DEFAULT_THRESHOLD))
+    )
+    app.before_request(start_trace)
+    app.after_request(finish_trace)
@@ -15,11 +15,27 @@ Functions:
 - test_db_connection: Tests the database connection.
 - test_home_page: Tests the home page route of the Flask application.
 - test_newsfeed_route: Tests the '/newsfeed' route of the application.
+- test_newsfeed_conditional_get: Tests that '/newsfeed' answers a matching If-None-Match
+     with 304 Not Modified.
+- test_newsfeed_fields_and_ndjson: Tests field selection, cursors and NDJSON streaming on
+     '/newsfeed'.
 - user_exists: Helper function to check if a user exists in the database.
 - test_insert_user_into_db: Tests the insertion of a new user into the database.
 - add_story_likes_for_testing: Helper function to add likes/dislikes to a story for testing.
 - test_get_likes_dislikes_db: Tests the function that retrieves like/dislike counts from the
      database.
+- test_get_likes_dislikes_batch: Tests that like/dislike counts for several stories are read
+     in one query.
+- test_is_admin_caches_role: Tests that admin status is cached until it is invalidated.
+- test_get_db: Tests that requests share one configured, migrated database connection per
+     thread.
+- test_apply_vote_overlay: Tests that vote markers in a cached story list are filled in.
+- test_newsfeed_cache_per_database: Tests that '/newsfeed' pages cached for one database
+     are not served for another at the same data version.
+- test_get_news_page: Tests that a page of news items is read from the database in feed order.
+- test_get_news_page_of_feed: Tests that a page of another feed is read in rank order.
+- test_get_comment_thread: Tests that a comment thread is read in thread order.
+- test_metrics_endpoint: Tests that '/metrics' reports per-route timings to admins only.
 """
 
 import sqlite3
@@ -27,7 +43,11 @@ import os
 import json
 import pytest
 from app import app as flask_app
-from app import get_likes_dislikes_db, insert_user_into_db
+from app import get_likes_dislikes_db, insert_user_into_db, get_news_page, ITEMS_PER_PAGE
+from app import get_likes_dislikes_batch, apply_vote_overlay, VOTE_MARKER, get_comment_thread
+from db import bump_data_version, get_db
+from login import invalidate_admin_cache, is_admin
+from migrations import MIGRATIONS, migrate
 
 
 def get_db_connection():
@@ -156,6 +176,53 @@ def test_newsfeed_route(test_client):
     assert len(data) <= 30  # Assuming it should return up to 30 items
 
 
+def test_newsfeed_conditional_get(test_client):
+    """
+    GIVEN a Flask application
+    WHEN the '/newsfeed' route is requested again with the ETag of the first response
+    THEN check that the second response is 304 Not Modified until the data version changes
+    """
+    response = test_client.get("/newsfeed")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert not response.headers["ETag"].startswith("W/")
+
+    response = test_client.get("/newsfeed", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    bump_data_version("stories.db")
+    response = test_client.get("/newsfeed", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_newsfeed_fields_and_ndjson(test_client):
+    """
+    GIVEN a Flask application
+    WHEN '/newsfeed' is requested with a field list, a limit, a cursor and as NDJSON
+    THEN check that only the requested fields and rows are returned in each format
+    """
+    response = test_client.get("/newsfeed?fields=id,title&limit=2")
+    first_page = json.loads(response.data)
+    assert len(first_page) <= 2
+    assert all(set(item) == {"id", "title"} for item in first_page)
+
+    if "Link" in response.headers:
+        next_url = response.headers["Link"].split(">")[0][1:]
+        second_page = json.loads(test_client.get(next_url).data)
+        assert not {item["id"] for item in first_page} & {item["id"] for item in second_page}
+
+    response = test_client.get("/newsfeed?format=ndjson&fields=id&limit=3")
+    lines = response.data.decode().splitlines()
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in lines] == [
+        item["id"] for item in json.loads(test_client.get("/newsfeed?limit=3").data)
+    ]
+
+    assert test_client.get("/newsfeed?fields=password").status_code == 400
+
+
 def user_exists(email):
     """
     Checks if a user exists in the database
@@ -288,3 +355,243 @@ def test_get_likes_dislikes_db():
     cursor.execute("DELETE FROM new_stories WHERE id = ?", (test_story_id,))
     conn.commit()
     conn.close()
+
+
+def test_get_likes_dislikes_batch():
+    """
+    Test that get_likes_dislikes_batch counts likes and dislikes for a list of stories.
+    """
+    conn = get_db_connection()
+
+    # Setup test data
+    test_story_id = 123  # Example story ID
+    untouched_story_id = 456  # A story without votes
+    add_story_likes_for_testing(conn, test_story_id)
+
+    counts = get_likes_dislikes_batch(conn.cursor(), [test_story_id, untouched_story_id])
+
+    assert counts == {test_story_id: (1, 1), untouched_story_id: (0, 0)}
+
+    # Cleanup: remove test data from the database
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM story_likes WHERE story_id = ?", (test_story_id,))
+    cursor.execute("DELETE FROM new_stories WHERE id = ?", (test_story_id,))
+    conn.commit()
+    conn.close()
+
+
+def test_is_admin_caches_role(app):
+    """
+    GIVEN an admin user in the database
+    WHEN their admin flag is revoked
+    THEN check that the cached status is used until the cache is invalidated
+    """
+    email = "cached-admin@example.com"
+    conn = get_db_connection()
+    conn.execute("INSERT INTO users (email, name, admin) VALUES (?, ?, 1)", (email, "Admin"))
+    conn.commit()
+
+    with app.app_context():
+        invalidate_admin_cache()
+        assert is_admin(email)
+
+        conn.execute("UPDATE users SET admin = 0 WHERE email = ?", (email,))
+        conn.commit()
+
+        assert is_admin(email)
+        invalidate_admin_cache(email)
+        assert not is_admin(email)
+        assert not is_admin("nobody@example.com")
+
+    conn.execute("DELETE FROM users WHERE email = ?", (email,))
+    conn.commit()
+    conn.close()
+
+
+def test_get_db(app, tmp_path):
+    """
+    GIVEN a Flask application configured with a database path
+    WHEN the database connection is requested in two application contexts
+    THEN check that the same connection is reused, runs in WAL mode and has migrated
+         the new database
+    """
+    database = app.config["DATABASE"]
+    app.config["DATABASE"] = str(tmp_path / "stories.db")
+    try:
+        with app.app_context():
+            first = get_db()
+            assert get_db() is first
+            assert first.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert first.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+        with app.app_context():
+            assert get_db() is first
+    finally:
+        app.config["DATABASE"] = database
+
+
+
+def test_newsfeed_cache_per_database(app, test_client, tmp_path):
+    """
+    GIVEN two databases at the same data version holding different stories
+    WHEN '/newsfeed' is requested with the application pointed at each in turn
+    THEN check that each response lists the stories of its own database
+    """
+    paths = [str(tmp_path / "one.db"), str(tmp_path / "two.db")]
+    for story_id, path in enumerate(paths, 1):
+        conn = sqlite3.connect(path)
+        migrate(conn)
+        conn.execute(
+            "INSERT INTO new_stories (by, id, score, time, title, url) "
+            "VALUES ('t', ?, 1, 0, 'Story', 'u')",
+            (story_id,),
+        )
+        conn.commit()
+        conn.close()
+
+    database = app.config["DATABASE"]
+    try:
+        ids = []
+        for path in paths:
+            app.config["DATABASE"] = path
+            response = test_client.get("/newsfeed?fields=id")
+            ids.append([item["id"] for item in json.loads(response.data)])
+    finally:
+        app.config["DATABASE"] = database
+    assert ids == [[1], [2]]
+
+
+def test_get_news_page(tmp_path):
+    """
+    GIVEN a new_stories table loaded in feed order
+    WHEN a page of news items is requested
+    THEN check that only that page is returned, in feed order
+    """
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    cursor = conn.cursor()
+    cursor.execute(
+        "CREATE TABLE new_stories (by TEXT, id INTEGER, score INTEGER, time INTEGER, "
+        "title TEXT, url TEXT, descendants INTEGER, type TEXT, text TEXT)"
+    )
+    # Ids deliberately out of order: the feed order is the load order
+    story_ids = [100 - i for i in range(25)]
+    cursor.executemany(
+        "INSERT INTO new_stories (by, id, score, time, title, url) VALUES ('t', ?, 0, 0, 't', 't')",
+        [(story_id,) for story_id in story_ids],
+    )
+
+    second_page = [row[1] for row in get_news_page(cursor, 2)]
+    last_page = [row[1] for row in get_news_page(cursor, 3)]
+    conn.close()
+
+    assert second_page == story_ids[ITEMS_PER_PAGE:2 * ITEMS_PER_PAGE]
+    assert last_page == story_ids[2 * ITEMS_PER_PAGE:]
+
+
+def test_get_news_page_of_feed(tmp_path):
+    """
+    GIVEN stories ranked in the ask feed
+    WHEN a page of the ask feed is requested
+    THEN check that its stories are returned in rank order, with the new_stories columns
+    """
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    migrate(conn)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO stories (id, by, score, time, title, url) VALUES (?, 'u', 1, 0, ?, '')",
+        [(story_id, f"Ask {story_id}") for story_id in range(1, 16)],
+    )
+    cursor.executemany(
+        "INSERT INTO feed_items (feed, rank, item_id) VALUES ('ask', ?, ?)",
+        [(rank, 16 - rank) for rank in range(1, 16)],
+    )
+
+    page = get_news_page(cursor, 2, "ask")
+    conn.close()
+
+    assert [row[1] for row in page] == [5, 4, 3, 2, 1]
+    assert page[0][:5] == ("u", 5, 1, 0, "Ask 5")
+
+
+def test_get_comment_thread(tmp_path):
+    """
+    GIVEN a story with two comments, the first of which has two replies
+    WHEN the story's thread is read, in full and one level deep
+    THEN check that every reply follows its parent, siblings keep their order, and the
+         depth limit leaves the replies out
+    """
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    migrate(conn)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO comments (id, story_id, by, text) VALUES (?, 1, 'u', ?)",
+        [(comment_id, f"Comment {comment_id}") for comment_id in (10, 11, 12, 13)],
+    )
+    # Inserted out of order: 11 and 10 answer the story, 13 and 12 answer 10
+    cursor.executemany(
+        "INSERT INTO story_kids (parent_id, position, kid_id) VALUES (?, ?, ?)",
+        [(1, 2, 11), (10, 2, 12), (1, 1, 10), (10, 1, 13)],
+    )
+
+    thread = get_comment_thread(cursor, 1)
+    top_level = get_comment_thread(cursor, 1, depth=1)
+    conn.close()
+
+    assert [(comment["id"], comment["parent"], comment["depth"]) for comment in thread] == [
+        (10, 1, 1), (13, 10, 2), (12, 10, 2), (11, 1, 1)
+    ]
+    assert [comment["id"] for comment in top_level] == [10, 11]
+
+
+def test_apply_vote_overlay():
+    """
+    GIVEN a cached story list with vote markers for two stories
+    WHEN the current vote counts are laid over it
+    THEN check that the counts and like/dislike card styles are filled in
+    """
+    fragment = "".join(
+        f"<div class='{VOTE_MARKER.format(kind='class', story_id=story_id)}'>"
+        f"{VOTE_MARKER.format(kind='like', story_id=story_id)}/"
+        f"{VOTE_MARKER.format(kind='dislike', story_id=story_id)}</div>"
+        for story_id in (1, 2)
+    )
+
+    html = apply_vote_overlay(fragment, {1: (0, 3)})
+
+    assert html == "<div class='dislike'>0/3</div><div class=''>0/0</div>"
+
+
+def test_metrics_endpoint(app, test_client):
+    """
+    GIVEN a request to '/newsfeed' and an admin user
+    WHEN '/metrics' is requested by a visitor and by the admin
+    THEN check that the visitor is redirected and the admin gets the '/newsfeed'
+         latency, DB time and query count histograms in the Prometheus format
+    """
+    email = "metrics-admin@example.com"
+    conn = get_db_connection()
+    conn.execute("INSERT INTO users (email, name, admin) VALUES (?, ?, 1)", (email, "Admin"))
+    conn.commit()
+    secret_key = app.secret_key
+    app.secret_key = secret_key or "test"
+    try:
+        assert test_client.get("/newsfeed").status_code == 200
+        assert test_client.get("/metrics").status_code == 302
+
+        with test_client.session_transaction() as sess:
+            sess["user"] = {"userinfo": {"email": email}}
+        response = test_client.get("/metrics")
+        body = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain")
+        assert "# TYPE http_request_duration_seconds histogram" in body
+        assert 'http_request_duration_seconds_count{endpoint="/newsfeed"}' in body
+        assert 'http_request_db_seconds_bucket{endpoint="/newsfeed",le="+Inf"}' in body
+        assert 'http_request_queries_sum{endpoint="/newsfeed"}' in body
+        assert 'http_requests_total{endpoint="/metrics",status="302"}' in body
+    finally:
+        app.secret_key = secret_key
+        invalidate_admin_cache(email)
+        conn.execute("DELETE FROM users WHERE email = ?", (email,))
+        conn.commit()
+        conn.close()
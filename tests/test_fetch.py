@@ -0,0 +1,465 @@
+"""
+Module: test_fetch.py
+
+This module contains unit tests for the Hacker News fetcher in fetch.py.
+The fetcher is pointed at a local stand-in Hacker News server so the tests
+run without network access.
+
+Functions:
+- hn_server: A pytest fixture that runs a stand-in Hacker News server.
+- test_concurrent_fetch_matches_sequential: Tests that concurrent fetching returns the
+     same sorted list as a sequential fetch.
+- test_incremental_fetch_only_downloads_changed_items: Tests that an incremental fetch
+     only downloads new or changed items.
+- test_incremental_fetch_refreshes_by_rank_tier: Tests that cached items are refreshed
+     at the rate of their rank's tier.
+- test_insert_data_into_db_swaps_in_complete_table: Tests that loading stories replaces
+     the whole table through the shadow table.
+- test_run_fetch_records_ledger_row: Tests that a fetch run is recorded in fetch_runs.
+- test_run_fetch_bumps_version_after_ledger_row: Tests that the data version changes only
+     once the run is recorded.
+- test_run_fetch_skips_removed_stories: Tests that deleted and dead stories are left out
+     and that a run ended by an error is recorded as failed.
+- test_run_fetch_downloads_shared_feed_items_once: Tests that items listed by several
+     feeds are downloaded once and recorded in every feed.
+- test_run_fetch_stores_comment_threads: Tests that the comment stage stores whole threads,
+     skips threads that have not changed and is counted apart in the ledger.
+- test_run_fetch_refetches_cut_short_threads: Tests that a thread cut short by the comment
+     deadline is fetched again by the next run.
+- test_get_comment_trees_respects_limits: Tests that comment fetching stops at the depth
+     and count limits.
+- test_fetch_retries_failed_requests: Tests that failing requests are retried and null
+     items are skipped.
+- test_fetch_deadline_keeps_partial_results: Tests that a slow server cannot hold a run
+     past its deadline.
+- test_run_daemon_refreshes_until_stopped: Tests that the daemon keeps refreshing, stops
+     on request and refuses to run twice.
+- test_run_daemon_survives_unexpected_errors: Tests that a run failing with an unexpected
+     error does not stop the daemon.
+"""
+
+import fcntl
+import sqlite3
+import threading
+import time
+from operator import itemgetter
+import pytest
+import fetch
+from benchmarks.hn_stub import add_comment_trees, make_items, start_stub_server
+from comments import get_comment_trees
+from fetch import (
+    FetchStats,
+    create_session,
+    get_hacker_news_data,
+    get_hacker_news_data_incremental,
+    insert_data_into_db,
+    run_daemon,
+    run_fetch,
+    sort_stories,
+)
+
+
+@pytest.fixture
+def hn_server():
+    """
+    Pytest fixture that runs a stand-in Hacker News server for the duration of a test.
+    """
+    server = start_stub_server(make_items(60))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_fetch_matches_sequential(hn_server):
+    """
+    GIVEN a stand-in Hacker News server
+    WHEN stories are fetched with and without concurrency
+    THEN check that both runs return the same list, sorted newest first
+    """
+    sequential = get_hacker_news_data(concurrency=1, base_url=hn_server.base_url)
+    concurrent = get_hacker_news_data(concurrency=8, base_url=hn_server.base_url)
+
+    assert len(concurrent) == 60
+    assert concurrent == sequential
+    assert concurrent == sorted(concurrent, key=itemgetter("time"), reverse=True)
+
+
+def test_incremental_fetch_only_downloads_changed_items(hn_server, tmp_path):
+    """
+    GIVEN a stand-in Hacker News server and an empty item cache
+    WHEN an incremental fetch runs twice with one item reported as changed in between
+    THEN check that the second run only downloads that item and still returns every story
+    """
+    db_path = str(tmp_path / "stories.db")
+    first = get_hacker_news_data_incremental(base_url=hn_server.base_url, db_path=db_path)
+
+    hn_server.items[5]["score"] = 9999
+    hn_server.updated_ids = [5]
+    hn_server.request_count = 0
+    second = get_hacker_news_data_incremental(base_url=hn_server.base_url, db_path=db_path)
+
+    # topstories.json, updates.json and the one changed item
+    assert hn_server.request_count == 3
+    assert len(second) == len(first) == 60
+    assert [x for x in second if x["id"] == 5][0]["score"] == 9999
+
+
+def test_incremental_fetch_refreshes_by_rank_tier(hn_server, tmp_path):
+    """
+    GIVEN an item cache filled by an incremental fetch
+    WHEN the cache is aged by two minutes and the fetch runs again
+    THEN check that only the front page tier is downloaded again and ranks are recorded
+    """
+    db_path = str(tmp_path / "stories.db")
+    get_hacker_news_data_incremental(base_url=hn_server.base_url, db_path=db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE item_cache SET fetched_at = fetched_at - 120")
+
+    hn_server.request_count = 0
+    data = get_hacker_news_data_incremental(base_url=hn_server.base_url, db_path=db_path)
+
+    assert len(data) == 60
+    # topstories.json, updates.json and ranks 1-30
+    assert hn_server.request_count == 2 + 30
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT id, rank, last_seen IS NOT NULL FROM item_cache ORDER BY rank"
+        ).fetchall()
+    assert rows == [(x, rank, 1) for rank, x in enumerate(hn_server.top_ids, 1)]
+
+
+def test_insert_data_into_db_swaps_in_complete_table(tmp_path):
+    """
+    GIVEN a database that already holds stories
+    WHEN a new batch of stories is loaded
+    THEN check that the table holds exactly the new batch, in load order
+    """
+    db_path = str(tmp_path / "stories.db")
+    items = sort_stories(list(make_items(25).values()))
+    insert_data_into_db(items[:10], db_path=db_path)
+    insert_data_into_db(items, db_path=db_path)
+
+    conn = sqlite3.connect(db_path)
+    ids = [row[0] for row in conn.execute("SELECT id FROM new_stories ORDER BY rowid")]
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master")]
+    conn.close()
+
+    assert ids == [item["id"] for item in items]
+    assert "new_stories_shadow" not in tables
+
+
+def test_run_fetch_records_ledger_row(hn_server, tmp_path):
+    """
+    GIVEN a stand-in Hacker News server
+    WHEN a full fetch runs through run_fetch
+    THEN check that fetch_runs holds one successful run with its counts, latencies and
+         write statistics
+    """
+    db_path = str(tmp_path / "stories.db")
+    stats = run_fetch(concurrency=4, db_path=db_path, base_url=hn_server.base_url)
+
+    conn = sqlite3.connect(db_path)
+    row = conn.execute(
+        """SELECT mode, status, items_requested, items_fetched, items_failed,
+        latency_p50_ms <= latency_p95_ms, bytes_downloaded, rows_written, db_write_ms > 0,
+        finished_at >= started_at
+        FROM fetch_runs"""
+    ).fetchall()
+    conn.close()
+
+    assert row == [("full", "ok", 60, 60, 0, 1, stats.bytes_downloaded, 60, 1, 1)]
+    assert stats.bytes_downloaded > 0
+
+
+def test_run_fetch_bumps_version_after_ledger_row(hn_server, tmp_path, monkeypatch):
+    """
+    GIVEN a stand-in Hacker News server
+    WHEN a fetch runs through run_fetch
+    THEN check that the data version is bumped once, after the run's ledger row is
+         committed
+    """
+    db_path = str(tmp_path / "stories.db")
+    runs_at_bump = []
+
+    def counting_bump(path):
+        with sqlite3.connect(path) as conn:
+            runs_at_bump.append(conn.execute("SELECT COUNT(*) FROM fetch_runs").fetchone()[0])
+
+    monkeypatch.setattr(fetch, "bump_data_version", counting_bump)
+    run_fetch(db_path=db_path, base_url=hn_server.base_url)
+
+    assert runs_at_bump == [1]
+
+
+def test_run_fetch_skips_removed_stories(tmp_path, monkeypatch):
+    """
+    GIVEN a stand-in server listing a deleted, a dead and a score-less story
+    WHEN a fetch runs into a fresh database, and then a fetch whose write fails
+    THEN check that the first run stores the other stories and the second is recorded
+         as failed
+    """
+    items = make_items(20)
+    items[3] = {"id": 3, "deleted": True, "time": 1700000000, "type": "story"}
+    items[4]["dead"] = True
+    del items[5]["score"]
+    server = start_stub_server(items)
+    db_path = str(tmp_path / "stories.db")
+    try:
+        run_fetch(db_path=db_path, base_url=server.base_url)
+
+        def failing_insert(*args):
+            raise KeyError(args[0])
+
+        monkeypatch.setattr(fetch, "insert_feeds_into_db", failing_insert)
+        with pytest.raises(KeyError):
+            run_fetch(db_path=db_path, base_url=server.base_url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    conn = sqlite3.connect(db_path)
+    ids = {row[0] for row in conn.execute("SELECT id FROM new_stories")}
+    runs = conn.execute("SELECT status, rows_written FROM fetch_runs ORDER BY id").fetchall()
+    conn.close()
+    assert ids == set(items) - {3, 4, 5}
+    assert runs == [("ok", 17), ("failed", None)]
+
+
+def test_run_fetch_downloads_shared_feed_items_once(tmp_path):
+    """
+    GIVEN a stand-in server whose top, new and ask feeds share some items
+    WHEN a fetch of the three feeds runs
+    THEN check that each item is downloaded once, stored once, and ranked in every feed
+         at its position in the API's list
+    """
+    items = make_items(80)
+    server = start_stub_server(
+        items,
+        top_ids=list(range(1, 61)),
+        feed_ids={"newstories": list(range(80, 40, -1)), "askstories": [7, 70]},
+    )
+    db_path = str(tmp_path / "stories.db")
+    try:
+        run_fetch(db_path=db_path, feeds=("new", "ask"), base_url=server.base_url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Three id lists and 80 distinct items
+    assert server.request_count == 3 + 80
+    conn = sqlite3.connect(db_path)
+    counts = conn.execute(
+        "SELECT feed, COUNT(*) FROM feed_items GROUP BY feed ORDER BY feed"
+    ).fetchall()
+    stored = conn.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+    ask = conn.execute(
+        "SELECT rank, item_id FROM feed_items WHERE feed = 'ask' ORDER BY rank"
+    ).fetchall()
+    new = conn.execute(
+        "SELECT item_id FROM feed_items WHERE feed = 'new' ORDER BY rank LIMIT 3"
+    ).fetchall()
+    conn.close()
+
+    assert counts == [("ask", 2), ("new", 40), ("top", 60)]
+    assert stored == 80
+    # Ranked in the API's order, not the news page's
+    assert ask == [(1, 7), (2, 70)]
+    assert new == [(80,), (79,), (78,)]
+
+
+def test_run_fetch_stores_comment_threads(tmp_path):
+    """
+    GIVEN a stand-in server whose stories have three levels of three replies each
+    WHEN two fetches with the comment stage run, without comment changes in between
+    THEN check that the first stores every comment and edge of the first stories, and
+         the second does not fetch their threads again; the ledger counts the comments
+         apart from the stories
+    """
+    items = add_comment_trees(make_items(5), depth=3, fanout=3)
+    server = start_stub_server(items, top_ids=list(range(1, 6)))
+    db_path = str(tmp_path / "stories.db")
+    try:
+        run_fetch(db_path=db_path, comments=2, base_url=server.base_url)
+        server.request_count = 0
+        run_fetch(db_path=db_path, comments=2, base_url=server.base_url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # topstories.json and the five stories
+    assert server.request_count == 1 + 5
+    conn = sqlite3.connect(db_path)
+    per_story = conn.execute("SELECT story_id, COUNT(*) FROM comments GROUP BY story_id").fetchall()
+    edges = conn.execute("SELECT COUNT(*) FROM story_kids").fetchone()[0]
+    runs = conn.execute(
+        """SELECT items_requested, items_fetched, comments_requested, comments_fetched,
+        comments_failed FROM fetch_runs ORDER BY id"""
+    ).fetchall()
+    conn.close()
+    assert len(per_story) == 2 and all(count == 3 + 9 + 27 for _, count in per_story)
+    assert edges == 2 * 39
+    assert runs == [(5, 5, 2 * 39, 2 * 39, 0), (5, 5, 0, 0, 0)]
+
+
+def test_run_fetch_refetches_cut_short_threads(tmp_path):
+    """
+    GIVEN a stand-in server answering some item requests after half a second
+    WHEN a fetch with a short comment deadline runs, then one with a long deadline
+    THEN check that the first stores partial threads without a comment count, and the
+         second completes them
+    """
+    items = add_comment_trees(make_items(3), depth=3, fanout=3)
+    server = start_stub_server(items, top_ids=[1, 2, 3], slow_rate=0.3, slow_latency=0.5, seed=2)
+    db_path = str(tmp_path / "stories.db")
+    query = "SELECT descendants FROM comment_threads"
+    try:
+        run_fetch(db_path=db_path, comments=2, comment_deadline=0.2, base_url=server.base_url)
+        with sqlite3.connect(db_path) as conn:
+            first = conn.execute(query).fetchall()
+            first_count = conn.execute("SELECT COUNT(*) FROM comments").fetchone()[0]
+        run_fetch(db_path=db_path, comments=2, comment_deadline=30, base_url=server.base_url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with sqlite3.connect(db_path) as conn:
+        second = conn.execute(query).fetchall()
+        second_count = conn.execute("SELECT COUNT(*) FROM comments").fetchone()[0]
+    assert (None,) in first
+    assert first_count < 2 * 39
+    assert second == [(39,), (39,)]
+    assert second_count == 2 * 39
+
+
+def test_get_comment_trees_respects_limits():
+    """
+    GIVEN a stand-in server whose stories have three levels of three replies each
+    WHEN comment trees are fetched with a depth limit of two and a count limit of ten
+    THEN check that each story gets its three top-level comments and seven replies
+    """
+    items = add_comment_trees(make_items(3), depth=3, fanout=3)
+    server = start_stub_server(items, top_ids=[1, 2, 3])
+    session = create_session()
+    try:
+        comments, edges, incomplete = get_comment_trees(
+            session, [items[1], items[2]], base_url=server.base_url, max_depth=2, max_count=10
+        )
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+    assert len(comments) == len(edges) == 20
+    assert not incomplete
+    assert [edge for edge in edges if edge[0] == 1] == [(1, 1, 4), (1, 2, 5), (1, 3, 6)]
+    # No reply below the second level
+    parents = (1, 2, *items[1]["kids"], *items[2]["kids"])
+    assert all(item["parent"] in parents for _, item in comments)
+
+
+def test_fetch_retries_failed_requests():
+    """
+    GIVEN a stand-in server failing a quarter of item requests and serving some items as null
+    WHEN stories are fetched with retries
+    THEN check that every non-null item is returned and the null items are counted as failed
+    """
+    items = make_items(60)
+    server = start_stub_server(items, fail_rate=0.25, null_rate=0.1, seed=3)
+    try:
+        stats = FetchStats("full", 8)
+        data = get_hacker_news_data(concurrency=8, base_url=server.base_url, stats=stats, retries=8)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    nulls = [x for x in items if server.roll("null", x) < server.null_rate]
+    assert nulls
+    assert sorted(story["id"] for story in data) == [x for x in items if x not in nulls]
+    assert stats.items_fetched == 60 - len(nulls)
+    assert stats.items_failed == len(nulls)
+
+
+def test_fetch_deadline_keeps_partial_results():
+    """
+    GIVEN a stand-in server answering half of the item requests after two seconds
+    WHEN stories are fetched with a one second deadline
+    THEN check that the run returns in bounded time with the fast items
+    """
+    server = start_stub_server(make_items(40), slow_rate=0.5, slow_latency=2.0, seed=1)
+    try:
+        started = time.monotonic()
+        data = get_hacker_news_data(concurrency=8, base_url=server.base_url, deadline=1.0)
+        elapsed = time.monotonic() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 0 < len(data) < 40
+    assert elapsed < 2.0
+
+
+def test_run_daemon_refreshes_until_stopped(hn_server, tmp_path):
+    """
+    GIVEN a stand-in Hacker News server
+    WHEN the fetch daemon runs on a short interval and is then stopped
+    THEN check that it recorded a run per refresh, stopped, and cannot start while
+         another process holds its lock
+    """
+    db_path = str(tmp_path / "stories.db")
+    stop = threading.Event()
+    runs = []
+    daemon = threading.Thread(
+        target=lambda: runs.append(
+            run_daemon(
+                0.05, 0.5, stop=stop, incremental=True, db_path=db_path,
+                base_url=hn_server.base_url,
+            )
+        )
+    )
+    daemon.start()
+    deadline = time.monotonic() + 10
+    count = 0
+    while count < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        with sqlite3.connect(db_path) as conn:
+            try:
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM fetch_runs WHERE status = 'ok'"
+                ).fetchone()[0]
+            except sqlite3.OperationalError:
+                count = 0
+    stop.set()
+    daemon.join(10)
+
+    assert not daemon.is_alive()
+    assert 3 <= count <= runs[0]
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM new_stories").fetchone()[0] == 60
+
+    with open(f"{db_path}.fetch.lock", "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with pytest.raises(RuntimeError):
+            run_daemon(db_path=db_path, base_url=hn_server.base_url)
+
+
+def test_run_daemon_survives_unexpected_errors(tmp_path, monkeypatch, capsys):
+    """
+    GIVEN a fetch whose first run fails with an unexpected error
+    WHEN the fetch daemon runs
+    THEN check that it logs the traceback and makes the next run
+    """
+    stop = threading.Event()
+    calls = []
+
+    def flaky_run_fetch(*args, **kwargs):  # pylint: disable=unused-argument
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise KeyError("score")
+        stop.set()
+        return FetchStats()
+
+    monkeypatch.setattr(fetch, "run_fetch", flaky_run_fetch)
+    runs = run_daemon(0.01, 0.0, stop=stop, db_path=str(tmp_path / "stories.db"))
+
+    assert runs == 2
+    assert "Traceback" in capsys.readouterr().out
@@ -0,0 +1,46 @@
+"""
+Module: test_generate_data.py
+
+This module contains unit tests for the synthetic data generator in
+benchmarks/generate_data.py.
+
+Functions:
+- test_generate_is_repeatable: Tests that the same seed produces the same database,
+     with votes concentrated on a few stories and users.
+"""
+
+import sqlite3
+from benchmarks.generate_data import generate
+
+
+def test_generate_is_repeatable(tmp_path):
+    """
+    GIVEN two databases generated with the same arguments and seed
+    WHEN their stories and votes are read back
+    THEN check that they are identical, have the requested sizes, and that votes
+         are concentrated on the most popular stories and users
+    """
+    snapshots = []
+    for name in ("first.db", "second.db"):
+        path = str(tmp_path / name)
+        counts = generate(path, stories=500, users=50, votes=2000, seed=7)
+        assert counts == {"stories": 500, "users": 50, "votes": 2000}
+
+        conn = sqlite3.connect(path)
+        snapshots.append(
+            (
+                conn.execute("SELECT * FROM new_stories ORDER BY rowid").fetchall(),
+                conn.execute("SELECT * FROM story_likes ORDER BY story_id, user_email").fetchall(),
+            )
+        )
+        top_story = conn.execute(
+            "SELECT MAX(likes + dislikes) FROM story_vote_counts"
+        ).fetchone()[0]
+        top_user = conn.execute(
+            "SELECT COUNT(*) FROM story_likes GROUP BY user_email ORDER BY 1 DESC LIMIT 1"
+        ).fetchone()[0]
+        conn.close()
+
+    assert snapshots[0] == snapshots[1]
+    assert top_story > 2000 / 500 * 10
+    assert top_user > 2000 / 50 * 3
@@ -0,0 +1,106 @@
+"""
+Module: test_migrations.py
+
+This module contains unit tests for the schema migrations in migrations.py.
+
+Functions:
+- test_migrate_upgrades_baseline_database: Tests that a database with the original schema
+     is upgraded in place, keeping its data.
+- test_migrate_is_idempotent: Tests that migrating an up-to-date database does nothing.
+- test_schema_sql_bootstraps_current_version: Tests that a database created from schema.sql
+     is at the current version and matches the migrations.
+"""
+
+import os
+import sqlite3
+from migrations import BASELINE_SCHEMA, MIGRATIONS, migrate, schema_script
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "schema.sql")
+
+
+def test_migrate_upgrades_baseline_database(tmp_path):
+    """
+    GIVEN a database with the original schema, duplicate rows and votes holding story copies
+    WHEN the migrations are applied
+    THEN check that the keys and indexes exist, duplicates are merged, the story copies
+         move to the stories table, and the version is set
+    """
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users (email, name, admin) VALUES (?, ?, ?)",
+        [("a@example.com", "A", 0), ("a@example.com", "A again", 1), ("b@example.com", "B", 0)],
+    )
+    conn.executemany(
+        "INSERT INTO new_stories (by, id, score, time, title, url) VALUES ('t', ?, 0, 0, 't', 't')",
+        [(1,), (2,), (1,)],
+    )
+    conn.executemany(
+        "INSERT INTO story_likes (story_id, user_email, liked, disliked, title) "
+        "VALUES (?, ?, 1, 0, ?)",
+        [(1, "b@example.com", "t"), (3, "b@example.com", "Gone from the feed")],
+    )
+    conn.commit()
+
+    applied = migrate(conn)
+
+    assert len(applied) == len(MIGRATIONS)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+    users = conn.execute("SELECT id, admin FROM users WHERE email = 'a@example.com'")
+    assert users.fetchall() == [(1, 1)]
+    assert [row[0] for row in conn.execute("SELECT id FROM new_stories ORDER BY rowid")] == [1, 2]
+    counts = conn.execute("SELECT likes, dislikes FROM story_vote_counts WHERE story_id = 1")
+    assert counts.fetchone() == (1, 0)
+    stories = conn.execute("SELECT id, title FROM stories ORDER BY id")
+    assert stories.fetchall() == [(1, "t"), (3, "Gone from the feed")]
+    assert [row[1] for row in conn.execute("PRAGMA table_info(story_likes)")] == [
+        "story_id", "user_email", "liked", "disliked"
+    ]
+
+    # The counters still follow votes on the rebuilt table
+    conn.execute("UPDATE story_likes SET liked = 0, disliked = 1 WHERE story_id = 1")
+    counts = conn.execute("SELECT likes, dislikes FROM story_vote_counts WHERE story_id = 1")
+    assert counts.fetchone() == (0, 1)
+
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT admin FROM users WHERE email = ?", ("a",)
+    ).fetchall()
+    assert "users_email" in plan[0][3]
+    conn.close()
+
+
+def test_migrate_is_idempotent(tmp_path):
+    """
+    GIVEN a database that is already at the current schema version
+    WHEN the migrations are applied again
+    THEN check that nothing is applied
+    """
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    migrate(conn)
+
+    assert not migrate(conn)
+    conn.close()
+
+
+def test_schema_sql_bootstraps_current_version(tmp_path):
+    """
+    GIVEN a database created from schema.sql
+    WHEN the migrations are applied
+    THEN check that nothing is applied, that schema.sql is what the migrations produce,
+         and that the vote counter triggers are in place
+    """
+    with open(SCHEMA_PATH, encoding="utf-8") as schema_file:
+        schema = schema_file.read()
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    conn.executescript(schema)
+
+    assert not migrate(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+    assert schema == schema_script()
+
+    conn.execute(
+        "INSERT INTO story_likes (story_id, user_email, liked, disliked) "
+        "VALUES (1, 'a', 1, 0)"
+    )
+    assert conn.execute("SELECT likes, dislikes FROM story_vote_counts").fetchall() == [(1, 0)]
+    conn.close()
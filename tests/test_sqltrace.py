@@ -0,0 +1,54 @@
+"""
+Module: test_sqltrace.py
+
+This module contains unit tests for the SQL tracer in sqltrace.py.
+
+Functions:
+- test_request_trace_flags_n_plus_one: Tests that a statement repeated for different
+     ids is counted as one statement and flagged once it passes the threshold.
+- test_traced_request_header: Tests that a traced request gets the X-SQL-Trace header.
+"""
+
+import sqlite3
+from app import app
+from sqltrace import RequestTrace
+
+
+def test_request_trace_flags_n_plus_one():
+    """
+    GIVEN a connection traced with a threshold of 3
+    WHEN one query runs once per id for five ids, and another query runs once
+    THEN check that the repeated query is counted as one statement and flagged as an N+1
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE story_vote_counts (story_id INTEGER PRIMARY KEY, likes INTEGER)")
+    trace = RequestTrace(threshold=3)
+    conn.set_trace_callback(trace.record)
+
+    for story_id in range(5):
+        conn.execute(
+            "SELECT likes FROM story_vote_counts WHERE story_id = ?", (story_id,)
+        ).fetchone()
+    conn.execute("SELECT COUNT(*) FROM story_vote_counts").fetchone()
+    conn.close()
+
+    assert trace.n_plus_one() == [
+        ("SELECT likes FROM story_vote_counts WHERE story_id = ?", 5, 0.0)
+    ]
+    assert trace.summary().startswith("statements=6; distinct=2;")
+
+
+def test_traced_request_header():
+    """
+    GIVEN the application with SQL tracing enabled
+    WHEN '/newsfeed' is requested
+    THEN check that the response carries the X-SQL-Trace summary without N+1 statements
+    """
+    app.config["SQL_TRACE"] = True
+    try:
+        response = app.test_client().get("/newsfeed?page=2&limit=7")
+    finally:
+        app.config["SQL_TRACE"] = False
+
+    assert response.status_code == 200
+    assert "n_plus_one=0" in response.headers["X-SQL-Trace"]
@@ -0,0 +1,205 @@
+"""
+Module: test_votes.py
+
+This module contains unit tests for the vote counter maintenance in votes.py.
+
+Functions:
+- votes_db: A pytest fixture that creates a story_likes table with vote counters installed.
+- test_triggers_keep_counts_in_step: Tests that the counters follow inserts, updates and
+     deletes on story_likes, and agree with a full rebuild.
+- test_cast_vote: Tests that a vote is recorded, changed and counted in one call.
+- test_vote_queue: Tests that buffered votes return optimistic counts and are written
+     in one batch on flush.
+- test_vote_queue_counts_committed_batch_once: Tests that a vote submitted while a batch
+     commits counts the batch once.
+- test_vote_queue_counts_dropped_votes: Tests that buffered votes on stories that are gone
+     by the flush are counted as dropped.
+"""
+
+import sqlite3
+import threading
+import pytest
+from migrations import migrate
+from votes import VOTE_COUNTS_SCHEMA, VoteQueue, cast_vote, rebuild_vote_counts
+
+
+@pytest.fixture
+def votes_db(tmp_path):
+    """
+    Pytest fixture that creates a story_likes table with the vote counters installed.
+    """
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    conn.execute(
+        "CREATE TABLE story_likes (story_id INTEGER NOT NULL, user_email TEXT NOT NULL, "
+        "liked BOOLEAN, disliked BOOLEAN, PRIMARY KEY (story_id, user_email))"
+    )
+    conn.executescript(VOTE_COUNTS_SCHEMA)
+    yield conn
+    conn.close()
+
+
+def counts(conn):
+    """
+    Returns the vote counters as a dictionary of story id to (likes, dislikes).
+    """
+    rows = conn.execute("SELECT story_id, likes, dislikes FROM story_vote_counts")
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def test_triggers_keep_counts_in_step(votes_db):
+    """
+    GIVEN a story_likes table with vote counters installed
+    WHEN votes are cast, changed and removed
+    THEN check that the counters match the votes and a full rebuild
+    """
+    votes_db.executemany(
+        "INSERT INTO story_likes (story_id, user_email, liked, disliked) VALUES (?, ?, ?, ?)",
+        [(1, "a@example.com", 1, 0), (1, "b@example.com", 1, 0), (2, "a@example.com", 0, 1)],
+    )
+    assert counts(votes_db) == {1: (2, 0), 2: (0, 1)}
+
+    votes_db.execute(
+        "UPDATE story_likes SET liked = 0, disliked = 1 WHERE user_email = 'b@example.com'"
+    )
+    votes_db.execute("DELETE FROM story_likes WHERE story_id = 2")
+    votes_db.commit()
+    assert counts(votes_db) == {1: (1, 1), 2: (0, 0)}
+
+    rebuild_vote_counts(votes_db)
+    assert counts(votes_db) == {1: (1, 1)}
+
+
+def test_cast_vote(tmp_path):
+    """
+    GIVEN a migrated database with one story
+    WHEN users like it, one of them changes to a dislike, and a missing story is voted on
+    THEN check that each call returns the story's new counts, or None for the missing story
+    """
+    conn = sqlite3.connect(str(tmp_path / "stories.db"))
+    migrate(conn)
+    conn.execute(
+        "INSERT INTO new_stories (by, id, score, time, title, url) "
+        "VALUES ('t', 7, 1, 0, 'Seven', 'u')"
+    )
+    conn.commit()
+
+    assert cast_vote(conn, 7, "a@example.com", liked=True) == (1, 0)
+    assert cast_vote(conn, 7, "b@example.com", liked=True) == (2, 0)
+    assert cast_vote(conn, 7, "b@example.com", liked=False) == (1, 1)
+    assert cast_vote(conn, 8, "a@example.com", liked=True) is None
+
+    rows = conn.execute(
+        "SELECT user_email, liked, disliked, title FROM story_likes "
+        "JOIN stories ON stories.id = story_likes.story_id ORDER BY user_email"
+    )
+    assert rows.fetchall() == [("a@example.com", 1, 0, "Seven"), ("b@example.com", 0, 1, "Seven")]
+    assert conn.execute("SELECT COUNT(*) FROM stories").fetchone() == (1,)
+    conn.close()
+
+
+def test_vote_queue(tmp_path):
+    """
+    GIVEN a migrated database with one story, one stored like and a write-behind queue
+    WHEN votes are submitted, one user changes their vote, and the queue is flushed
+    THEN check that each submission returns the expected counts, nothing is written
+         before the flush, and the flush writes every vote
+    """
+    path = str(tmp_path / "stories.db")
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.execute(
+        "INSERT INTO new_stories (by, id, score, time, title, url) "
+        "VALUES ('t', 7, 1, 0, 'Seven', 'u')"
+    )
+    conn.commit()
+    cast_vote(conn, 7, "a@example.com", liked=True)
+
+    queue = VoteQueue(lambda: sqlite3.connect(path), flush_interval=60)
+    assert queue.submit(conn, 7, "b@example.com", liked=True) == (2, 0)
+    assert queue.submit(conn, 7, "a@example.com", liked=False) == (1, 1)
+    assert queue.submit(conn, 7, "b@example.com", liked=False) == (0, 2)
+    assert queue.submit(conn, 8, "a@example.com", liked=True) is None
+    assert conn.execute("SELECT likes, dislikes FROM story_vote_counts").fetchall() == [(1, 0)]
+
+    assert queue.flush() == 2
+    assert conn.execute("SELECT likes, dislikes FROM story_vote_counts").fetchall() == [(0, 2)]
+    assert queue.submit(conn, 7, "a@example.com", liked=True) == (1, 1)
+    queue.close()
+    assert conn.execute("SELECT likes, dislikes FROM story_vote_counts").fetchall() == [(1, 1)]
+    conn.close()
+
+
+def test_vote_queue_counts_committed_batch_once(tmp_path):
+    """
+    GIVEN a migrated database with one story and a queue holding one buffered like
+    WHEN another user likes the story from a second thread just as the batch commits
+    THEN check that the second thread gets the batch's like counted once, not twice
+    """
+    path = str(tmp_path / "stories.db")
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.execute(
+        "INSERT INTO new_stories (by, id, score, time, title, url) "
+        "VALUES ('t', 7, 1, 0, 'Seven', 'u')"
+    )
+    conn.commit()
+    voters = []
+    results = []
+
+    def submit_other_vote():
+        with sqlite3.connect(path) as other:
+            results.append(queue.submit(other, 7, "b@example.com", liked=True))
+
+    class RacingConnection(sqlite3.Connection):  # pylint: disable=too-few-public-methods
+        """
+        A connection that starts a vote in another thread when the first commit is done.
+        """
+
+        def commit(self):
+            """
+            Commits, then lets the other vote in while the queue may still be flushing.
+            """
+            super().commit()
+            if not voters:
+                voters.append(threading.Thread(target=submit_other_vote))
+                voters[0].start()
+                voters[0].join(0.2)
+
+    queue = VoteQueue(lambda: sqlite3.connect(path, factory=RacingConnection), flush_interval=60)
+    assert queue.submit(conn, 7, "a@example.com", liked=True) == (1, 0)
+    assert queue.flush() == 1
+    voters[0].join()
+    queue.close()
+
+    assert results == [(2, 0)]
+    assert conn.execute("SELECT likes, dislikes FROM story_vote_counts").fetchall() == [(2, 0)]
+    conn.close()
+
+
+def test_vote_queue_counts_dropped_votes(tmp_path):
+    """
+    GIVEN a migrated database with two stories only in new_stories and a queue
+    WHEN both are voted on and one leaves new_stories before the flush
+    THEN check that the flush writes the other vote and counts the lost one as dropped
+    """
+    path = str(tmp_path / "stories.db")
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO new_stories (by, id, score, time, title, url) "
+        "VALUES ('t', ?, 1, 0, 'Story', 'u')",
+        [(7,), (8,)],
+    )
+    conn.commit()
+
+    queue = VoteQueue(lambda: sqlite3.connect(path), flush_interval=60)
+    assert queue.submit(conn, 7, "a@example.com", liked=True) == (1, 0)
+    assert queue.submit(conn, 8, "a@example.com", liked=True) == (1, 0)
+    conn.execute("DELETE FROM new_stories WHERE id = 8")
+    conn.commit()
+
+    assert queue.flush() == 1
+    assert queue.dropped == 1
+    queue.close()
+    assert conn.execute("SELECT story_id FROM story_likes").fetchall() == [(7,)]
+    conn.close()
@@ -0,0 +1,410 @@
+"""
+Module: votes.py
+
+This module records votes on news stories and maintains their like/dislike counters.
+
+A vote row in `story_likes` only holds the story id, the user and the vote; the
+story itself lives in the persistent `stories` table, which outlives the fetcher's
+refreshes of `new_stories`. A vote is recorded in one short transaction that also
+reads back the story's new counts.
+
+Counting rows in `story_likes` on every page view gets slower as stories collect
+votes. Instead, the `story_vote_counts` table holds one row of totals per story,
+kept correct by SQLite triggers on every insert, update and delete of `story_likes`,
+so reading a story's counts is a single primary-key lookup.
+
+The table and triggers are created by the schema migrations in migrations.py.
+
+When many users vote at once, each vote's transaction waits its turn for SQLite's
+single writer lock. `VoteQueue` is an optional write-behind buffer: votes are
+acknowledged at once with optimistic counts and written in batches, one transaction
+per batch, every `VOTE_FLUSH_INTERVAL` seconds or as soon as `VOTE_FLUSH_SIZE` votes
+are waiting. Whatever is still buffered is written when the process exits, including
+on SIGTERM once `exit_on_sigterm` is installed; a process killed outright, e.g. with
+SIGKILL after a worker timeout, loses up to `VOTE_FLUSH_INTERVAL` seconds of votes.
+
+Classes:
+- VoteQueue(connect, flush_interval, max_pending): Buffers votes and writes them in
+  batches.
+
+Functions:
+- cast_vote(connection, story_id, user_email, liked): Records a like or dislike and
+  returns the story's new counts.
+- exit_on_sigterm(): Lets SIGTERM exit the process normally, so buffered votes are
+  written.
+- rebuild_vote_counts(connection): Recomputes every counter from `story_likes`.
+
+Usage:
+The counters can be rebuilt from scratch at any time, e.g. after editing
+`story_likes` with the triggers disabled.
+
+Example:
+python3 votes.py rebuild
+python3 votes.py rebuild --db /path/to/stories.db
+"""
+import argparse
+import atexit
+import logging
+import signal
+import sqlite3
+import sys
+import threading
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# Seconds between write-behind flushes, and the number of waiting votes that triggers one early
+VOTE_FLUSH_INTERVAL = 0.5
+VOTE_FLUSH_SIZE = 200
+
+VOTE_COUNTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS story_vote_counts (
+    story_id INTEGER PRIMARY KEY,
+    likes INTEGER NOT NULL DEFAULT 0,
+    dislikes INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS story_likes_count_insert AFTER INSERT ON story_likes
+BEGIN
+    INSERT INTO story_vote_counts (story_id, likes, dislikes)
+    VALUES (NEW.story_id, IFNULL(NEW.liked = True, 0), IFNULL(NEW.disliked = True, 0))
+    ON CONFLICT(story_id) DO UPDATE SET
+        likes = likes + excluded.likes,
+        dislikes = dislikes + excluded.dislikes;
+END;
+
+CREATE TRIGGER IF NOT EXISTS story_likes_count_delete AFTER DELETE ON story_likes
+BEGIN
+    UPDATE story_vote_counts
+    SET likes = likes - IFNULL(OLD.liked = True, 0),
+        dislikes = dislikes - IFNULL(OLD.disliked = True, 0)
+    WHERE story_id = OLD.story_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS story_likes_count_update
+AFTER UPDATE OF story_id, liked, disliked ON story_likes
+BEGIN
+    UPDATE story_vote_counts
+    SET likes = likes - IFNULL(OLD.liked = True, 0),
+        dislikes = dislikes - IFNULL(OLD.disliked = True, 0)
+    WHERE story_id = OLD.story_id;
+    INSERT INTO story_vote_counts (story_id, likes, dislikes)
+    VALUES (NEW.story_id, IFNULL(NEW.liked = True, 0), IFNULL(NEW.disliked = True, 0))
+    ON CONFLICT(story_id) DO UPDATE SET
+        likes = likes + excluded.likes,
+        dislikes = dislikes + excluded.dislikes;
+END;
+"""
+
+REBUILD_VOTE_COUNTS_SQL = """
+DELETE FROM story_vote_counts;
+INSERT INTO story_vote_counts (story_id, likes, dislikes)
+SELECT story_id, SUM(IFNULL(liked = True, 0)), SUM(IFNULL(disliked = True, 0))
+FROM story_likes
+GROUP BY story_id;
+"""
+
+
+# Keeps a copy of the story once it has votes; content is refreshed by the fetcher
+KEEP_STORY_SQL = """
+INSERT INTO stories (id, by, score, time, title, url, descendants, type, text)
+SELECT id, by, score, time, title, url, descendants, type, text
+FROM new_stories
+WHERE id = ?
+ON CONFLICT (id) DO NOTHING
+"""
+
+CAST_VOTE_SQL = """
+INSERT INTO story_likes (story_id, user_email, liked, disliked)
+SELECT id, ?, ?, ?
+FROM stories
+WHERE id = ?
+ON CONFLICT (story_id, user_email) DO UPDATE SET
+    liked = excluded.liked,
+    disliked = excluded.disliked
+"""
+
+
+def cast_vote(connection, story_id, user_email, liked):
+    """
+    Records a like or dislike of a story and returns the story's new counts.
+
+    The story is copied into `stories` the first time it is voted on, the vote is
+    written by a single upsert, and the counts are read back in the same short
+    transaction.
+
+    Parameters:
+    - connection (sqlite3.Connection): An open connection to the stories database.
+    - story_id (int): The id of the story being voted on.
+    - user_email (str): The email of the voting user.
+    - liked (bool): True for a like, False for a dislike.
+
+    Returns:
+    - tuple: The story's (likes, dislikes) after the vote, or None if there is no
+      story with that id.
+    """
+    with connection:
+        cursor = connection.cursor()
+        cursor.execute(KEEP_STORY_SQL, (story_id,))
+        cursor.execute(CAST_VOTE_SQL, (user_email, liked, not liked, story_id))
+        if cursor.rowcount == 0:
+            return None
+
+        cursor.execute(
+            "SELECT likes, dislikes FROM story_vote_counts WHERE story_id = ?", (story_id,)
+        )
+        return cursor.fetchone()
+
+
+def vote_deltas(previous, liked):
+    """
+    Returns how a vote changes its story's counts, given the user's earlier vote.
+
+    Parameters:
+    - previous (bool): True for an earlier like, False for a dislike, None for no vote.
+    - liked (bool): True for a like, False for a dislike.
+
+    Returns:
+    - tuple: The change in (likes, dislikes).
+    """
+    return int(liked) - int(previous is True), int(not liked) - int(previous is False)
+
+
+class VoteQueue:
+    """
+    Buffers votes in memory and writes them to the database in batches.
+
+    Each process has its own queue. A background thread writes the buffered votes in
+    one transaction every `flush_interval` seconds, or sooner once `max_pending` votes
+    are waiting; a user voting again on a story before a flush only replaces the
+    buffered vote. Counts returned to the voter add the buffered votes to the stored
+    counters, so they are optimistic until the batch is written. If a batch cannot be
+    written it is put back in the queue and retried on the next flush. A vote on a
+    story that has left both `stories` and `new_stories` by the time of the flush
+    cannot be written; it is logged and counted in `dropped` instead.
+
+    Parameters:
+    - connect (callable): Opens a new connection to the stories database.
+    - flush_interval (float): Seconds between flushes.
+    - max_pending (int): Number of waiting votes that triggers an early flush.
+    """
+
+    def __init__(self, connect, flush_interval=VOTE_FLUSH_INTERVAL, max_pending=VOTE_FLUSH_SIZE):
+        self._connect = connect
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self.dropped = 0
+        # (story_id, user_email) -> liked, for votes waiting for the next flush and
+        # for the batch being written, with each group's change to the story counts
+        self._pending = {}
+        self._pending_deltas = {}
+        self._writing = {}
+        self._writing_deltas = {}
+
+    def submit(self, connection, story_id, user_email, liked):
+        """
+        Buffers a like or dislike of a story and returns the story's expected counts.
+
+        Parameters:
+        - connection (sqlite3.Connection): A connection used to read the story, the
+          user's stored vote and the stored counts.
+        - story_id (int): The id of the story being voted on.
+        - user_email (str): The email of the voting user.
+        - liked (bool): True for a like, False for a dislike.
+
+        Returns:
+        - tuple: The story's (likes, dislikes) once the vote is written, or None if
+          there is no story with that id.
+        """
+        self._start()
+        cursor = connection.cursor()
+        key = (story_id, user_email)
+        with self._lock:
+            if key in self._pending:
+                previous = self._pending[key]
+            elif key in self._writing:
+                previous = self._writing[key]
+            else:
+                cursor.execute(
+                    "SELECT 1 FROM stories WHERE id = ? UNION ALL "
+                    "SELECT 1 FROM new_stories WHERE id = ? LIMIT 1",
+                    (story_id, story_id),
+                )
+                if cursor.fetchone() is None:
+                    return None
+                cursor.execute(
+                    "SELECT liked, disliked FROM story_likes WHERE story_id = ? AND user_email = ?",
+                    key,
+                )
+                row = cursor.fetchone()
+                previous = None if row is None else (True if row[0] else False if row[1] else None)
+
+            self._pending[key] = liked
+            like_delta, dislike_delta = vote_deltas(previous, liked)
+            pending = self._pending_deltas.get(story_id, (0, 0))
+            self._pending_deltas[story_id] = (pending[0] + like_delta, pending[1] + dislike_delta)
+
+            cursor.execute(
+                "SELECT likes, dislikes FROM story_vote_counts WHERE story_id = ?", (story_id,)
+            )
+            likes, dislikes = cursor.fetchone() or (0, 0)
+            for deltas in (self._writing_deltas, self._pending_deltas):
+                story_likes, story_dislikes = deltas.get(story_id, (0, 0))
+                likes, dislikes = likes + story_likes, dislikes + story_dislikes
+            waiting = len(self._pending)
+
+        if waiting >= self.max_pending:
+            self._wake.set()
+        return likes, dislikes
+
+    def flush(self):
+        """
+        Writes every buffered vote to the database in a single transaction.
+
+        Returns:
+        - int: The number of votes written, not counting those dropped because their
+          story is gone.
+
+        Raises:
+        - sqlite3.Error: If the batch could not be written; it stays queued.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._writing, self._pending = self._pending, {}
+                self._writing_deltas, self._pending_deltas = self._pending_deltas, {}
+                batch = self._writing
+            if not batch:
+                return 0
+
+            try:
+                with closing(self._connect()) as connection:
+                    try:
+                        connection.execute("BEGIN IMMEDIATE")
+                        connection.executemany(
+                            KEEP_STORY_SQL, [(story_id,) for story_id in {key[0] for key in batch}]
+                        )
+                        cursor = connection.executemany(
+                            CAST_VOTE_SQL,
+                            [
+                                (user_email, liked, not liked, story_id)
+                                for (story_id, user_email), liked in batch.items()
+                            ],
+                        )
+                        # Commit and drop the batch's deltas in one step, so no vote is
+                        # counted with the batch both in the stored counts and in flight
+                        with self._lock:
+                            connection.commit()
+                            self._writing, self._writing_deltas = {}, {}
+                            self.dropped += len(batch) - cursor.rowcount
+                    except sqlite3.Error:
+                        connection.rollback()
+                        raise
+            except sqlite3.Error:
+                with self._lock:
+                    # Newer votes were counted on top of this batch, so they win
+                    self._pending = {**batch, **self._pending}
+                    for story_id, (likes, dislikes) in self._writing_deltas.items():
+                        pending = self._pending_deltas.get(story_id, (0, 0))
+                        self._pending_deltas[story_id] = (pending[0] + likes, pending[1] + dislikes)
+                    self._writing, self._writing_deltas = {}, {}
+                raise
+
+            if cursor.rowcount < len(batch):
+                logger.warning(
+                    "dropped %d buffered votes on stories that are gone",
+                    len(batch) - cursor.rowcount,
+                )
+            return cursor.rowcount
+
+    def close(self):
+        """
+        Stops the background thread and writes any votes still buffered.
+        """
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _start(self):
+        """
+        Starts the background thread on first use, so it runs in the process that serves
+        requests rather than in a parent that forks workers.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vote-queue", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        """
+        Flushes the queue on every interval, or early when woken, until closed.
+        """
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # The batch is back in the queue; try again on the next interval
+                pass
+
+
+def exit_on_sigterm():
+    """
+    Makes SIGTERM exit the process normally, so `atexit` handlers such as
+    `VoteQueue.close` still write the buffered votes.
+
+    Python's default action for SIGTERM ends the process without running them, as
+    when the development server is stopped. A handler installed by someone else, e.g.
+    a gunicorn worker's graceful shutdown, already exits normally and is kept. Must be
+    called from the main thread; elsewhere it does nothing.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+
+def rebuild_vote_counts(connection):
+    """
+    Recomputes every vote counter from the rows in `story_likes`.
+
+    Runs in a single transaction, so readers never see a partially rebuilt table.
+
+    Parameters:
+    - connection (sqlite3.Connection): An open connection to the stories database.
+
+    Returns:
+    - int: The number of stories that have counters after the rebuild.
+    """
+    connection.executescript(f"BEGIN IMMEDIATE; {REBUILD_VOTE_COUNTS_SQL} COMMIT;")
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM story_vote_counts")
+    return cursor.fetchone()[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the story vote counters")
+    parser.add_argument(
+        "command", choices=["rebuild"], help="rebuild all counters from story_likes"
+    )
+    parser.add_argument("--db", default="stories.db", help="path to the stories database")
+    args = parser.parse_args()
+
+    # Imported here: migrations builds its scripts from this module's schema
+    from migrations import migrate  # pylint: disable=import-outside-toplevel
+
+    with closing(sqlite3.connect(args.db)) as db:
+        migrate(db)
+        stories = rebuild_vote_counts(db)
+    print(f"rebuilt vote counts for {stories} stories")